@@ -1,23 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 from datetime import datetime as dt
-from datetime import timedelta
 import os
 import tempfile
+import threading
 
+import cv2
 from flask import (
     Flask,
     make_response,
+    request,
 )
 from kavalkilu import (
     Hosts,
     LogWithInflux,
 )
-from moviepy.editor import VideoFileClip
 
 from servertools import (
+    CaptureService,
+    MotionHeatmap,
+    MotionZones,
     Reolink,
     SlackComm,
+    ThresholdCalibration,
     VidTools,
 )
 
@@ -27,7 +32,40 @@ vt = VidTools(fps=10, resize_perc=0.5, speed_x=5)
 app = Flask(__name__)
 
 DURATION_S = 30
+# Seconds of frames kept in memory for each camera, so clips start before the webhook fired
+PREROLL_S = 5
+# Stop recording once nothing's moved for this long. Counted from the start of the pre-roll, so keep it longer.
+IDLE_STOP_S = 10
+STREAM_FPS = 10
 CAMERA = None
+captures = {}
+camera_vts = {}
+# Held while an event is analyzed, so a camera's events don't update its detector state and heatmap at once
+camera_locks = {}
+
+
+def get_capture(camera: str) -> CaptureService:
+    """Gets the camera's capture service, starting one if it's not yet running"""
+    if camera not in captures.keys():
+        cam_ip = Hosts().get_ip_from_host(camera)
+        cam = Reolink(cam_ip, parent_log=logg)
+        captures[camera] = CaptureService(cam.open_video_stream, preroll_s=PREROLL_S, fps=STREAM_FPS, parent_log=logg)
+    return captures[camera].start()
+
+
+def get_vidtools(camera: str) -> VidTools:
+    """Gets VidTools set up with the camera's motion zones, heatmap and threshold calibration"""
+    if camera not in camera_vts.keys():
+        camera_vts[camera] = VidTools(fps=vt.fps, resize_perc=vt.resize_perc, speed_x=vt.speed_x,
+                                      motion_zones=MotionZones.for_camera(camera),
+                                      motion_heatmap=MotionHeatmap(camera),
+                                      threshold_calibration=ThresholdCalibration(camera), parent_log=logg)
+    return camera_vts[camera]
+
+
+# Start buffering the known cameras right away so their first event has a pre-roll too
+for cam_name in filter(None, os.environ.get('MOTION_CAMERAS', '').split(',')):
+    get_capture(cam_name.strip())
 
 
 @app.route('/')
@@ -39,48 +77,58 @@ def main_page():
 def detect_motion(camera: str):
     """Handle motion detection prodecures"""
     CAMERA = camera
-    raw_cam_path = os.path.join(tempfile.gettempdir(), f'{camera}-motion-raw.mp4')
-    processed_cam_path = os.path.join(tempfile.gettempdir(), f'{camera}-motion-proc.mp4')
+    # The camera's motion alert fires as the event starts, so its hour picks the calibrated threshold
+    event_dt = dt.now()
+    processed_cam_path = os.path.join(tempfile.gettempdir(), f'{camera}-motion-proc-{event_dt:%Y%m%d%H%M%S%f}.mp4')
     response = make_response('', 200)
 
     @response.call_on_close
     def process_event():
-        # Load camera live stream, for {duration}
-        cam_ip = Hosts().get_ip_from_host(camera)
-        cam = Reolink(cam_ip, parent_log=logg)
-
-        stream = cam.open_video_stream()
-        # Determine the length of time we're capturing the camera's feed
-        start_dt = dt.now()
-        end_dt = (start_dt + timedelta(seconds=DURATION_S))
-        frames = []
-        logg.debug('Recording frames...')
-        for frame in stream:
-            # Store image for later
-            frames.append(frame)
-            # Determine if we've exceeded the duration limit
-            if dt.now() > end_dt:
-                logg.debug('Time limit reached. Exiting loop.')
-                break
-        # Draw motion squares on frames
-        logg.debug('Drawing motion on frames...')
-        is_motion_detected, fpath, duration = vt.draw_on_motion(
-            fpath=raw_cam_path, frames=frames, min_area=1000, min_frames=5, threshold=25, ref_frame_turnover=20,
-            buffer_s=1, motion_frames_only=False)
+        with camera_locks.setdefault(camera, threading.Lock()):
+            # Take the buffered pre-roll, then keep recording the live stream for up to {duration}
+            capture = get_capture(camera)
+            frames = capture.iter_event(preroll_s=PREROLL_S, postroll_s=DURATION_S)
+            # Draw motion squares on frames as they arrive, resizing & speeding up in the same encoding pass
+            logg.debug('Recording and drawing motion on frames...')
+            cam_vt = get_vidtools(camera)
+            is_motion_detected, fpath, duration = cam_vt.draw_on_motion(
+                fpath=processed_cam_path, frames=frames, min_area=1000, min_frames=5, threshold=25,
+                ref_frame_turnover=20, buffer_s=1, motion_frames_only=False, streaming=True,
+                idle_stop_s=IDLE_STOP_S, resize_perc=cam_vt.resize_perc, speed_x=cam_vt.speed_x, when=event_dt)
+            cam_vt.motion_heatmap.save()
+        if not is_motion_detected:
+            logg.debug('No frames were kept. Skipping upload.')
+            return
         logg.debug(f'Received processed clip at path: {fpath}')
         # Send clip to slack
-        logg.debug('Adjusting clip for quality and speed...')
-        clip = VideoFileClip(raw_cam_path)
-        clip = (clip.resize(0.50).speedx(5))
-        clip.write_videofile(processed_cam_path)
         logg.debug('Uploading clip to slack...')
         sc.st.upload_file(sc.kaamerate_kanal, processed_cam_path, filename=f'{CAMERA} events',
                           txt='Motion detected!')
+        os.remove(processed_cam_path)
         logg.debug('Process complete!')
 
     return response
 
 
+@app.route('/heatmap/<camera>', methods=['GET'])
+def motion_heatmap(camera: str):
+    """Renders where the camera saw motion on a day (?day=yyyy-mm-dd, today by default) over its latest frame"""
+    day = request.args.get('day')
+    day = dt.strptime(day, '%Y-%m-%d').date() if day is not None else None
+    counts = get_vidtools(camera).motion_heatmap.load(day)
+    if counts is None:
+        return make_response(f'No motion heatmap for {camera}', 404)
+    background = None
+    if camera in captures.keys():
+        frames, _ = captures[camera].buffer.snapshot()
+        background = frames[-1] if len(frames) > 0 else None
+    overlay = MotionHeatmap.render(counts, background=background)
+    _, png = cv2.imencode('.png', cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+    response = make_response(png.tobytes(), 200)
+    response.headers['Content-Type'] = 'image/png'
+    return response
+
+
 @app.errorhandler(500)
 def handle_errors(error):
     return 'Not found!'
@@ -0,0 +1,469 @@
+"""Throughput benchmarks for the motion detection pieces of VidTools
+
+Usage:
+    python development/video_benchmarks.py [path/to/clip.mp4]
+
+Without a clip, a synthetic scene with a few moving blocks is used
+(640x360 for sub-stream benchmarks and 1280x720 for main-stream ones, plus a busy scene full of
+flickering leaves for the region backends),
+the decoding benchmark is skipped and an hour-long recording is generated for the keyframe triage one.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import (
+    Callable,
+    List,
+)
+
+import cv2
+from moviepy.editor import (
+    ImageSequenceClip,
+    VideoFileClip,
+)
+import numpy as np
+
+from servertools import (
+    ContourSignatureStore,
+    DecodeBackend,
+    DiffMotionDetector,
+    FFmpeg,
+    MotionDetector,
+    MotionEngine,
+    RegionBackend,
+    VideoCaptureReader,
+    VidTools,
+)
+
+
+def synthetic_frames(n_frames: int = 600, w: int = 640, h: int = 360, fps: int = 20) -> List[np.ndarray]:
+    """Static noisy background with a bright block sliding across it for a few seconds at a time"""
+    rng = np.random.default_rng(0)
+    background = (rng.random((h, w, 3)) * 60 + 80).astype(np.uint8)
+    events = [(5 * fps, 8 * fps), (15 * fps, 16 * fps), (20 * fps, 26 * fps)]
+    frames = []
+    for i in range(n_frames):
+        frame = background.copy()
+        for st, end in events:
+            if st <= i < end:
+                x = int((i - st) / (end - st) * (w - w // 8))
+                frame[h * 5 // 12:h * 2 // 3, x:x + w // 10] = 240
+        frames.append(frame)
+    return frames
+
+
+def busy_frames(n_frames: int = 300, w: int = 640, h: int = 360, n_leaves: int = 6000, leaf_size: int = 5,
+                flicker: float = 0.03, fps: int = 20) -> List[np.ndarray]:
+    """Synthetic frames with a couple of blocks sliding across a scene full of flickering
+    leaf-sized patches (think foliage in the wind or heavy rain), each too small to count as motion"""
+    rng = np.random.default_rng(0)
+    background = (rng.random((h, w, 3)) * 60 + 80).astype(np.uint8)
+    leaves = np.stack([rng.integers(0, w - leaf_size, n_leaves), rng.integers(0, h - leaf_size, n_leaves)], axis=1)
+    events = [(2 * fps, 6 * fps), (9 * fps, 12 * fps)]
+    frames = []
+    for i in range(n_frames):
+        frame = background.copy()
+        for x, y in leaves[rng.random(n_leaves) < flicker]:
+            frame[y:y + leaf_size, x:x + leaf_size] = 230
+        for st, end in events:
+            if st <= i < end:
+                x = int((i - st) / (end - st) * (w - w // 8))
+                frame[h * 5 // 12:h * 2 // 3, x:x + w // 10] = 20
+        frames.append(frame)
+    return frames
+
+
+def load_frames(fpath: str) -> List[np.ndarray]:
+    """Decodes a clip into memory so decoding isn't part of what's being timed"""
+    return [np.array(x) for x in VideoFileClip(fpath).iter_frames()]
+
+
+def time_fps(name: str, func: Callable[[List[np.ndarray]], None], frames: List[np.ndarray]) -> float:
+    """Runs the function over the frames and prints the frames per second achieved"""
+    st = time.perf_counter()
+    func(frames)
+    fps = len(frames) / (time.perf_counter() - st)
+    print(f'{name:<40} {fps:>10.1f} fps')
+    return fps
+
+
+def bench_reference_caching(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25,
+                            ref_frame_turnover: int = 20):
+    """Stateless _detect_contours (reference preprocessed every frame) vs. DiffMotionDetector"""
+    vt = VidTools()
+
+    def stateless(frms: List[np.ndarray]):
+        ref_frame = frms[0]
+        for i, frame in enumerate(frms):
+            vt._detect_contours(ref_frame, frame.copy(), min_area, threshold)
+            if i > 0 and i % ref_frame_turnover == 0:
+                ref_frame = frame
+
+    def cached(frms: List[np.ndarray]):
+        detector = DiffMotionDetector(min_area=min_area, threshold=threshold, ref_frame_turnover=ref_frame_turnover)
+        for frame in frms:
+            vt._draw_motion_boxes(detector.detect(frame), frame.copy())
+
+    print('-- Reference frame caching --')
+    before = time_fps('_detect_contours (before)', stateless, frames)
+    after = time_fps('DiffMotionDetector (after)', cached, frames)
+    print(f'{"speedup":<40} {after / before:>10.2f}x')
+
+
+def bench_proxy_detection(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25,
+                          scales: tuple = (1, 0.5, 0.25)):
+    """Full-resolution detection vs. downscaled proxies. Reports throughput and
+    how many frames' motion flags differ from the full-resolution result"""
+    flags = {}
+
+    def detect_at(scale: float) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            detector = DiffMotionDetector(min_area=min_area, threshold=threshold, scale=scale)
+            flags[scale] = [len(detector.detect(frame)) > 0 for frame in frms]
+        return _detect
+
+    print(f'-- Proxy detection ({frames[0].shape[1]}x{frames[0].shape[0]}) --')
+    base = None
+    for scale in scales:
+        fps = time_fps(f'scale={scale}', detect_at(scale), frames)
+        base = fps if base is None else base
+        mismatched = sum(a != b for a, b in zip(flags[scales[0]], flags[scale]))
+        print(f'{"":<40} {fps / base:>10.2f}x, {mismatched} frame flags differ, '
+              f'{sum(flags[scale])} motion frames')
+
+
+def bench_parallel_detection(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25,
+                             workers: int = max(os.cpu_count(), 2)):
+    """Single-process detection vs. chunked detection in a process pool"""
+    results = {}
+
+    def detect_with(n_workers: int) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            vt = VidTools(workers=n_workers)
+            results[n_workers] = [boxes for _, boxes in vt._iter_motion_boxes(frms, min_area, threshold)]
+        return _detect
+
+    print(f'-- Parallel detection ({workers} workers) --')
+    before = time_fps('workers=1', detect_with(1), frames)
+    after = time_fps(f'workers={workers}', detect_with(workers), frames)
+    print(f'{"speedup":<40} {after / before:>10.2f}x, identical results: {results[1] == results[workers]}')
+
+
+def bench_motion_engines(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25):
+    """Compares the motion engines against the stateless _detect_contours path they replace"""
+    vt = VidTools()
+
+    def stateless(frms: List[np.ndarray]):
+        ref_frame = frms[0]
+        for i, frame in enumerate(frms):
+            vt._detect_contours(ref_frame, frame.copy(), min_area, threshold)
+            if i > 0 and i % 20 == 0:
+                ref_frame = frame
+
+    n_motion = {}
+
+    def detect_with(engine: str) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            engine_vt = VidTools(motion_engine=engine)
+            boxes = engine_vt._iter_motion_boxes(frms, min_area, threshold)
+            n_motion[engine] = sum(len(frame_boxes) > 0 for _, frame_boxes in boxes)
+        return _detect
+
+    print('-- Motion engines --')
+    base = time_fps('_detect_contours (existing path)', stateless, frames)
+    for engine in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG, MotionEngine.MOG2, MotionEngine.KNN]:
+        fps = time_fps(engine, detect_with(engine), frames)
+        print(f'{"":<40} {fps / base:>10.2f}x vs. existing path, {n_motion[engine]} motion frames')
+
+
+def bench_region_backends(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25):
+    """findContours + a contourArea/boundingRect loop vs. connectedComponentsWithStats, both on the
+    region extraction step alone (masks precomputed) and end to end through the detector"""
+    mask_detector = DiffMotionDetector(min_area=min_area, threshold=threshold)
+    masks = []
+    for frame in frames:
+        masks.append(mask_detector.get_motion_mask(frame))
+        mask_detector.n_frames += 1
+    n_regions = sum(len(MotionDetector.find_contours(mask)) for mask in masks) / len(masks)
+    results = {}
+
+    def extract_with(backend: str) -> Callable[[List[np.ndarray]], None]:
+        def _extract(msks: List[np.ndarray]):
+            find_regions = MotionDetector.component_regions if backend == RegionBackend.COMPONENTS else \
+                MotionDetector.contour_regions
+            for mask in msks:
+                find_regions(mask, min_area)
+        return _extract
+
+    def detect_with(backend: str) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            detector = DiffMotionDetector(min_area=min_area, threshold=threshold, region_backend=backend)
+            results[backend] = [len(detector.detect(frame)) > 0 for frame in frms]
+        return _detect
+
+    print(f'-- Region backends ({n_regions:.0f} regions per mask) --')
+    before = time_fps('contours (mask -> boxes)', extract_with(RegionBackend.CONTOURS), masks)
+    after = time_fps('components (mask -> boxes)', extract_with(RegionBackend.COMPONENTS), masks)
+    print(f'{"speedup":<40} {after / before:>10.2f}x')
+    before = time_fps('contours (end to end)', detect_with(RegionBackend.CONTOURS), frames)
+    after = time_fps('components (end to end)', detect_with(RegionBackend.COMPONENTS), frames)
+    mismatched = sum(a != b for a, b in zip(results[RegionBackend.CONTOURS], results[RegionBackend.COMPONENTS]))
+    print(f'{"speedup":<40} {after / before:>10.2f}x, {mismatched} frame flags differ, '
+          f'{sum(results[RegionBackend.CONTOURS])} motion frames')
+
+
+def bench_block_prefilter(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25,
+                          blocks: tuple = (16, 32)):
+    """Full detection on every frame vs. skipping the frames whose block-averaged difference stays
+    under threshold. Reports the share of frames skipped, the time saved per frame and
+    how many frames' motion flags differ from the unfiltered result"""
+    flags = {}
+    skip_rates = {}
+
+    def detect_with(block: int = None) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            detector = DiffMotionDetector(min_area=min_area, threshold=threshold, prefilter_block=block)
+            flags[block] = [len(detector.detect(frame)) > 0 for frame in frms]
+            skip_rates[block] = detector.prefilter_rate
+        return _detect
+
+    print(f'-- Block prefilter ({frames[0].shape[1]}x{frames[0].shape[0]}) --')
+    before = time_fps('no prefilter', detect_with(), frames)
+    for block in blocks:
+        after = time_fps(f'prefilter_block={block}', detect_with(block), frames)
+        mismatched = sum(a != b for a, b in zip(flags[None], flags[block]))
+        print(f'{"":<40} {after / before:>10.2f}x, {skip_rates[block]:.0%} of frames skipped, '
+              f'{1000 / before - 1000 / after:.2f} ms saved per frame, {mismatched} frame flags differ')
+
+
+def bench_frame_sink(frames: List[np.ndarray], fps: int = 20):
+    """ImageSequenceClip.write_videofile (the previous write path) vs. streaming frames to a FrameSink"""
+    fpath = os.path.join(tempfile.gettempdir(), 'frame_sink_bench.mp4')
+
+    def image_sequence(frms: List[np.ndarray]):
+        ImageSequenceClip(frms, fps=fps).write_videofile(fpath, codec='libx264', fps=fps, logger=None)
+
+    def frame_sink_with(preset: str) -> Callable[[List[np.ndarray]], None]:
+        def _write(frms: List[np.ndarray]):
+            VidTools(fps=fps, preset=preset).write_frames(iter(frms), fpath)
+        return _write
+
+    print('-- Frame writing --')
+    base = time_fps('ImageSequenceClip (before)', image_sequence, frames)
+    for preset in ['medium', 'veryfast', 'ultrafast']:
+        fps_achieved = time_fps(f'FrameSink preset={preset}', frame_sink_with(preset), frames)
+        print(f'{"":<40} {fps_achieved / base:>10.2f}x, {os.path.getsize(fpath) / 1e6:.2f} MB')
+    os.remove(fpath)
+
+
+def bench_segment_encoding(frames: List[np.ndarray], n_segments: int = 4, fps: int = 20,
+                           workers: int = max(os.cpu_count(), 2)):
+    """Encoding disjoint motion segments one after another into a single sink vs. concurrently
+    into separate files that are then joined with a stream copy"""
+    fpath = os.path.join(tempfile.gettempdir(), 'segment_bench.mp4')
+    seg_len = len(frames) // n_segments
+    segments = [[i * seg_len, (i + 1) * seg_len - 1] for i in range(n_segments)]
+
+    def serial(frms: List[np.ndarray]):
+        vt = VidTools(fps=fps)
+        with vt.open_frame_sink(fpath, size=(frms[0].shape[1], frms[0].shape[0])) as sink:
+            for start, end in segments:
+                for frame in frms[start:end + 1]:
+                    sink.write(frame)
+
+    def parallel(frms: List[np.ndarray]):
+        VidTools(fps=fps, workers=workers)._encode_segments(frms, segments, fpath, fps)
+
+    print(f'-- Segment encoding ({n_segments} segments, {workers} workers) --')
+    base = time_fps('single sink (before)', serial, frames)
+    fps_achieved = time_fps('parallel segments + concat copy', parallel, frames)
+    print(f'{"speedup":<40} {fps_achieved / base:>10.2f}x')
+    os.remove(fpath)
+
+
+def bench_strided_detection(frames: List[np.ndarray], min_area: int = 500, threshold: int = 25,
+                            strides: tuple = (1, 5, 10, 20), min_frames: int = 20, fps: int = 20):
+    """Exhaustive scan vs. the coarse-to-fine stride scan. Reports throughput, how many frames' motion flags
+    differ from the exhaustive scan and whether the sequences draw_on_motion would keep are the same"""
+    vt = VidTools(fps=fps)
+    flags = {}
+
+    def detect_with(stride: int) -> Callable[[List[np.ndarray]], None]:
+        def _detect(frms: List[np.ndarray]):
+            boxes = vt._iter_motion_boxes(frms, min_area, threshold, stride=stride)
+            flags[stride] = [len(frame_boxes) > 0 for _, frame_boxes in boxes]
+        return _detect
+
+    def kept_sequences(frame_flags: List[bool]) -> List[tuple]:
+        keep_frames = [i for i, flag in enumerate(frame_flags) if flag]
+        return [(st, end) for st, end in vt._build_sequences(keep_frames, fps) if end - st >= min_frames]
+
+    print('-- Strided (coarse-to-fine) detection --')
+    base = None
+    for stride in strides:
+        fps_achieved = time_fps(f'stride={stride}', detect_with(stride), frames)
+        base = fps_achieved if base is None else base
+        mismatched = sum(a != b for a, b in zip(flags[strides[0]], flags[stride]))
+        same_sequences = kept_sequences(flags[strides[0]]) == kept_sequences(flags[stride])
+        print(f'{"":<40} {fps_achieved / base:>10.2f}x, {mismatched} frame flags differ, '
+              f'same sequences: {same_sequences}')
+
+
+def bench_unique_contours(n_contours: int = 3000, contour_lim: float = 0.002, w: int = 1280, h: int = 720):
+    """List of contours checked one by one with cv2.matchShapes vs. ContourSignatureStore,
+    over a stream of random contours. Reports throughput and how often the two disagree"""
+    rng = np.random.default_rng(0)
+    contours = [cv2.convexHull((rng.random((8, 2)) * 120 + rng.random(2) * [w - 120, h - 120]).astype(np.int32))
+                for _ in range(n_contours)]
+    verdicts = {}
+
+    def match_shapes(cnts: List[np.ndarray]):
+        unique_cnts = []
+        verdicts['list'] = []
+        for cnt in cnts:
+            is_unique = all(cv2.matchShapes(cnt, ucnt, 1, 0.0) > contour_lim for ucnt in unique_cnts)
+            if is_unique:
+                unique_cnts.append(cnt)
+            verdicts['list'].append(is_unique)
+
+    def signature_store_with(max_signatures: int, search_radius: int) -> Callable[[List[np.ndarray]], None]:
+        def _check(cnts: List[np.ndarray]):
+            store = ContourSignatureStore(max_signatures=max_signatures, search_radius=search_radius)
+            verdicts['store'] = [store.add_if_unique(cnt, contour_lim) for cnt in cnts]
+        return _check
+
+    print(f'-- Unique contour matching ({n_contours} contours) --')
+    base = time_fps('matchShapes over a list (before)', match_shapes, contours)
+    for max_signatures, search_radius in [(n_contours, None), (n_contours, 1), (500, 1)]:
+        name = f'store cap={max_signatures}, radius={search_radius}'
+        fps = time_fps(name, signature_store_with(max_signatures, search_radius), contours)
+        disagree = sum(a != b for a, b in zip(verdicts['list'], verdicts['store']))
+        print(f'{"":<40} {fps / base:>10.2f}x, {disagree} verdicts differ')
+
+
+def bench_decode_backends(fpath: str):
+    """moviepy's ffmpeg pipe vs. cv2.VideoCapture, with and without a reused buffer and frame skipping.
+    Decoding is the work being timed here, so throughput is in frames of the source file per second"""
+    n_source_frames = VideoCaptureReader(fpath).n_frames
+
+    def decode_with(backend: str, reuse_buffer: bool = False, skip: int = 1) -> Callable[[List[np.ndarray]], None]:
+        def _decode(_):
+            vt = VidTools(decode_backend=backend, decode_skip=skip)
+            frames, _ = vt.read_frames(fpath, reuse_buffer=reuse_buffer)
+            for frame in frames:
+                # Touch the frame like a detector would
+                frame[::64, ::64].sum()
+        return _decode
+
+    print(f'-- Decoding ({os.path.basename(fpath)}) --')
+    placeholder = [None] * n_source_frames
+    base = time_fps('moviepy (before)', decode_with(DecodeBackend.MOVIEPY), placeholder)
+    for name, args in [('opencv', (False, 1)), ('opencv, reused buffer', (True, 1)),
+                       ('opencv, reused buffer, skip=2', (True, 2)), ('moviepy, skip=2', (False, 2))]:
+        backend = DecodeBackend.MOVIEPY if name.startswith('moviepy') else DecodeBackend.OPENCV
+        fps = time_fps(name, decode_with(backend, *args), placeholder)
+        print(f'{"":<40} {fps / base:>10.2f}x')
+
+
+def bench_shared_frames(fpath: str, min_area: int = 500, threshold: int = 25, workers: int = max(os.cpu_count(), 2)):
+    """Decoding and detecting a file: in one process, with frames pickled over to a process pool,
+    and with a decoder process handing frames to the pool through shared memory.
+    Throughput is in frames of the file per second, decoding included"""
+    n_frames = VideoCaptureReader(fpath).n_frames
+    results = {}
+
+    def detect_with(n_workers: int, shared: bool) -> Callable[[List[np.ndarray]], None]:
+        def _detect(_):
+            vt = VidTools(workers=n_workers, decode_backend=DecodeBackend.OPENCV, shared_frames=shared)
+            if shared:
+                regions = vt._iter_shared_motion_regions(fpath, min_area, threshold)
+            else:
+                frames, _ = vt.read_frames(fpath, reuse_buffer=vt._can_reuse_buffer())
+                regions = ((boxes, areas) for _, boxes, areas in vt._iter_motion_regions(frames, min_area, threshold))
+            results[(n_workers, shared)] = [boxes for boxes, _ in regions]
+        return _detect
+
+    print(f'-- Shared-memory frames ({os.path.basename(fpath)}, {workers} workers) --')
+    placeholder = [None] * n_frames
+    base = time_fps('workers=1', detect_with(1, False), placeholder)
+    pickled = time_fps(f'workers={workers}, pickled frames', detect_with(workers, False), placeholder)
+    shared = time_fps(f'workers={workers}, shared memory', detect_with(workers, True), placeholder)
+    print(f'{"speedup (pickled, shared)":<40} {pickled / base:>10.2f}x {shared / base:>10.2f}x, '
+          f'identical results: {results[(1, False)] == results[(workers, True)]}')
+
+
+def long_recording(fpath: str, minutes: float = 60, fps: int = 20, keyint_s: float = 2, event_every_s: int = 300,
+                   event_s: int = 10) -> str:
+    """Generates a multi-hour-style camera recording with ffmpeg: a static noisy scene, keyframes every
+    keyint_s, and a block crossing the frame for event_s seconds every event_every_s seconds"""
+    scene = (f'color=c=0x707070:s=640x360:r={fps},noise=alls=8,loop=loop=-1:size=1:start=0[bg];'
+             f'color=c=white:s=40x60:r={fps}[block];'
+             f'[bg][block]overlay=x=\'mod(t*40,600)\':y=140:enable=\'lt(mod(t,{event_every_s}),{event_s})\'')
+    subprocess.run([FFmpeg.binary(), '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', scene,
+                    '-t', str(minutes * 60), '-vcodec', 'libx264', '-preset', 'ultrafast',
+                    '-g', str(int(keyint_s * fps)), '-pix_fmt', 'yuv420p', fpath], check=True)
+    return fpath
+
+
+def bench_keyframe_triage(fpath: str = None, minutes: float = 60, min_area: int = 500, threshold: int = 25):
+    """Full-rate streaming detection of a long recording vs. a keyframe-only scan that hands only the
+    changed GOPs to the full-rate detector. Throughput is in frames of the recording per second"""
+    made_fixture = fpath is None
+    if made_fixture:
+        fpath = long_recording(os.path.join(tempfile.gettempdir(), 'triage_bench.mp4'), minutes=minutes)
+    n_frames = VideoCaptureReader(fpath).n_frames
+    out_fpath = os.path.join(tempfile.gettempdir(), 'triage_bench_out.mp4')
+    results = {}
+
+    def draw_with(triage: bool) -> Callable[[List[np.ndarray]], None]:
+        def _draw(_):
+            vt = VidTools(decode_backend=DecodeBackend.OPENCV, preset='ultrafast')
+            # draw_on_motion replaces its input, so work on a copy
+            shutil.copyfile(fpath, out_fpath)
+            results[triage] = vt.draw_on_motion(out_fpath, min_area=min_area, min_frames=10,
+                                                threshold=threshold, buffer_s=1, streaming=True,
+                                                keyframe_triage=triage)
+        return _draw
+
+    print(f'-- Keyframe triage ({os.path.basename(fpath)}, {n_frames} frames) --')
+    placeholder = [None] * n_frames
+    base = time_fps('every frame (before)', draw_with(False), placeholder)
+    fps = time_fps('keyframe triage', draw_with(True), placeholder)
+    print(f'{"speedup":<40} {fps / base:>10.2f}x, motion kept (s): '
+          f'{results[False][2] or 0:.1f} vs. {results[True][2] or 0:.1f}')
+    os.remove(out_fpath)
+    if made_fixture:
+        os.remove(fpath)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        test_frames = main_frames = load_frames(sys.argv[1])
+    else:
+        test_frames = synthetic_frames()
+        main_frames = synthetic_frames(n_frames=300, w=1280, h=720)
+    bench_reference_caching(test_frames)
+    bench_proxy_detection(main_frames)
+    bench_parallel_detection(test_frames)
+    bench_motion_engines(test_frames)
+    bench_region_backends(busy_frames())
+    bench_region_backends(test_frames)
+    bench_block_prefilter(test_frames)
+    bench_block_prefilter(main_frames)
+    bench_frame_sink(test_frames)
+    bench_segment_encoding(test_frames)
+    bench_strided_detection(test_frames)
+    bench_unique_contours()
+    if len(sys.argv) > 1:
+        bench_decode_backends(sys.argv[1])
+        bench_shared_frames(sys.argv[1])
+        bench_keyframe_triage(sys.argv[1])
+    else:
+        synthetic_fpath = os.path.join(tempfile.gettempdir(), 'bench_synthetic.mp4')
+        VidTools(fps=20).write_frames(test_frames, synthetic_fpath)
+        bench_shared_frames(synthetic_fpath)
+        os.remove(synthetic_fpath)
+        bench_keyframe_triage()
@@ -1,5 +1,6 @@
 from datetime import datetime as dt
 from datetime import timedelta
+import os
 import tempfile
 
 from easylogger import ArgParse
@@ -10,7 +11,11 @@ from kavalkilu import (
 
 from servertools import (
     Amcrest,
+    MotionHeatmap,
+    MotionResultCache,
+    MotionZones,
     SlackComm,
+    ThresholdCalibration,
     VidTools,
 )
 
@@ -30,18 +35,30 @@ args = [
             'action': 'store',
             'default': '60'
         }
+    }, {
+        'names': ['--clip'],
+        'other': {
+            'action': 'store_true',
+            'help': 'upload the full clip instead of a contact sheet and GIF'
+        }
     }
 ]
 ap = ArgParse(args, parse_all=False)
 CAMERA = ap.arg_dict.get('camera')
 INTERVAL_MINS = int(ap.arg_dict.get('interval'))
+FULL_CLIP = ap.arg_dict.get('clip', False)
 start_dt = (dt.now() - timedelta(minutes=INTERVAL_MINS)).replace(second=0, microsecond=0)
 end_dt = (start_dt + timedelta(minutes=INTERVAL_MINS))
+# Size and playing time the uploaded clip is fit into
+UPLOAD_MAX_BYTES = 20 * 2 ** 20
+UPLOAD_MAX_S = 180
 
 
 cam_ip = Hosts().get_ip_from_host(CAMERA)
 cam = Amcrest(cam_ip)
-vt = VidTools(640, 360, resize_perc=0.5, speed_x=5)
+vt = VidTools(640, 360, resize_perc=0.5, speed_x=5, motion_zones=MotionZones.for_camera(CAMERA),
+              result_cache=MotionResultCache(), motion_heatmap=MotionHeatmap(CAMERA),
+              threshold_calibration=ThresholdCalibration(CAMERA), parent_log=logg)
 
 temp_dir = tempfile.gettempdir()
 motion_logs = cam.get_motion_log(start_dt, end_dt)
@@ -50,6 +67,9 @@ logg.info(f'Found {len(motion_logs)} motion events for the range selected.')
 buffer = 30  # give the clips an x second buffer before and after motion was detected
 
 already_downloaded = []
+triaged = {}    # Changed keyframe intervals of each downloaded file
+detected = set()    # Downloaded files already run through detection (--clip)
+event_windows = {}  # Seconds of each downloaded file the events span
 files = []
 for mlog in motion_logs:
     start = mlog['start'] - timedelta(seconds=buffer)
@@ -72,25 +92,78 @@ for mlog in motion_logs:
 
     filepaths = list(sorted(set([x['path'] for x in already_downloaded
                                  if x['start'] < start < x['end'] or x['start'] < end < x['end']])))
-    # Clip & combine the video files, save to temp file
-    logg.debug('Clipping video files and combining them...')
-    fpath = vt.make_clip_from_filenames(start, end, filepaths, trim_files=True,
-                                        prefix=f'{CAMERA}_motion')
-    # Draw rectangles over the motion zones
-    logg.debug('Detecting motion in downloaded video file...')
-    upload, fpath = vt.draw_on_motion(fpath, min_area=500, min_frames=2, threshold=20)
-    if upload:
-        logg.debug('File is significant... Adding to list.')
-        # We have some motion to upload!
-        # Add to list of filepaths to be uploaded in bulk
-        files.append(fpath)
+    downloads = {x['path']: x for x in already_downloaded}
+    if FULL_CLIP:
+        # Only the keyframe intervals that changed in the raw downloads are decoded and run through detection,
+        #   which resizes and speeds up what's kept as it's written. Detection runs at the source's frame rate
+        #   and size, so the frame and area thresholds are scaled up to match.
+        logg.debug('Detecting motion in downloaded video files...')
+        for path in filepaths:
+            if path in detected:
+                continue
+            detected.add(path)
+            upload, fpath, _ = vt.draw_on_motion(
+                path, min_area=int(500 / vt.resize_perc ** 2), min_frames=2 * vt.speed_x, threshold=20,
+                ref_frame_turnover=20 * vt.speed_x, buffer_s=vt.speed_x, resize_perc=vt.resize_perc,
+                speed_x=vt.speed_x, keyframe_triage=True, when=downloads[path]['start'])
+            if upload:
+                logg.debug('File is significant... Adding to list.')
+                # Add to list of filepaths to be uploaded in bulk
+                files.append(fpath)
+        continue
+    # Triage the downloads by keyframe, skipping events where nothing changed
+    for path in filepaths:
+        if path not in triaged:
+            triaged[path] = vt.find_changed_gops(path, min_area=int(500 / vt.resize_perc ** 2), threshold=20)
+    if not any(len(triaged[path]) > 0 for path in filepaths):
+        logg.debug('No keyframe changes in the downloaded files. Skipping.')
+        continue
+    # All events are summarized together below, straight from the downloads
+    for path in filepaths:
+        dl_start, dl_end = downloads[path]['start'], downloads[path]['end']
+        event_windows.setdefault(path, []).append(
+            (max((start - dl_start).total_seconds(), 0), (min(end, dl_end) - dl_start).total_seconds()))
 
-if len(files) > 0:
+if not FULL_CLIP:
+    # Post the peak frame of each motion sequence rather than the video itself. The cuts are the changed
+    #   keyframe intervals within the events' windows, so nothing gets encoded. Frame counts, seconds and
+    #   areas are in the downloads' frame rate and size, as with --clip.
+    cuts = []
+    for path in sorted(event_windows):
+        windows = []
+        for win_start, win_end in sorted(event_windows[path]):
+            if len(windows) > 0 and win_start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], win_end)
+            else:
+                windows.append([win_start, win_end])
+        cuts += [(path, max(gop_start, win_start), min(gop_end, win_end))
+                 for win_start, win_end in windows for gop_start, gop_end in triaged[path]
+                 if gop_start < win_end and win_start < gop_end]
+    logg.debug(f'Summarizing motion in {len(cuts)} cuts of the downloaded video files...')
+    sheet, gif = None, None
+    if len(cuts) > 0:
+        sheet, gif = vt.summarize_motion(
+            cuts, os.path.join(temp_dir, f'{CAMERA}_motion.jpg'),
+            gif_fpath=os.path.join(temp_dir, f'{CAMERA}_motion.gif'), min_area=int(500 / vt.resize_perc ** 2),
+            min_frames=2 * vt.speed_x, threshold=20, ref_frame_turnover=20 * vt.speed_x, buffer_s=vt.speed_x,
+            when=min(x['start'] for x in already_downloaded if x['path'] == cuts[0][0]))
+    if sheet is not None:
+        logg.info('Uploading motion summary to channel')
+        msg = f'Motion from {len(motion_logs)} motion events detected from {start_dt:%T} to {end_dt:%T}'
+        sc.st.upload_file('kaamerad', sheet, msg)
+        sc.st.upload_file('kaamerad', gif, f'{CAMERA} motion preview')
+    else:
+        logg.info('No significant motion detected during this time interval')
+elif len(files) > 0:
     logg.info(f'Uploading {len(files)} vids to channel')
     msg = f'{len(files)} clips out of {len(motion_logs)} motion events detected from {start_dt:%T} to {end_dt:%T}'
     file = vt.concat_files(files)
+    # Keep the upload's size and length predictable
+    file, _ = vt.fit_to_budget(file, max_bytes=UPLOAD_MAX_BYTES, max_duration_s=UPLOAD_MAX_S)
     sc.st.upload_file('kaamerad', file, msg)
 else:
     logg.info('No significant motion detected during this time interval')
 
+# Fold this run's motion into the camera's heatmap for the day
+vt.motion_heatmap.save()
 logg.close()
@@ -9,11 +9,14 @@ from kavalkilu import (
     Hosts,
     LogWithInflux,
 )
-from moviepy.editor import VideoFileClip
 
 from servertools import (
+    MotionHeatmap,
+    MotionResultCache,
+    MotionZones,
     Reolink,
     SlackComm,
+    ThresholdCalibration,
     VidTools,
 )
 
@@ -33,13 +36,23 @@ args = [
             'action': 'store',
             'default': '60'
         }
+    }, {
+        'names': ['--clip'],
+        'other': {
+            'action': 'store_true',
+            'help': 'upload the full clip instead of a contact sheet and GIF'
+        }
     }
 ]
 ap = ArgParse(args, parse_all=False)
 CAMERA = ap.arg_dict.get('camera')
 INTERVAL_MINS = int(ap.arg_dict.get('interval'))
+FULL_CLIP = ap.arg_dict.get('clip', False)
 start_dt = (dt.now() - timedelta(minutes=INTERVAL_MINS)).replace(second=0, microsecond=0)
 end_dt = (start_dt + timedelta(minutes=INTERVAL_MINS))
+# Size and playing time the uploaded clip is fit into
+UPLOAD_MAX_BYTES = 20 * 2 ** 20
+UPLOAD_MAX_S = 180
 
 cam_ip = Hosts().get_ip_from_host(CAMERA)
 cam = Reolink(cam_ip, parent_log=logg)
@@ -48,57 +61,74 @@ stream = 'sub'
 # Get dimensions of substream
 dims = cam.get_dimensions(stream)
 logg.debug(f'Video dimensions set to {dims[0]}x{dims[1]}')
-vt = VidTools(*dims, resize_perc=1, speed_x=6)
+vt = VidTools(*dims, resize_perc=1, speed_x=6, motion_zones=MotionZones.for_camera(CAMERA),
+              result_cache=MotionResultCache(), motion_heatmap=MotionHeatmap(CAMERA),
+              threshold_calibration=ThresholdCalibration(CAMERA), parent_log=logg)
 
 temp_dir = tempfile.gettempdir()
 motion_files = cam.get_motion_files(start=start_dt, end=end_dt, streamtype=stream)
 logg.info(f'Found {len(motion_files)} motion events for the range selected.')
 
-already_downloaded = []
-processed_files = []
-durations = []
-last_motion_end = None
+downloaded_files = []
 for mlog in motion_files:
     start = mlog['start']
     end = mlog['end']
     logg.info(f'Found motion timerange from {start:%a}: {start:%T} to {end:%T}.')
-    # Search if the time range falls in one of the ranges that were already downloaded
     out_path = os.path.join(temp_dir, mlog['filename'])
     logg.debug('Attempting to download motion file')
     if not cam.get_file(mlog['filename'], out_path):
         logg.warning('Download unsuccessful!')
         continue
-    if last_motion_end is not None:
-        if start < last_motion_end:
-            # Start of this motion event began before the last motion event ended
-            #   Adjust the length of the current motion event.
-            seconds_from_start = (last_motion_end - start).total_seconds()
-            logg.debug(f'Clip overlap detected. Clipping current video by {seconds_from_start} seconds.')
-            clip = VideoFileClip(out_path)
-            clip = clip.subclip(t_start=seconds_from_start)
-            clip.write_videofile(out_path)
-    processed_files.append(out_path)
-    last_motion_end = end
+    downloaded_files.append({'fpath': out_path, 'start': start, 'end': end})
+
+# Merge the overlapping time ranges into one cut list
+cuts = vt.plan_cuts(downloaded_files)
+logg.debug(f'Planned {len(cuts)} cuts from {len(downloaded_files)} files.')
+# The cuts are in time order, so this is when the first one starts
+clip_start = min([x['start'] for x in downloaded_files], default=None)
 
-if len(motion_files) > 0:
-    # Clip & combine the video files, save to temp file
-    logg.debug('Clipping video files and combining them...')
-    fpath = vt.make_clip_from_filenames(motion_files[0]['start'], motion_files[-1]['end'], processed_files,
-                                        trim_files=False, prefix=f'{CAMERA}_motion')
-    # Draw rectangles over the motion zones
-    logg.debug('Detecting motion in downloaded video file...')
-    upload, fpath, duration = vt.draw_on_motion(fpath, min_area=500, min_frames=20, threshold=20,
-                                                ref_frame_turnover=20, buffer_s=0.2)
+if len(downloaded_files) > 0 and not FULL_CLIP:
+    # Post the peak frame of each motion sequence rather than the video itself.
+    #   Frame counts and seconds are in source time (see the clip below).
+    logg.debug('Summarizing motion in downloaded video files...')
+    sheet, gif = vt.summarize_motion(
+        cuts, os.path.join(temp_dir, f'{CAMERA}_motion.jpg'),
+        gif_fpath=os.path.join(temp_dir, f'{CAMERA}_motion.gif'), min_area=500, min_frames=20 * vt.speed_x,
+        threshold=20, ref_frame_turnover=20 * vt.speed_x, buffer_s=0.2 * vt.speed_x, stride=5, when=clip_start)
+    if sheet is not None:
+        logg.info('Uploading motion summary to channel')
+        msg = f'*`{CAMERA}`*: motion from *`{len(motion_files)}`* motion events ' \
+              f'detected from `{start_dt:%H:%M}` to `{end_dt:%H:%M}`'
+        sc.st.upload_file('kaamerad', sheet, filename=f'{CAMERA} events', txt=msg)
+        sc.st.upload_file('kaamerad', gif, filename=f'{CAMERA} preview', txt='')
+    else:
+        logg.info('No significant motion detected during this time interval')
+elif len(downloaded_files) > 0:
+    # Decode each cut once, drawing rectangles over the motion zones & speeding up in a single encode
+    logg.debug('Detecting motion in downloaded video files...')
+    fpath = os.path.join(temp_dir, f'{CAMERA}_motion_{downloaded_files[0]["start"]:%T}_to_'
+                                   f'{downloaded_files[-1]["end"]:%T}.mp4')
+    # Detection now runs before the speed-up, so frame counts (incl. the reference turnover) and seconds
+    #   are in source time, scaled by speed_x to cover the same footage as when it ran after.
+    #   The upload's size and length are budgeted for ahead of the encode, so it's only encoded once.
+    upload, fpath, duration = vt.draw_on_motion_from_cuts(
+        cuts, fpath, min_area=500, min_frames=20 * vt.speed_x, threshold=20, ref_frame_turnover=20 * vt.speed_x,
+        buffer_s=0.2 * vt.speed_x, stride=5, when=clip_start, max_bytes=UPLOAD_MAX_BYTES,
+        max_duration_s=UPLOAD_MAX_S)
     if upload:
+        if os.path.getsize(fpath) > UPLOAD_MAX_BYTES:
+            # The estimate was off. Only then is it worth another encode.
+            fpath, _ = vt.fit_to_budget(fpath, max_bytes=UPLOAD_MAX_BYTES, max_duration_s=UPLOAD_MAX_S)
         logg.info('Uploading vid to channel')
         mins = duration / 60
         secs = mins % 1 * 60
-        msg = f'*`{CAMERA}`*: *`{len(processed_files)}`* clips out of *`{len(motion_files)}`* motion events ' \
+        msg = f'*`{CAMERA}`*: *`{len(cuts)}`* clips out of *`{len(motion_files)}`* motion events ' \
               f'detected from `{start_dt:%H:%M}` to `{end_dt:%H:%M}`\n\t ' \
               f'Total duration: *`{math.floor(mins):.0f}m{secs:.0f}s`*'
-        file = vt.concat_files([fpath])
-        sc.st.upload_file('kaamerad', file, filename=f'{CAMERA} events', txt=msg)
+        sc.st.upload_file('kaamerad', fpath, filename=f'{CAMERA} events', txt=msg)
 else:
     logg.info('No significant motion detected during this time interval')
 
+# Fold this run's motion into the camera's heatmap for the day
+vt.motion_heatmap.save()
 logg.close()
@@ -2,17 +2,44 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
 
+from .cache import MotionResultCache
 from .camera import (
     Amcrest,
     Reolink,
 )
+from .capture import (
+    CaptureService,
+    FrameRingBuffer,
+)
+from .decode import (
+    DecodeBackend,
+    VideoCaptureReader,
+)
+from .ffmpeg import (
+    FFmpeg,
+    FrameSink,
+)
 from .gif import (
     GIF,
     GIFSlice,
     GIFTile,
 )
 from .message import Email
+from .motion import (
+    BackgroundSubtractorMotionDetector,
+    ContourSignatureStore,
+    DiffMotionDetector,
+    MotionDetector,
+    MotionEngine,
+    MotionHeatmap,
+    MotionIndex,
+    MotionZones,
+    RegionBackend,
+    RunningAverageMotionDetector,
+    ThresholdCalibration,
+)
 from .openwrt import OpenWRT
+from .pipeline import SharedFrameRing
 from .plants import (
     Plant,
     Plants,
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+class MotionResultCache:
+    """Disk cache of `VidTools.draw_on_motion` results: the motion verdict and, when there was motion,
+    the rendered clip. Entries are keyed by the source files' contents and the settings used
+    (see `VidTools._get_result_key`), so footage that shows up again in a later run costs nothing.
+
+    Each entry is a small json file alongside a copy of the clip. Looking up an entry marks it as used,
+    and the least recently used entries are evicted whenever the cache grows past max_bytes.
+
+    Args:
+        cache_dir: the directory to keep entries in
+        max_bytes: the total size of entries to keep
+    """
+    CACHE_DIR = os.path.join(tempfile.gettempdir(), 'motion_results')
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir if cache_dir is not None else self.CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_paths(self, key: str) -> Tuple[str, str]:
+        """Paths to the entry's json and clip"""
+        return os.path.join(self.cache_dir, f'{key}.json'), os.path.join(self.cache_dir, f'{key}.mp4')
+
+    def get(self, key: str, out_fpath: str) -> Optional[Tuple[bool, Optional[str], Optional[float]]]:
+        """Looks up a result, copying its clip (if any) to out_fpath
+
+        Returns:
+            the cached (is_motion, fpath, duration) result, with fpath pointing to out_fpath.
+                None if there's no entry for the key.
+        """
+        json_path, clip_path = self._entry_paths(key)
+        try:
+            with open(json_path) as f:
+                entry = json.load(f)
+            if entry['is_motion']:
+                shutil.copyfile(clip_path, out_fpath)
+            # Mark as recently used
+            os.utime(json_path)
+        except (OSError, ValueError):
+            # Missing, or evicted by another run halfway through being read
+            return None
+        if not entry['is_motion']:
+            return False, None, None
+        return True, out_fpath, entry['duration']
+
+    def put(self, key: str, is_motion: bool, fpath: Optional[str] = None, duration: Optional[float] = None):
+        """Stores a result, copying the clip at fpath into the cache when there was motion,
+        then evicts entries until the cache fits in max_bytes"""
+        json_path, clip_path = self._entry_paths(key)
+        if is_motion:
+            shutil.copyfile(fpath, clip_path)
+        # Written to a temp file first so concurrent runs never read a partial entry
+        tmp_path = f'{json_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'is_motion': is_motion, 'duration': duration}, f)
+        os.replace(tmp_path, json_path)
+        self.evict()
+
+    def get_or_render(self, key: str, out_fpath: str,
+                      render: Callable[[], Tuple[bool, Optional[str], Optional[float]]]) -> \
+            Tuple[bool, Optional[str], Optional[float]]:
+        """Returns the cached result for the key, or renders it and caches it
+
+        Args:
+            key: the entry's key
+            out_fpath: the path the rendered clip is (or a cached one should be) written to
+            render: produces the (is_motion, fpath, duration) result when it's not cached
+        """
+        result = self.get(key, out_fpath)
+        if result is None:
+            result = render()
+            self.put(key, *result)
+        return result
+
+    def _entries(self) -> List[Tuple[float, int, List[str]]]:
+        """(last used time, total bytes, paths) of every entry, least recently used first"""
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if not fname.endswith('.json'):
+                continue
+            json_path, clip_path = self._entry_paths(fname[:-len('.json')])
+            paths = [p for p in [json_path, clip_path] if os.path.exists(p)]
+            try:
+                entries.append((os.path.getmtime(json_path), sum(os.path.getsize(p) for p in paths), paths))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, paths in entries:
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        """Removes every entry"""
+        for _, _, paths in self._entries():
+            for path in paths:
+                os.remove(path)
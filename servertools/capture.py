@@ -0,0 +1,183 @@
+import threading
+import time
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+from loguru import logger
+import numpy as np
+
+
+class FrameRingBuffer:
+    """Fixed-size ring of the most recent frames from a stream.
+
+    The frame storage is allocated once, on the first frame pushed (when the frame size becomes known),
+    and is overwritten in place from then on. Every frame gets a sequence number, so readers can tell
+    which frames they've already seen and which have been overwritten.
+
+    Args:
+        capacity: the number of frames to hold
+    """
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f'capacity must be at least 1. Got {capacity}')
+        self.capacity = capacity
+        self.frames = None      # type: Optional[np.ndarray]
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        # Sequence number the next pushed frame will get (i.e., the total number of frames pushed)
+        self.n_pushed = 0
+        # Sequence number of the first frame at the current frame size
+        self._first_seq = 0
+        self.lock = threading.Condition()
+
+    def push(self, frame: np.ndarray, timestamp: float = None):
+        """Copies the frame into the oldest slot"""
+        with self.lock:
+            if self.frames is None or self.frames.shape[1:] != frame.shape:
+                # First frame or the stream changed resolution. Anything buffered so far is unusable.
+                self.frames = np.empty((self.capacity, *frame.shape), dtype=frame.dtype)
+                self._first_seq = self.n_pushed
+            slot = self.n_pushed % self.capacity
+            self.frames[slot] = frame
+            self.timestamps[slot] = time.time() if timestamp is None else timestamp
+            self.n_pushed += 1
+            self.lock.notify_all()
+
+    @property
+    def oldest_seq(self) -> int:
+        """Sequence number of the oldest frame still held"""
+        return max(self.n_pushed - self.capacity, self._first_seq)
+
+    def read(self, seq: int, timeout: float = None) -> Optional[Tuple[int, np.ndarray]]:
+        """Waits for the frame with the given sequence number and returns a copy of it.
+        If it's already been overwritten, the oldest frame still held is returned instead.
+
+        Returns:
+            tuple of the sequence number read and the frame, or None if no frame arrived before the timeout
+        """
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.n_pushed > seq, timeout=timeout):
+                return None
+            seq = max(seq, self.oldest_seq)
+            return seq, self.frames[seq % self.capacity].copy()
+
+    def snapshot(self, since: float = None) -> Tuple[np.ndarray, int]:
+        """Copies out the buffered frames, oldest first
+
+        Args:
+            since: if given, only frames timestamped at or after this (epoch) time are included
+
+        Returns:
+            tuple(
+                - array of frames, shaped (n, height, width, channels)
+                - sequence number of the first frame after the snapshot
+            )
+        """
+        with self.lock:
+            if self.frames is None:
+                return np.empty((0, ), dtype=np.uint8), self.n_pushed
+            seqs = np.arange(self.oldest_seq, self.n_pushed)
+            slots = seqs % self.capacity
+            if since is not None:
+                slots = slots[self.timestamps[slots] >= since]
+            return self.frames[slots], self.n_pushed
+
+
+class CaptureService:
+    """Keeps reading a camera stream in a background thread so the last `preroll_s` seconds are
+    always at hand. When an event comes in, `iter_event` plays back the pre-roll from the buffer
+    and carries on with the live frames.
+
+    Args:
+        open_stream: opens the stream, returning an iterable of frames (e.g., `Reolink.open_video_stream`).
+            Called again whenever the stream ends or errors out.
+        preroll_s: the seconds of frames to keep buffered
+        fps: the expected frame rate of the stream, used to size the buffer. A faster stream shortens the pre-roll.
+        reconnect_s: seconds to wait before reopening a stream that ended. Doubled after each
+            consecutive failure to read any frames, up to max_reconnect_s.
+        max_reconnect_s: the longest to wait before reopening the stream
+        parent_log: the logger to report errors through. Defaults to loguru's.
+    """
+    def __init__(self, open_stream: Callable[[], Iterable[np.ndarray]], preroll_s: float = 5, fps: float = 10,
+                 reconnect_s: float = 5, max_reconnect_s: float = 300, parent_log: logger = None):
+        self.open_stream = open_stream
+        self.preroll_s = preroll_s
+        self.fps = fps
+        self.reconnect_s = reconnect_s
+        self.max_reconnect_s = max_reconnect_s
+        self.log = (parent_log if parent_log is not None else logger).bind(child_name=self.__class__.__name__)
+        self.buffer = FrameRingBuffer(capacity=max(int(np.ceil(preroll_s * fps)), 1))
+        self._stop = threading.Event()
+        self._thread = None     # type: Optional[threading.Thread]
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> 'CaptureService':
+        """Starts reading the stream in the background (if it's not already being read)"""
+        if not self.is_running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._capture, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """Stops reading the stream after the current frame"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _capture(self):
+        """Pushes frames from the stream into the buffer, reopening the stream when it ends.
+        The wait before reopening backs off while the stream keeps failing without producing frames."""
+        n_failures = 0
+        while not self._stop.is_set():
+            n_pushed = self.buffer.n_pushed
+            try:
+                for frame in self.open_stream():
+                    if frame is None:
+                        continue
+                    self.buffer.push(frame)
+                    if self._stop.is_set():
+                        return
+            except Exception:
+                # A dropped connection shouldn't end the service. Try again after a pause.
+                self.log.exception('Reading the stream failed.')
+            n_failures = 0 if self.buffer.n_pushed > n_pushed else n_failures + 1
+            wait_s = min(self.reconnect_s * 2 ** max(n_failures - 1, 0), self.max_reconnect_s)
+            self.log.debug(f'Stream ended. Reopening in {wait_s:.1f}s.')
+            self._stop.wait(wait_s)
+
+    def iter_event(self, preroll_s: float = None, postroll_s: float = 30,
+                   timeout_s: float = 5) -> Iterator[np.ndarray]:
+        """Snapshots the buffered pre-roll right away, then yields it followed by
+        live frames until postroll_s has passed. Stopping iteration early ends the event.
+
+        Args:
+            preroll_s: seconds of buffered frames to start with. Defaults to the service's preroll_s.
+            postroll_s: seconds of live frames to follow the pre-roll with
+            timeout_s: give up if the stream produces no frames for this long
+        """
+        self.start()
+        now = time.time()
+        since = now - (self.preroll_s if preroll_s is None else preroll_s)
+        preroll, next_seq = self.buffer.snapshot(since=since)
+        return self._iter_event(preroll, next_seq, end_time=now + postroll_s, timeout_s=timeout_s)
+
+    def _iter_event(self, preroll: np.ndarray, next_seq: int, end_time: float,
+                    timeout_s: float) -> Iterator[np.ndarray]:
+        """Yields the pre-roll snapshot, then live frames from next_seq on until end_time"""
+        yield from preroll
+        while time.time() < end_time:
+            # If the consumer's fallen so far behind that frames were overwritten, this skips ahead
+            result = self.buffer.read(next_seq, timeout=timeout_s)
+            if result is None:
+                break
+            seq, frame = result
+            next_seq = seq + 1
+            yield frame
@@ -0,0 +1,116 @@
+from itertools import islice
+from typing import (
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+import cv2
+from moviepy.editor import VideoFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import numpy as np
+
+
+class DecodeBackend:
+    """Frame decoders available to VidTools"""
+    MOVIEPY = 'moviepy'
+    OPENCV = 'opencv'
+
+
+class VideoCaptureReader:
+    """Decodes a video file with cv2.VideoCapture, in-process.
+
+    Frames are read with `grab()` and only converted with `retrieve()` when they're needed, so
+    skipped frames never leave the decoder. Frames come out as RGB, like moviepy's.
+
+    Args:
+        fpath: path to the video file
+        skip: yield only every skip-th frame
+        reuse_buffer: if True, every frame is written into the same array. The consumer must be done
+            with a frame before asking for the next one (and copy it if it needs to keep it).
+        t_start: second of the file to start reading at
+        t_end: second of the file to stop reading at. None reads to the end.
+    """
+    def __init__(self, fpath: str, skip: int = 1, reuse_buffer: bool = True, t_start: float = 0,
+                 t_end: float = None):
+        if skip < 1:
+            raise ValueError(f'skip must be at least 1. Got {skip}')
+        self.fpath = fpath
+        self.skip = skip
+        self.reuse_buffer = reuse_buffer
+        self.t_start = t_start
+        self.t_end = t_end
+        cap = cv2.VideoCapture(fpath)
+        if not cap.isOpened():
+            raise IOError(f'Unable to open {fpath}')
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+    @property
+    def output_fps(self) -> float:
+        """Frame rate of the frames yielded, after skipping"""
+        return self.fps / self.skip
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        cap = cv2.VideoCapture(self.fpath)
+        start_frame = int(round(self.t_start * self.fps))
+        end_frame = None if self.t_end is None else int(round(self.t_end * self.fps))
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        bgr: Optional[np.ndarray] = None
+        rgb: Optional[np.ndarray] = None
+        idx = start_frame
+        try:
+            while end_frame is None or idx < end_frame:
+                if not cap.grab():
+                    break
+                idx += 1
+                if (idx - 1 - start_frame) % self.skip != 0:
+                    continue
+                ok, bgr = cap.retrieve(bgr if self.reuse_buffer else None)
+                if not ok:
+                    break
+                rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=rgb if self.reuse_buffer else None)
+                yield rgb
+        finally:
+            cap.release()
+
+
+def read_frames(fpath: str, backend: str = DecodeBackend.MOVIEPY, skip: int = 1, reuse_buffer: bool = False,
+                t_start: float = 0, t_end: float = None) -> Tuple[Iterator[np.ndarray], float]:
+    """Opens the file with the given decode backend
+
+    Args:
+        fpath: path to the video file
+        backend: the decoder to use (see `DecodeBackend`)
+        skip: yield only every skip-th frame
+        reuse_buffer: if True, frames may be written into the same array (only the OpenCV backend does).
+            The consumer must be done with a frame before asking for the next one.
+        t_start: second of the file to start reading at
+        t_end: second of the file to stop reading at. None reads to the end.
+
+    Returns:
+        tuple of the frame iterator and the frame rate of the frames it yields
+    """
+    if backend == DecodeBackend.OPENCV:
+        reader = VideoCaptureReader(fpath, skip=skip, reuse_buffer=reuse_buffer, t_start=t_start, t_end=t_end)
+        return iter(reader), reader.output_fps
+    elif backend == DecodeBackend.MOVIEPY:
+        # Only the stream info for now. The clip (and its ffmpeg reader) is opened once iteration starts.
+        fps = ffmpeg_parse_infos(fpath)['video_fps']
+        return _iter_clip_frames(fpath, skip, t_start, t_end), fps / skip
+    raise ValueError(f'Unknown decode backend: {backend}')
+
+
+def _iter_clip_frames(fpath: str, skip: int = 1, t_start: float = 0, t_end: float = None) -> Iterator[np.ndarray]:
+    """Yields every skip-th frame of the file between t_start and t_end with moviepy,
+    closing the clip's ffmpeg reader once iteration is over (or the iterator is discarded)"""
+    clip = VideoFileClip(fpath)
+    try:
+        sub_clip = clip.subclip(t_start, t_end) if t_start > 0 or t_end is not None else clip
+        yield from islice(sub_clip.iter_frames(), 0, None, skip)
+    finally:
+        # Subclips share their parent's reader
+        clip.close()
@@ -0,0 +1,241 @@
+import os
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from moviepy.config import get_setting
+import numpy as np
+
+
+class FFmpeg:
+    """Thin wrappers around the ffmpeg binary moviepy is configured with,
+    for the jobs that don't need frames to pass through python"""
+    # Stream properties that need to match for files to be joined without re-encoding
+    CONCAT_KEYS = ['video_codec', 'pix_fmt', 'width', 'height', 'fps', 'tbn',
+                   'audio_codec', 'sample_rate', 'channels']
+
+    @staticmethod
+    def binary() -> str:
+        """Path to the ffmpeg binary"""
+        return get_setting('FFMPEG_BINARY')
+
+    @classmethod
+    def _input_summary(cls, fpath: str) -> str:
+        """ffmpeg's description of the input file"""
+        # ffmpeg exits with an error when no output is given, but still prints the input summary
+        result = subprocess.run([cls.binary(), '-hide_banner', '-i', fpath], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True)
+        return result.stderr
+
+    @classmethod
+    def duration(cls, fpath: str) -> float:
+        """The file's duration in seconds"""
+        match = re.search(r'Duration: (\d+):(\d+):([\d.]+)', cls._input_summary(fpath))
+        if match is None:
+            raise ValueError(f'No duration found for {fpath}')
+        hours, mins, secs = match.groups()
+        return int(hours) * 3600 + int(mins) * 60 + float(secs)
+
+    @classmethod
+    def probe(cls, fpath: str) -> Dict[str, Optional[str]]:
+        """Reads the properties of the first video and audio streams of the file from ffmpeg's input summary
+
+        Returns:
+            dict with video_codec, pix_fmt, width, height, fps, tbn, audio_codec, sample_rate and channels.
+                Audio properties are None when the file has no audio stream.
+        """
+        summary = cls._input_summary(fpath)
+        info = {k: None for k in cls.CONCAT_KEYS}
+        video = re.search(r'Stream #.*?: Video: ([^,]+), (\w+)(?:\([^)]*\))?, (\d+)x(\d+)(.*)', summary)
+        if video is None:
+            raise ValueError(f'No video stream found in {fpath}')
+        info['video_codec'], info['pix_fmt'], info['width'], info['height'], rest = video.groups()
+        for key, pattern in [('fps', r'([\d.]+k?) fps'), ('tbn', r'([\d.]+k?) tbn')]:
+            match = re.search(pattern, rest)
+            info[key] = match.group(1) if match is not None else None
+        audio = re.search(r'Stream #.*?: Audio: ([^,]+), (\d+) Hz, ([^,]+)', summary)
+        if audio is not None:
+            info['audio_codec'], info['sample_rate'], info['channels'] = audio.groups()
+        return info
+
+    @classmethod
+    def is_concat_compatible(cls, fpaths: List[str]) -> bool:
+        """Whether the files share the codec parameters needed to be joined with `concat_copy`"""
+        try:
+            probes = [cls.probe(fpath) for fpath in fpaths]
+        except ValueError:
+            return False
+        return all(probe == probes[0] for probe in probes[1:])
+
+    @classmethod
+    def concat_copy(cls, fpaths: List[str], out_fpath: str) -> str:
+        """Joins the files with ffmpeg's concat demuxer, copying the streams rather than re-encoding them.
+        The files should all pass `is_concat_compatible`."""
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            for fpath in fpaths:
+                escaped = os.path.abspath(fpath).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+            list_fpath = f.name
+        try:
+            subprocess.run([cls.binary(), '-hide_banner', '-loglevel', 'error', '-y', '-f', 'concat',
+                            '-safe', '0', '-i', list_fpath, '-c', 'copy', out_fpath], check=True)
+        finally:
+            os.remove(list_fpath)
+        return out_fpath
+
+    @classmethod
+    def transcode(cls, fpath: str, out_fpath: str, scale: float = 1, speed: float = 1, codec: str = 'libx264',
+                  preset: Optional[str] = 'medium', crf: Optional[int] = 23, t_start: float = 0,
+                  duration: float = None) -> str:
+        """Re-encodes the file, optionally scaled down, sped up and/or cut
+
+        Args:
+            fpath: the file to encode
+            out_fpath: the path to write to
+            scale: factor to scale the frames by. Dimensions are kept even for yuv420p.
+            speed: factor to speed the video up by. Audio is dropped when sped up.
+            codec: the ffmpeg video encoder to use
+            preset: encoder speed/compression preset. None leaves the encoder default.
+            crf: constant rate factor. None leaves the encoder default.
+            t_start: second of the file to start at
+            duration: seconds of the file (before speeding up) to encode. None encodes to the end.
+        """
+        cmd = [cls.binary(), '-hide_banner', '-loglevel', 'error', '-y']
+        if t_start > 0:
+            cmd += ['-ss', f'{t_start:.3f}']
+        if duration is not None:
+            cmd += ['-t', f'{duration:.3f}']
+        cmd += ['-i', fpath]
+        filters = []
+        if scale != 1:
+            filters.append(f'scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2')
+        if speed != 1:
+            filters.append(f'setpts=PTS/{speed}')
+        if len(filters) > 0:
+            cmd += ['-vf', ','.join(filters)]
+        cmd += ['-vcodec', codec]
+        if preset is not None:
+            cmd += ['-preset', preset]
+        if crf is not None:
+            cmd += ['-crf', str(crf)]
+        cmd += ['-pix_fmt', 'yuv420p']
+        cmd += ['-an'] if speed != 1 else ['-acodec', 'aac']
+        subprocess.run(cmd + [out_fpath], check=True)
+        return out_fpath
+
+    @classmethod
+    def iter_keyframes(cls, fpath: str) -> Iterator[Tuple[float, np.ndarray]]:
+        """Decodes only the keyframes (I-frames) of the file, skipping everything in between
+        without decoding it
+
+        Yields:
+            tuple of the keyframe's timestamp (seconds) and the RGB frame
+        """
+        info = cls.probe(fpath)
+        width, height = int(info['width']), int(info['height'])
+        frame_bytes = width * height * 3
+        # showinfo logs each frame's timestamp to stderr as it passes through
+        cmd = [cls.binary(), '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', fpath, '-an',
+               '-vsync', '0', '-vf', 'showinfo', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timestamps = queue.Queue()
+
+        def _read_timestamps():
+            for line in proc.stderr:
+                match = re.search(rb'pts_time:\s*(-?[\d.]+)', line)
+                if match is not None:
+                    timestamps.put(float(match.group(1)))
+            # No more frames coming
+            timestamps.put(None)
+
+        reader = threading.Thread(target=_read_timestamps, daemon=True)
+        reader.start()
+        try:
+            while True:
+                raw = proc.stdout.read(frame_bytes)
+                if len(raw) < frame_bytes:
+                    break
+                timestamp = timestamps.get()
+                if timestamp is None:
+                    break
+                yield timestamp, np.frombuffer(raw, dtype=np.uint8).reshape((height, width, 3))
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            reader.join()
+
+
+class FrameSink:
+    """Streams raw RGB frames into a single ffmpeg encoding process as they're produced,
+    so frames don't need to be collected into a clip before being written.
+
+    Args:
+        fpath: the path to the output video file
+        size: (width, height) of the frames
+        fps: frame rate of the output
+        codec: the ffmpeg video encoder to use
+        preset: encoder speed/compression preset (e.g., 'ultrafast', 'medium'). None leaves the encoder default.
+        crf: constant rate factor (lower => higher quality, larger files). None leaves the encoder default.
+        threads: the number of threads the encoder can use. None leaves it to ffmpeg.
+        pix_fmt: the pixel format of the output
+        keyint: the maximum number of frames between keyframes. None leaves the encoder default.
+    """
+    def __init__(self, fpath: str, size: Tuple[int, int], fps: float, codec: str = 'libx264',
+                 preset: Optional[str] = 'medium', crf: Optional[int] = 23, threads: Optional[int] = None,
+                 pix_fmt: str = 'yuv420p', keyint: Optional[int] = None):
+        self.fpath = fpath
+        self.size = tuple(size)
+        self.fps = fps
+        self.n_frames = 0
+        cmd = [FFmpeg.binary(), '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-vcodec', 'rawvideo', '-s', f'{size[0]}x{size[1]}', '-pix_fmt', 'rgb24',
+               '-r', f'{fps:.02f}', '-i', '-', '-an', '-vcodec', codec]
+        if preset is not None:
+            cmd += ['-preset', preset]
+        if crf is not None:
+            cmd += ['-crf', str(crf)]
+        if threads is not None:
+            cmd += ['-threads', str(threads)]
+        if keyint is not None:
+            cmd += ['-g', str(keyint)]
+        cmd += ['-pix_fmt', pix_fmt, fpath]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def __enter__(self) -> 'FrameSink':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, frame: np.ndarray):
+        """Sends an RGB (height, width, 3) uint8 frame to the encoder"""
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            raise ValueError(f'Frame size {frame.shape[1]}x{frame.shape[0]} doesn\'t match the sink\'s '
+                             f'{self.size[0]}x{self.size[1]}')
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        except BrokenPipeError:
+            raise IOError(f'ffmpeg stopped accepting frames for {self.fpath}: '
+                          f'{self.proc.stderr.read().decode(errors="replace")}')
+        self.n_frames += 1
+
+    def close(self):
+        """Finishes the encode, raising if ffmpeg didn't exit cleanly"""
+        if self.proc.stdin.closed:
+            return
+        self.proc.stdin.close()
+        err = self.proc.stderr.read().decode(errors='replace')
+        self.proc.stderr.close()
+        if self.proc.wait() != 0:
+            raise IOError(f'ffmpeg failed writing {self.fpath}: {err}')
@@ -9,6 +9,7 @@ import os
 from typing import List
 
 from PIL import Image
+import numpy as np
 
 
 class GIF:
@@ -85,6 +86,16 @@ class GIF:
         img_list[0].save(filename, 'gif', save_all=True, append_images=img_list[1:],
                          duration=frame_duration_ms, loop=0)
 
+    def from_frames(self, filename: str, frames: List[np.ndarray], frame_duration_ms: int = 100):
+        """Makes a gif from a list of RGB frames (e.g., video frames)
+
+        Args:
+            filename: path to the file
+            frames: list of (height, width, 3) uint8 arrays
+            frame_duration_ms: int, duration of each frame
+        """
+        self._save_imgs_to_gif(filename, [self.Image.fromarray(frame) for frame in frames], frame_duration_ms)
+
     def make_gif(self, filename: str, img_list: List[Image.Image], frame_duration_ms: int = 100, ):
         """Makes a gif from a list of images, sorted alphabetically
 
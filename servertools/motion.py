@@ -0,0 +1,883 @@
+from datetime import date
+from datetime import datetime as dt
+import json
+import os
+import time
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+import cv2
+import imutils
+import numpy as np
+
+
+class MotionEngine:
+    """Motion detection engines available to VidTools"""
+    DIFF = 'diff'
+    RUNNING_AVG = 'running_avg'
+    MOG2 = 'mog2'
+    KNN = 'knn'
+
+
+class RegionBackend:
+    """Ways of turning a binary motion mask into boxes and areas"""
+    # findContours, then contourArea & boundingRect for each contour
+    CONTOURS = 'contours'
+    # connectedComponentsWithStats, which gives every region's area and box as one array
+    COMPONENTS = 'components'
+
+
+class MotionZones:
+    """Polygonal areas of the frame to watch (include) or ignore (exclude) for motion.
+
+    Polygon points are (x, y) fractions of the frame's width and height, so the same zones
+    work for a camera's main and sub streams and for downscaled proxies. Without include zones,
+    the whole frame is watched apart from the exclude zones.
+    """
+    # Where per-camera zones are kept (see `for_camera`)
+    ZONE_DIR = os.path.join(os.path.expanduser('~'), 'data', 'motion_zones')
+
+    def __init__(self, include: List[List[Tuple[float, float]]] = None,
+                 exclude: List[List[Tuple[float, float]]] = None):
+        """
+        Args:
+            include: polygons of the areas to watch
+            exclude: polygons of the areas to ignore. These take precedence over include zones.
+        """
+        self.include = [[tuple(pt) for pt in polygon] for polygon in (include or [])]
+        self.exclude = [[tuple(pt) for pt in polygon] for polygon in (exclude or [])]
+        self._masks = {}    # type: Dict[Tuple[int, int], Tuple[np.ndarray, Tuple[int, int, int, int]]]
+
+    def _scale_polygons(self, polygons: List[List[Tuple[float, float]]], shape: Tuple[int, int]) -> List[np.ndarray]:
+        """Converts the fractional polygons to pixel coordinates for a frame of the given (height, width)"""
+        h, w = shape
+        return [np.round(np.array(polygon, dtype=np.float64) * [w, h]).astype(np.int32) for polygon in polygons]
+
+    def _build(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """Renders the zone mask for a frame of the given (height, width) along with its bounding rect"""
+        if shape not in self._masks.keys():
+            if len(self.include) > 0:
+                mask = np.zeros(shape, dtype=np.uint8)
+                cv2.fillPoly(mask, self._scale_polygons(self.include, shape), 255)
+            else:
+                mask = np.full(shape, 255, dtype=np.uint8)
+            if len(self.exclude) > 0:
+                cv2.fillPoly(mask, self._scale_polygons(self.exclude, shape), 0)
+            self._masks[shape] = (mask, cv2.boundingRect(mask))
+        return self._masks[shape]
+
+    def mask(self, shape: Tuple[int, int]) -> np.ndarray:
+        """Binary mask (255 = watched) for a frame of the given (height, width)"""
+        return self._build(tuple(shape[:2]))[0]
+
+    def roi(self, shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """Bounding rect (x, y, w, h) of the watched area for a frame of the given (height, width)"""
+        return self._build(tuple(shape[:2]))[1]
+
+    def to_dict(self) -> Dict[str, List[List[List[float]]]]:
+        return {
+            'include': [[list(pt) for pt in polygon] for polygon in self.include],
+            'exclude': [[list(pt) for pt in polygon] for polygon in self.exclude],
+        }
+
+    def save(self, fpath: str):
+        """Saves the zones as json"""
+        with open(fpath, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, fpath: str) -> 'MotionZones':
+        """Loads zones saved with `save`"""
+        with open(fpath) as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def for_camera(cls, camera: str, zone_dir: str = ZONE_DIR) -> Optional['MotionZones']:
+        """Loads the camera's zones from `<zone_dir>/<camera>.json`, if there are any"""
+        fpath = os.path.join(zone_dir, f'{camera}.json')
+        if not os.path.exists(fpath):
+            return None
+        return cls.load(fpath)
+
+
+class MotionHeatmap:
+    """Running per-pixel count of how often each part of a camera's view had motion, for finding where
+    (false) triggers come from. Detectors add their thresholded masks as they go (see `MotionDetector`),
+    and `save` folds the counts into the camera's map for the day.
+
+    Counts are kept at the detection (proxy) resolution as float32.
+    """
+    # Where per-camera daily maps are kept, as `<heatmap_dir>/<camera>/<yyyy-mm-dd>.npy`
+    HEATMAP_DIR = os.path.join(os.path.expanduser('~'), 'data', 'motion_heatmaps')
+
+    def __init__(self, camera: str, heatmap_dir: str = HEATMAP_DIR):
+        """
+        Args:
+            camera: the name of the camera
+            heatmap_dir: the directory the daily maps are saved to
+        """
+        self.camera = camera
+        self.heatmap_dir = heatmap_dir
+        self.counts = None      # type: Optional[np.ndarray]
+
+    def add(self, mask: np.ndarray, offset: Tuple[int, int] = (0, 0), shape: Tuple[int, int] = None):
+        """Counts the motion in a binary (0/255) motion mask
+
+        Args:
+            mask: the motion mask
+            offset: (x, y) of the mask within the frame, when it was found on a crop
+            shape: (height, width) of the whole frame. Defaults to the mask's.
+        """
+        shape = tuple(shape[:2]) if shape is not None else mask.shape[:2]
+        x0, y0 = offset
+        h, w = mask.shape[:2]
+        if self.counts is None:
+            self.counts = np.zeros(shape, dtype=np.float32)
+        if self.counts.shape == shape:
+            region = self.counts[y0:y0 + h, x0:x0 + w]
+            region += mask > 0
+        else:
+            # The stream changed resolution. Map the motion onto the existing grid.
+            full = np.zeros(shape, dtype=np.float32)
+            full[y0:y0 + h, x0:x0 + w] = mask > 0
+            self.counts += cv2.resize(full, self.counts.shape[::-1], interpolation=cv2.INTER_AREA)
+
+    def path_for(self, day: date = None) -> str:
+        """Path to the camera's map for the day (today by default)"""
+        day = day if day is not None else date.today()
+        return os.path.join(self.heatmap_dir, self.camera, f'{day:%Y-%m-%d}.npy')
+
+    def save(self, day: date = None) -> Optional[str]:
+        """Adds the counts so far to the camera's saved map for the day (today by default)
+        and starts counting afresh
+
+        Returns:
+            the path of the map, or None if nothing was counted
+        """
+        if self.counts is None:
+            return None
+        fpath = self.path_for(day)
+        counts = self.counts
+        if os.path.exists(fpath):
+            saved = np.load(fpath)
+            if saved.shape != counts.shape:
+                counts = cv2.resize(counts, saved.shape[::-1], interpolation=cv2.INTER_AREA)
+            counts = saved + counts
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        np.save(fpath, counts.astype(np.float32))
+        self.counts = None
+        return fpath
+
+    def load(self, day: date = None) -> Optional[np.ndarray]:
+        """Loads the camera's saved map for the day (today by default), if there is one"""
+        fpath = self.path_for(day)
+        if not os.path.exists(fpath):
+            return None
+        return np.load(fpath)
+
+    @staticmethod
+    def render(counts: np.ndarray, background: np.ndarray = None, alpha: float = 0.6) -> np.ndarray:
+        """Colors the counts from blue (least motion) to red (most)
+
+        Args:
+            counts: the motion counts
+            background: an RGB frame from the camera to lay the heatmap over. Areas without motion are left clear.
+            alpha: the heatmap's opacity where motion was most frequent
+
+        Returns:
+            the RGB heatmap, at the background's resolution if one was given
+        """
+        peak = counts.max()
+        norm = counts / peak if peak > 0 else counts.astype(np.float32)
+        heat = cv2.cvtColor(cv2.applyColorMap((norm * 255).astype(np.uint8), cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+        if background is None:
+            return heat
+        size = (background.shape[1], background.shape[0])
+        heat = cv2.resize(heat, size, interpolation=cv2.INTER_LINEAR)
+        weight = cv2.resize(norm, size, interpolation=cv2.INTER_LINEAR)[..., None] * alpha
+        return (background * (1 - weight) + heat * weight).astype(np.uint8)
+
+
+class ThresholdCalibration:
+    """Per-camera difference thresholds set from the noise floor of the camera's own footage.
+    Calibrations are kept per hour of day, so daylight and IR night footage each get their own.
+
+    The noise floor is a percentile of the histogram of how far the (grayscale, blurred) frames at the
+    start of a clip differ from the first of them, taking the median over those frames so a bit of motion
+    doesn't throw it off. The threshold is a multiple of the noise floor, kept within threshold_range.
+    Calibrations are saved to `<calibration_dir>/<camera>.json` and reused for their hour until they're
+    max_age_days old, so sunrise and sunset drifting through the year are picked up.
+    """
+    CALIBRATION_DIR = os.path.join(os.path.expanduser('~'), 'data', 'motion_calibration')
+
+    def __init__(self, camera: str, calibration_dir: str = CALIBRATION_DIR, sample_s: float = 3,
+                 percentile: float = 99, multiplier: float = 3, threshold_range: Tuple[int, int] = (15, 60),
+                 max_age_days: float = 7):
+        """
+        Args:
+            camera: the name of the camera
+            calibration_dir: the directory calibrations are saved to
+            sample_s: the seconds at the start of a clip the noise floor is estimated from
+            percentile: the percentile of the difference histogram taken as the noise floor
+            multiplier: the threshold as a multiple of the noise floor
+            threshold_range: the (lowest, highest) threshold to set
+            max_age_days: the age after which an hour's calibration is redone
+        """
+        self.camera = camera
+        self.calibration_dir = calibration_dir
+        self.sample_s = sample_s
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.threshold_range = threshold_range
+        self.max_age_days = max_age_days
+
+    @property
+    def fpath(self) -> str:
+        return os.path.join(self.calibration_dir, f'{self.camera}.json')
+
+    def _load(self) -> Dict[str, dict]:
+        """Loads the camera's calibrations, keyed by hour"""
+        try:
+            with open(self.fpath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, when: dt = None) -> Optional[int]:
+        """Returns the threshold calibrated for the hour of `when` (now by default),
+        None if there isn't one or it's out of date"""
+        when = when if when is not None else dt.now()
+        entry = self._load().get(str(when.hour))
+        if entry is None or (dt.now() - dt.fromisoformat(entry['updated'])).days >= self.max_age_days:
+            return None
+        return entry['threshold']
+
+    @staticmethod
+    def noise_floor(grays: Iterable[np.ndarray], percentile: float = 99) -> Optional[float]:
+        """Estimates the noise floor of a (static) stretch of grayscale frames
+
+        Returns:
+            the median, over the frames after the first, of the percentile-th absolute difference
+                from the first frame. None if there were fewer than two frames.
+        """
+        ref = None
+        levels = []
+        for gray in grays:
+            if ref is None:
+                ref = gray
+                continue
+            hist = cv2.calcHist([cv2.absdiff(ref, gray)], [0], None, [256], [0, 256]).ravel()
+            levels.append(int(np.searchsorted(np.cumsum(hist) / hist.sum(), percentile / 100)))
+        if len(levels) == 0:
+            return None
+        return float(np.median(levels))
+
+    def threshold_for(self, noise: float) -> int:
+        """The threshold to use for the noise floor"""
+        lowest, highest = self.threshold_range
+        return int(np.clip(np.ceil(noise * self.multiplier), lowest, highest))
+
+    def calibrate(self, grays: Iterable[np.ndarray], when: dt = None) -> Optional[int]:
+        """Sets the threshold for the hour of `when` (now by default) from the noise floor of the frames
+
+        Args:
+            grays: grayscale frames from the start of a clip, preprocessed as the detector would
+            when: the time the frames were taken
+
+        Returns:
+            the threshold, None if there weren't enough frames to calibrate from
+        """
+        noise = self.noise_floor(grays, self.percentile)
+        if noise is None:
+            return None
+        threshold = self.threshold_for(noise)
+        when = when if when is not None else dt.now()
+        calibrations = self._load()
+        calibrations[str(when.hour)] = {'threshold': threshold, 'noise': noise, 'updated': dt.now().isoformat()}
+        os.makedirs(self.calibration_dir, exist_ok=True)
+        # Written to a temp file first so concurrent runs never read a partial file
+        tmp_path = f'{self.fpath}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(calibrations, f)
+        os.replace(tmp_path, self.fpath)
+        return threshold
+
+
+class MotionDetector:
+    """Base class for stateful motion detectors.
+
+    Subclasses build a binary motion mask from each (optionally downscaled) frame, while
+    this class handles the proxy scaling and turns the mask into bounding boxes.
+    """
+    BLUR_LVL = 21
+    # Whether a clip can be split into chunks that are detected independently (see `detect_chunk`)
+    SUPPORTS_CHUNKING = False
+
+    def __init__(self, min_area: int = 500, threshold: int = 25, blur_lvl: int = BLUR_LVL, scale: float = 1,
+                 zones: MotionZones = None, heatmap: MotionHeatmap = None,
+                 region_backend: str = RegionBackend.CONTOURS, prefilter_block: int = None):
+        """
+        Args:
+            min_area: the minimum contour area (full-resolution pixels)
+            threshold: min threshold (out of 255). used when calculating img differences
+            blur_lvl: the size of the gaussian kernel applied to (full-resolution) frames before differencing
+            scale: if below 1, detection runs on a proxy of the frame downscaled by this factor.
+                min_area and blur_lvl are rescaled to match and the boxes returned are mapped back
+                onto the full-resolution frame
+            zones: if given, only motion inside these zones is detected. The frame is cropped to the
+                zones' bounding rect before any processing and masked after thresholding.
+            heatmap: if given, every motion mask is counted into it
+            region_backend: how regions are found in the motion mask (see `RegionBackend`).
+                RegionBackend.COMPONENTS measures areas in pixels, which come out slightly above
+                the contour areas of RegionBackend.CONTOURS (by about a pixel's width along the outline).
+            prefilter_block: if given, engines that difference frames first average the difference over
+                blocks of this size (full-resolution pixels, e.g., 16). Frames where no block averages
+                at or above threshold are taken as static, skipping thresholding, dilation and region
+                extraction (see `is_quiet`). Motion covering less than a block can be missed,
+                so keep blocks well under the size of what min_area should catch.
+        """
+        if not 0 < scale <= 1:
+            raise ValueError(f'Proxy scale must be within (0, 1], got {scale}')
+        if region_backend not in [RegionBackend.CONTOURS, RegionBackend.COMPONENTS]:
+            raise ValueError(f'Unknown region backend: {region_backend}')
+        self.min_area = min_area
+        self.threshold = threshold
+        self.blur_lvl = blur_lvl
+        self.scale = scale
+        self.zones = zones
+        self.heatmap = heatmap
+        self.region_backend = region_backend
+        self.prefilter_block = prefilter_block
+        # Detection parameters in proxy pixels. Blur kernels need to stay odd
+        self.proxy_min_area = min_area * scale ** 2
+        self.proxy_blur_lvl = max(3, int(round(blur_lvl * scale)) // 2 * 2 + 1)
+        self.proxy_prefilter_block = max(1, int(round(prefilter_block * scale))) if prefilter_block else None
+        self.n_frames = 0
+        self._reset_counts()
+
+    def _reset_counts(self):
+        """Zeroes the prefilter counts"""
+        # Frames the prefilter found static, and the seconds spent on them
+        self.n_prefiltered = 0
+        self.prefiltered_s = 0.
+        # Frames analyzed in full that turned out to have no motion, and the seconds spent on them
+        self.n_static = 0
+        self.static_s = 0.
+
+    def reset(self):
+        """Drops any background state and the frame counts so the detector can be reused on a new clip"""
+        self.n_frames = 0
+        self._reset_counts()
+
+    @property
+    def prefilter_rate(self) -> float:
+        """The share of the frames seen so far that the prefilter found static"""
+        return self.n_prefiltered / self.n_frames if self.n_frames > 0 else 0
+
+    @property
+    def prefilter_saved_s(self) -> float:
+        """Estimated seconds the prefilter has saved: what the frames it found static would have taken
+        to analyze in full (going by the analyzed frames that had no motion), less the time spent on them"""
+        if self.n_prefiltered == 0 or self.n_static == 0:
+            return 0
+        return self.n_prefiltered * self.static_s / self.n_static - self.prefiltered_s
+
+    def add_counts(self, other: 'MotionDetector'):
+        """Adds the prefilter counts of another detector (e.g., one that ran over part of the same clip) to these"""
+        self.n_prefiltered += other.n_prefiltered
+        self.prefiltered_s += other.prefiltered_s
+        self.n_static += other.n_static
+        self.static_s += other.static_s
+
+    @staticmethod
+    def grayscale_frame(frame: np.ndarray, blur_lvl: int = BLUR_LVL) -> np.ndarray:
+        """Converts a frame to grayscale"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (blur_lvl, blur_lvl), 0)
+        return gray
+
+    @staticmethod
+    def threshold_delta(fdelta: np.ndarray, threshold: int = 25) -> np.ndarray:
+        """Thresholds a grayscale difference image into a binary motion mask"""
+        thresh = cv2.threshold(fdelta, threshold, 255, cv2.THRESH_BINARY)[1]
+        # Dilate the thresholded image to fill in holes
+        return cv2.dilate(thresh, None, iterations=2)
+
+    @staticmethod
+    def find_contours(mask: np.ndarray) -> List[np.ndarray]:
+        """Finds the external contours in a binary motion mask"""
+        cnts = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return imutils.grab_contours(cnts)
+
+    def is_quiet(self, fdelta: np.ndarray) -> bool:
+        """Whether no block of the grayscale difference image averages at or above threshold.
+        Always False without a prefilter_block."""
+        if self.proxy_prefilter_block is None:
+            return False
+        block = self.proxy_prefilter_block
+        h, w = fdelta.shape[:2]
+        n_rows, n_cols = max(1, h // block), max(1, w // block)
+        # Area interpolation averages each block. Trimming to whole blocks keeps OpenCV on its
+        #   integer-ratio path, which is several times faster; the trimmed edge is under a block wide.
+        blocks = cv2.resize(fdelta[:n_rows * block, :n_cols * block], (n_cols, n_rows), interpolation=cv2.INTER_AREA)
+        if blocks.max() >= self.threshold:
+            return False
+        self.n_prefiltered += 1
+        return True
+
+    def get_motion_mask(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Builds the binary motion mask for the (proxy) frame and updates the background state.
+        None if the prefilter found the frame static (see `is_quiet`)."""
+        raise NotImplementedError
+
+    def detect(self, frame: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Returns the bounding boxes (x, y, w, h) of the changed areas in the frame
+        that are at least min_area in size"""
+        return self.detect_regions(frame)[0]
+
+    def detect_regions(self, frame: np.ndarray) -> Tuple[List[Tuple[int, int, int, int]], List[float]]:
+        """Same as `detect`, but also returns the contour area (full-resolution pixels) behind each box"""
+        proxy = self.to_proxy(frame)
+        crop, (x0, y0) = self.crop_to_zones(proxy)
+        if crop.size == 0:
+            # Everything's excluded
+            self.n_frames += 1
+            return [], []
+        t_start = time.perf_counter()
+        mask = self.get_motion_mask(crop)
+        self.n_frames += 1
+        if mask is None:
+            self.prefiltered_s += time.perf_counter() - t_start
+            return [], []
+        if self.zones is not None:
+            x, y, w, h = self.zones.roi(proxy.shape)
+            mask = cv2.bitwise_and(mask, self.zones.mask(proxy.shape)[y:y + h, x:x + w])
+        if self.heatmap is not None:
+            self.heatmap.add(mask, (x0, y0), proxy.shape)
+        if self.region_backend == RegionBackend.COMPONENTS:
+            boxes, areas = self.component_regions(mask, self.proxy_min_area)
+        else:
+            boxes, areas = self.contour_regions(mask, self.proxy_min_area)
+        if len(boxes) == 0:
+            self.n_static += 1
+            self.static_s += time.perf_counter() - t_start
+        boxes = [(x + x0, y + y0, w, h) for x, y, w, h in boxes]
+        return self.from_proxy(boxes), [area / self.scale ** 2 for area in areas]
+
+    @classmethod
+    def contour_regions(cls, mask: np.ndarray, min_area: float) -> \
+            Tuple[List[Tuple[int, int, int, int]], List[float]]:
+        """Bounding boxes (x, y, w, h) and areas of the mask's external contours that are at least min_area"""
+        boxes = []
+        areas = []
+        for cnt in cls.find_contours(mask):
+            area = cv2.contourArea(cnt)
+            if area >= min_area:
+                boxes.append(cv2.boundingRect(cnt))
+                areas.append(area)
+        return boxes, areas
+
+    @staticmethod
+    def component_regions(mask: np.ndarray, min_area: float) -> \
+            Tuple[List[Tuple[int, int, int, int]], List[float]]:
+        """Bounding boxes (x, y, w, h) and pixel counts of the mask's 8-connected regions that are
+        at least min_area. The filtering is done on the whole stats table at once, so the cost doesn't
+        grow with the number of (e.g., rain or foliage) specks that get filtered out."""
+        # Grana's block-based labeling, which is well ahead of the default on sparse masks
+        _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+        # Row 0 is the background
+        stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= min_area]
+        return [tuple(box) for box in stats[:, :cv2.CC_STAT_AREA].tolist()], \
+            stats[:, cv2.CC_STAT_AREA].astype(float).tolist()
+
+    def crop_to_zones(self, frame: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """Crops the (proxy) frame to the bounding rect of the zones, returning the crop and its (x, y) offset"""
+        if self.zones is None:
+            return frame, (0, 0)
+        x, y, w, h = self.zones.roi(frame.shape)
+        return frame[y:y + h, x:x + w], (x, y)
+
+    def to_proxy(self, frame: np.ndarray) -> np.ndarray:
+        """Downscales the frame to the detection resolution"""
+        if self.scale == 1:
+            return frame
+        return cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def from_proxy(self, boxes: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+        """Projects bounding boxes (x, y, w, h) found on the proxy back onto the full-resolution frame"""
+        if self.scale == 1:
+            return boxes
+        return [tuple(int(round(v / self.scale)) for v in box) for box in boxes]
+
+
+class DiffMotionDetector(MotionDetector):
+    """Frame-minus-reference motion detector.
+
+    The blurred grayscale reference frame is kept between calls and only recomputed when the
+    reference turns over, so each incoming frame is grayscaled and blurred exactly once.
+    With a prefilter_block, the unblurred reference is kept as well and the block test is run
+    before blurring, so static frames skip the blur too.
+    """
+    SUPPORTS_CHUNKING = True
+
+    def __init__(self, min_area: int = 500, threshold: int = 25, ref_frame_turnover: float = 20,
+                 blur_lvl: int = MotionDetector.BLUR_LVL, scale: float = 1, zones: MotionZones = None,
+                 heatmap: MotionHeatmap = None, region_backend: str = RegionBackend.CONTOURS,
+                 prefilter_block: int = None):
+        """
+        Args:
+            ref_frame_turnover: the number of consecutive frames to use a single reference frame on
+                before resetting the reference
+            (see `MotionDetector` for the remaining args)
+        """
+        super().__init__(min_area=min_area, threshold=threshold, blur_lvl=blur_lvl, scale=scale, zones=zones,
+                         heatmap=heatmap, region_backend=region_backend, prefilter_block=prefilter_block)
+        self.ref_frame_turnover = ref_frame_turnover
+        self.ref_gray = None
+        # Unblurred reference for the prefilter
+        self.ref_raw = None
+
+    def reset(self):
+        super().reset()
+        self.ref_gray = None
+        self.ref_raw = None
+
+    def _set_reference(self, raw: np.ndarray, gray: np.ndarray):
+        """Makes the (unblurred, blurred) grayscale frame the reference"""
+        self.ref_gray = gray
+        if self.proxy_prefilter_block is not None:
+            self.ref_raw = raw
+
+    def prime(self, ref_frame: np.ndarray, n_frames: int = 0):
+        """Sets the reference frame ahead of time, e.g., when picking up partway through a clip
+
+        Args:
+            ref_frame: the frame the next detected frame should be compared against
+            n_frames: the clip-wide index of the next frame to detect, which keeps
+                reference turnover aligned with a detector that ran from the start
+        """
+        raw = cv2.cvtColor(self.crop_to_zones(self.to_proxy(ref_frame))[0], cv2.COLOR_BGR2GRAY)
+        self._set_reference(raw, cv2.GaussianBlur(raw, (self.proxy_blur_lvl, self.proxy_blur_lvl), 0))
+        self.n_frames = n_frames
+
+    def get_motion_mask(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Compares the frame against the current reference.
+        The first frame seen becomes the reference, which is then replaced every ref_frame_turnover frames.
+        Frames that replace the reference are never prefiltered, as they need blurring regardless.
+        """
+        # Same as grayscale_frame, keeping the unblurred frame for the prefilter
+        raw = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        is_turnover = self.n_frames > 0 and self.n_frames % self.ref_frame_turnover == 0
+        if self.ref_raw is not None and not is_turnover and self.is_quiet(cv2.absdiff(self.ref_raw, raw)):
+            return None
+        gray = cv2.GaussianBlur(raw, (self.proxy_blur_lvl, self.proxy_blur_lvl), 0)
+        if self.ref_gray is None:
+            self._set_reference(raw, gray)
+        mask = self.threshold_delta(cv2.absdiff(self.ref_gray, gray), self.threshold)
+        if is_turnover:
+            # Reuse the already-preprocessed frame as the new reference
+            self._set_reference(raw, gray)
+        return mask
+
+
+class RunningAverageMotionDetector(MotionDetector):
+    """Compares each frame against an exponentially weighted running average of the scene.
+
+    The background adapts gradually (lighting changes, swaying trees), so there's no hard
+    reference reset to leave ghosts of whatever was moving when the reference was taken.
+    """
+
+    def __init__(self, min_area: int = 500, threshold: int = 25, alpha: float = 0.05,
+                 blur_lvl: int = MotionDetector.BLUR_LVL, scale: float = 1, zones: MotionZones = None,
+                 heatmap: MotionHeatmap = None, region_backend: str = RegionBackend.CONTOURS,
+                 prefilter_block: int = None):
+        """
+        Args:
+            alpha: the weight given to each new frame when updating the background average
+            (see `MotionDetector` for the remaining args)
+        """
+        super().__init__(min_area=min_area, threshold=threshold, blur_lvl=blur_lvl, scale=scale, zones=zones,
+                         heatmap=heatmap, region_backend=region_backend, prefilter_block=prefilter_block)
+        self.alpha = alpha
+        self.avg = None
+
+    def reset(self):
+        super().reset()
+        self.avg = None
+
+    def get_motion_mask(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        gray = self.grayscale_frame(frame, self.proxy_blur_lvl)
+        if self.avg is None:
+            self.avg = gray.astype(np.float32)
+        fdelta = cv2.absdiff(gray, cv2.convertScaleAbs(self.avg))
+        mask = None if self.is_quiet(fdelta) else self.threshold_delta(fdelta, self.threshold)
+        # Fold the current frame into the background only after it's been compared
+        cv2.accumulateWeighted(gray, self.avg, self.alpha)
+        return mask
+
+
+class BackgroundSubtractorMotionDetector(MotionDetector):
+    """Motion detection with one of OpenCV's Gaussian-mixture (MOG2) or k-nearest-neighbor (KNN)
+    background subtractors. Shadows are detected and left out of the mask."""
+    # Pixel value OpenCV marks confirmed foreground with (shadows get 127)
+    FOREGROUND = 255
+
+    def __init__(self, min_area: int = 500, engine: str = MotionEngine.MOG2, history: int = 500,
+                 var_threshold: float = None, blur_lvl: int = MotionDetector.BLUR_LVL, scale: float = 1,
+                 zones: MotionZones = None, heatmap: MotionHeatmap = None,
+                 region_backend: str = RegionBackend.CONTOURS):
+        """
+        Args:
+            engine: MotionEngine.MOG2 or MotionEngine.KNN
+            history: the number of frames the background model learns from
+            var_threshold: the engine's distance threshold (MOG2's varThreshold, KNN's dist2Threshold).
+                Leave as None to use OpenCV's defaults.
+            (see `MotionDetector` for the remaining args)
+        """
+        super().__init__(min_area=min_area, threshold=self.FOREGROUND - 1, blur_lvl=blur_lvl, scale=scale,
+                         zones=zones, heatmap=heatmap, region_backend=region_backend)
+        if engine not in [MotionEngine.MOG2, MotionEngine.KNN]:
+            raise ValueError(f'Unknown background subtractor engine: {engine}')
+        self.engine = engine
+        self.history = history
+        self.var_threshold = var_threshold
+        self.subtractor = self._build_subtractor()
+
+    def _build_subtractor(self) -> cv2.BackgroundSubtractor:
+        """Creates a fresh OpenCV background subtractor"""
+        kwargs = {'history': self.history, 'detectShadows': True}
+        if self.engine == MotionEngine.MOG2:
+            if self.var_threshold is not None:
+                kwargs['varThreshold'] = self.var_threshold
+            return cv2.createBackgroundSubtractorMOG2(**kwargs)
+        if self.var_threshold is not None:
+            kwargs['dist2Threshold'] = self.var_threshold
+        return cv2.createBackgroundSubtractorKNN(**kwargs)
+
+    def reset(self):
+        super().reset()
+        self.subtractor = self._build_subtractor()
+
+    def get_motion_mask(self, frame: np.ndarray) -> np.ndarray:
+        blurred = cv2.GaussianBlur(frame, (self.proxy_blur_lvl, self.proxy_blur_lvl), 0)
+        return self.threshold_delta(self.subtractor.apply(blurred), self.threshold)
+
+
+class ContourSignatureStore:
+    """Bounded store of contour shape signatures for telling new shapes from ones already seen.
+
+    Each contour is reduced to the seven log-scaled Hu moments `cv2.matchShapes` compares (method 1), so
+    the distance to every stored signature is one vectorized L1 sum that equals what matchShapes would give.
+    Signatures are bucketed by the grid cell of the contour's centroid, and only the cells around
+    a new contour are searched. Once full, the oldest signature makes room for the next one.
+    """
+    # Hu moments smaller than this are left out of the distance, as in cv2.matchShapes
+    HU_EPS = 1e-5
+
+    def __init__(self, cell_size: int = 64, max_signatures: int = 1000, search_radius: Optional[int] = 1):
+        """
+        Args:
+            cell_size: the side of a grid cell (pixels)
+            max_signatures: the most signatures held before the oldest are evicted
+            search_radius: the number of neighboring cells (in each direction) searched for similar shapes.
+                None searches every stored signature.
+        """
+        self.cell_size = cell_size
+        self.max_signatures = max_signatures
+        self.search_radius = search_radius
+        self.signatures = np.full((max_signatures, 7), np.nan, dtype=np.float64)
+        self.slot_cells = [None] * max_signatures   # type: List[Optional[Tuple[int, int]]]
+        self.cells = {}     # type: Dict[Tuple[int, int], set]
+        self.n_added = 0
+
+    def __len__(self) -> int:
+        return min(self.n_added, self.max_signatures)
+
+    @classmethod
+    def signature(cls, contour: np.ndarray) -> np.ndarray:
+        """The contour's Hu moments in the form cv2.matchShapes compares them (1 / (sign * log10|h|)).
+        Moments too small to compare are NaN."""
+        hu = cv2.HuMoments(cv2.moments(contour)).ravel()
+        sig = np.full(7, np.nan, dtype=np.float64)
+        valid = np.abs(hu) > cls.HU_EPS
+        sig[valid] = 1 / (np.sign(hu[valid]) * np.log10(np.abs(hu[valid])))
+        return sig
+
+    def _cell(self, contour: np.ndarray) -> Tuple[int, int]:
+        """Grid cell of the contour's centroid"""
+        x, y, w, h = cv2.boundingRect(contour)
+        return (x + w // 2) // self.cell_size, (y + h // 2) // self.cell_size
+
+    def _nearby_slots(self, cell: Tuple[int, int]) -> List[int]:
+        if self.search_radius is None:
+            return list(range(len(self)))
+        cx, cy = cell
+        slots = []
+        for dx in range(-self.search_radius, self.search_radius + 1):
+            for dy in range(-self.search_radius, self.search_radius + 1):
+                slots += self.cells.get((cx + dx, cy + dy), ())
+        return slots
+
+    def nearest_distance(self, contour: np.ndarray, sig: np.ndarray = None, cell: Tuple[int, int] = None) -> float:
+        """matchShapes (method 1) distance to the most similar stored contour nearby. inf if there are none."""
+        sig = self.signature(contour) if sig is None else sig
+        slots = self._nearby_slots(self._cell(contour) if cell is None else cell)
+        if len(slots) == 0:
+            return np.inf
+        # NaN terms (moments too small on either side) drop out of the sum
+        return float(np.nansum(np.abs(self.signatures[slots] - sig), axis=1).min())
+
+    def add(self, contour: np.ndarray, sig: np.ndarray = None, cell: Tuple[int, int] = None):
+        """Stores the contour's signature, evicting the oldest one if the store is full"""
+        slot = self.n_added % self.max_signatures
+        old_cell = self.slot_cells[slot]
+        if old_cell is not None:
+            self.cells[old_cell].discard(slot)
+            if len(self.cells[old_cell]) == 0:
+                del self.cells[old_cell]
+        cell = self._cell(contour) if cell is None else cell
+        self.signatures[slot] = self.signature(contour) if sig is None else sig
+        self.slot_cells[slot] = cell
+        self.cells.setdefault(cell, set()).add(slot)
+        self.n_added += 1
+
+    def add_if_unique(self, contour: np.ndarray, contour_lim: float = 10) -> bool:
+        """Stores the contour if no contour nearby is within contour_lim of its shape.
+        Returns whether it was unique."""
+        sig = self.signature(contour)
+        cell = self._cell(contour)
+        if self.nearest_distance(contour, sig, cell) <= contour_lim:
+            return False
+        self.add(contour, sig, cell)
+        return True
+
+
+class MotionIndex:
+    """Per-frame record of a motion analysis pass, compact enough to keep on disk next to the clip.
+
+    Holds every box found at or above the analysis' area floor, so sequence selection can be re-run
+    for any min_area at or above that floor without decoding or analyzing the clip again.
+    Alongside the boxes, a per-frame summary (total motion area, largest contour area,
+    contour count and the union of the boxes) is kept for quick inspection.
+    """
+    # Columns of the per-frame summary
+    AREA, MAX_AREA, COUNT, X0, Y0, X1, Y1 = range(7)
+    # Columns of the box table
+    FRAME, BOX_X, BOX_Y, BOX_W, BOX_H, BOX_AREA = range(6)
+
+    def __init__(self, boxes: np.ndarray, n_frames: int, fps: float, min_area: float = 0):
+        """
+        Args:
+            boxes: (n, 6) array of frame index, x, y, w, h and contour area for each box found
+            n_frames: the number of frames analyzed
+            fps: the frame rate of the clip
+            min_area: the area floor the boxes were collected at
+        """
+        self.boxes = boxes
+        self.n_frames = n_frames
+        self.fps = fps
+        self.min_area = min_area
+        self.summary = self.summarize()
+
+    @classmethod
+    def from_regions(cls, regions: Iterable[Tuple[List[Tuple[int, int, int, int]], List[float]]], fps: float,
+                     min_area: float = 0) -> 'MotionIndex':
+        """Builds the index from per-frame (boxes, areas) results, as returned by `MotionDetector.detect_regions`"""
+        rows = []
+        n_frames = 0
+        for i, (boxes, areas) in enumerate(regions):
+            rows += [(i, *box, area) for box, area in zip(boxes, areas)]
+            n_frames += 1
+        return cls(np.array(rows, dtype=np.float32).reshape(-1, 6), n_frames=n_frames, fps=fps, min_area=min_area)
+
+    def summarize(self, min_area: float = None) -> np.ndarray:
+        """Builds the (n_frames, 7) per-frame summary, using only boxes at or above min_area"""
+        boxes = self._filter(min_area)
+        summary = np.zeros((self.n_frames, 7), dtype=np.float32)
+        frame_idx = boxes[:, self.FRAME].astype(np.int64)
+        areas = boxes[:, self.BOX_AREA]
+        x1 = boxes[:, self.BOX_X] + boxes[:, self.BOX_W]
+        y1 = boxes[:, self.BOX_Y] + boxes[:, self.BOX_H]
+        np.add.at(summary[:, self.AREA], frame_idx, areas)
+        np.maximum.at(summary[:, self.MAX_AREA], frame_idx, areas)
+        np.add.at(summary[:, self.COUNT], frame_idx, 1)
+        summary[:, [self.X0, self.Y0]] = np.inf
+        np.minimum.at(summary[:, self.X0], frame_idx, boxes[:, self.BOX_X])
+        np.minimum.at(summary[:, self.Y0], frame_idx, boxes[:, self.BOX_Y])
+        np.maximum.at(summary[:, self.X1], frame_idx, x1)
+        np.maximum.at(summary[:, self.Y1], frame_idx, y1)
+        summary[summary[:, self.COUNT] == 0, self.X0:] = 0
+        return summary
+
+    def _filter(self, min_area: float = None) -> np.ndarray:
+        """Limits the box table to the boxes at or above min_area"""
+        if min_area is None or min_area <= self.min_area:
+            return self.boxes
+        return self.boxes[self.boxes[:, self.BOX_AREA] >= min_area]
+
+    def motion_flags(self, min_area: float = None) -> np.ndarray:
+        """Boolean array of whether each frame has a box at or above min_area"""
+        if min_area is not None and min_area < self.min_area:
+            raise ValueError(f'Index was built with a min_area of {self.min_area}, '
+                             f'so it can\'t be filtered down to {min_area}.')
+        flags = np.zeros(self.n_frames, dtype=bool)
+        flags[self._filter(min_area)[:, self.FRAME].astype(np.int64)] = True
+        return flags
+
+    def get_boxes(self, frame_idx: int, min_area: float = None) -> List[Tuple[int, int, int, int]]:
+        """Returns the boxes (x, y, w, h) at or above min_area for the given frame"""
+        boxes = self._filter(min_area)
+        boxes = boxes[boxes[:, self.FRAME] == frame_idx]
+        return [tuple(int(v) for v in box) for box in boxes[:, self.BOX_X:self.BOX_AREA]]
+
+    def save(self, fpath: str):
+        """Saves the index as a compressed .npz file"""
+        with open(fpath, 'wb') as f:
+            np.savez_compressed(f, boxes=self.boxes, meta=np.array([self.n_frames, self.fps, self.min_area]))
+
+    @classmethod
+    def load(cls, fpath: str) -> 'MotionIndex':
+        """Loads an index saved with `save`"""
+        with np.load(fpath) as data:
+            n_frames, fps, min_area = data['meta']
+            return cls(data['boxes'], n_frames=int(n_frames), fps=float(fps), min_area=float(min_area))
+
+
+def build_detector(engine: str = MotionEngine.DIFF, **params) -> MotionDetector:
+    """Builds a motion detector for the given engine (see `MotionEngine`)
+
+    Args:
+        engine: the name of the engine
+        params: keyword arguments for the engine's detector class
+    """
+    if engine == MotionEngine.DIFF:
+        return DiffMotionDetector(**params)
+    elif engine == MotionEngine.RUNNING_AVG:
+        return RunningAverageMotionDetector(**params)
+    elif engine in [MotionEngine.MOG2, MotionEngine.KNN]:
+        return BackgroundSubtractorMotionDetector(engine=engine, **params)
+    raise ValueError(f'Unknown motion engine: {engine}')
+
+
+def detect_chunk(engine: str, detector_params: dict, frames: List[np.ndarray], start_idx: int = 0,
+                 ref_frame: np.ndarray = None) -> List[Tuple[List[Tuple[int, int, int, int]], List[float]]]:
+    """Runs a fresh detector over a chunk of a clip, returning the (boxes, areas) for each frame.
+    Meant to be sent off to a worker process.
+
+    Args:
+        engine: the motion engine to use. Must be one whose detector supports chunking.
+        detector_params: keyword arguments to build the detector with
+        frames: the chunk of frames to detect motion in
+        start_idx: the clip-wide index of the first frame in the chunk
+        ref_frame: the reference frame in effect for the first frame of the chunk.
+            Can be None for the chunk starting the clip.
+    """
+    detector = build_detector(engine, **detector_params)
+    if ref_frame is not None:
+        detector.prime(ref_frame, start_idx)
+    return [detector.detect_regions(frame) for frame in frames]
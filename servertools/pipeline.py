@@ -0,0 +1,123 @@
+from multiprocessing import shared_memory
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from .decode import read_frames
+from .motion import build_detector
+
+
+class SharedFrameRing:
+    """Blocks of frame slots in shared memory, for handing frames between processes without pickling them.
+
+    Each block holds a chunk of consecutive frames plus one extra slot (slot 0) for the reference
+    frame in effect at the start of the chunk. A decoder fills a block, a detector reads it in place,
+    and the block is handed back to the decoder once the detector's results are in.
+
+    Args:
+        n_blocks: the number of blocks
+        chunk_size: the number of frames per block
+        frame_shape: (height, width, channels) of the frames
+        name: the name of an existing ring to attach to. None creates a new one.
+    """
+    def __init__(self, n_blocks: int, chunk_size: int, frame_shape: Tuple[int, int, int], name: str = None):
+        self.n_blocks = n_blocks
+        self.chunk_size = chunk_size
+        self.frame_shape = tuple(frame_shape)
+        self.shape = (n_blocks, chunk_size + 1, *self.frame_shape)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+            self.is_owner = True
+        else:
+            # Spawned processes share their parent's resource tracker, so attaching doesn't hand
+            #   ownership over. Only the creator unlinks the memory.
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.is_owner = False
+        self.slots = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def layout(self) -> Tuple[int, int, Tuple[int, int, int]]:
+        """The arguments (after the name) needed to attach to this ring from another process"""
+        return self.n_blocks, self.chunk_size, self.frame_shape
+
+    def ref_slot(self, block: int) -> np.ndarray:
+        return self.slots[block, 0]
+
+    def frame_slots(self, block: int) -> np.ndarray:
+        return self.slots[block, 1:]
+
+    def close(self):
+        """Detaches from the shared memory, freeing it as well if this process created it"""
+        # The array view has to go before the buffer can be released
+        self.slots = None
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+
+
+def decode_to_ring(fpath: str, backend: str, skip: int, ring_name: str,
+                   ring_layout: Tuple[int, int, Tuple[int, int, int]], ref_frame_turnover: int, free_blocks,
+                   filled_blocks):
+    """Decoder process: decodes the file into free blocks of the ring, announcing each filled block
+    as (block, start frame index, number of frames, whether the ref slot is set). None marks the end.
+
+    Args:
+        fpath: the path to the video file
+        backend: the decode backend to use (see `DecodeBackend`)
+        skip: read only every skip-th frame
+        ring_name: the name of the `SharedFrameRing` to fill
+        ring_layout: the ring's `layout`
+        ref_frame_turnover: the reference window of the detector. Chunks should be a whole number of them.
+        free_blocks: queue of block numbers that are free to fill
+        filled_blocks: queue the filled blocks are announced on
+    """
+    ring = SharedFrameRing(*ring_layout, name=ring_name)
+    try:
+        frames, _ = read_frames(fpath, backend=backend, skip=skip, reuse_buffer=True)
+        next_ref: Optional[np.ndarray] = None
+        start_idx = 0
+        block = None
+        n_filled = 0
+        for frame in frames:
+            if block is None:
+                block = free_blocks.get()
+                if next_ref is not None:
+                    ring.ref_slot(block)[:] = next_ref
+            ring.frame_slots(block)[n_filled] = frame
+            n_filled += 1
+            if n_filled == ring.chunk_size:
+                # Reference in effect at the start of the next chunk
+                next_ref = ring.frame_slots(block)[-ref_frame_turnover].copy()
+                filled_blocks.put((block, start_idx, n_filled, start_idx > 0))
+                start_idx += n_filled
+                block = None
+                n_filled = 0
+        if block is not None and n_filled > 0:
+            filled_blocks.put((block, start_idx, n_filled, start_idx > 0))
+    finally:
+        filled_blocks.put(None)
+        ring.close()
+
+
+def detect_ring_chunk(engine: str, detector_params: dict, ring_name: str,
+                      ring_layout: Tuple[int, int, Tuple[int, int, int]], block: int, n_frames: int,
+                      start_idx: int, has_ref: bool) -> List[Tuple[List[Tuple[int, int, int, int]], List[float]]]:
+    """Detector worker: runs a fresh detector over a block of the ring in place,
+    returning only the (boxes, areas) of each frame (see `detect_chunk`)"""
+    ring = SharedFrameRing(*ring_layout, name=ring_name)
+    try:
+        detector = build_detector(engine, **detector_params)
+        if has_ref:
+            detector.prime(ring.ref_slot(block), start_idx)
+        frames = ring.frame_slots(block)
+        return [detector.detect_regions(frames[i]) for i in range(n_frames)]
+    finally:
+        ring.close()
@@ -1,24 +1,70 @@
+from collections import deque
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from datetime import datetime as dt
+from functools import partial
+import hashlib
+from itertools import (
+    chain,
+    islice,
+)
+import json
+import multiprocessing
 import os
 import re
+import subprocess
 import tempfile
 from typing import (
+    Iterable,
+    Iterator,
     List,
     Optional,
     Tuple,
+    Union,
 )
 
 import cv2
-import imutils
+from loguru import logger
 from moviepy.editor import (
-    CompositeAudioClip,
-    ImageSequenceClip,
-    VideoClip,
+    AudioClip,
     VideoFileClip,
+    concatenate_audioclips,
     concatenate_videoclips,
 )
+from moviepy.video.io.ffmpeg_tools import ffmpeg_merge_video_audio
 import numpy as np
 
+from .cache import MotionResultCache
+from .decode import (
+    DecodeBackend,
+    VideoCaptureReader,
+    read_frames,
+)
+from .ffmpeg import (
+    FFmpeg,
+    FrameSink,
+)
+from .gif import GIF
+from .motion import (
+    ContourSignatureStore,
+    MotionDetector,
+    MotionEngine,
+    MotionHeatmap,
+    MotionIndex,
+    MotionZones,
+    RegionBackend,
+    ThresholdCalibration,
+    build_detector,
+    detect_chunk,
+)
+from .pipeline import (
+    SharedFrameRing,
+    decode_to_ring,
+    detect_ring_chunk,
+)
+
 
 class VidTools:
     """Class for general video editing"""
@@ -26,14 +72,389 @@ class VidTools:
     FPS = 20
     RESIZE_PCT = 0.5
     SPEEDX = 6
+    # Number of reference windows (ref_frame_turnover frames) handed to a worker at a time
+    PARALLEL_CHUNK_WINDOWS = 2
+    # Smallest contour area recorded in a motion index. Indexes can be reused for any min_area above this
+    INDEX_MIN_AREA = 100
+    index_dir = os.path.join(temp_dir, 'motion_index')
+    # Output scales tried by fit_to_budget, largest first, and the CRFs it may pick from
+    BUDGET_SCALES = [1, 0.75, 0.5, 0.375, 0.25]
+    BUDGET_CRF_RANGE = (18, 35)
+    # Seconds of output encoded to estimate the bitrate, and the share of the budget aimed for
+    BUDGET_SAMPLE_S = 3
+    BUDGET_MARGIN = 0.9
 
     def __init__(self, vid_w: float = 640, vid_h: float = 360, fps: float = FPS, resize_perc: float = RESIZE_PCT,
-                 speed_x: float = SPEEDX):
+                 speed_x: float = SPEEDX, proxy_scale: float = 1, workers: int = 1,
+                 motion_engine: str = MotionEngine.DIFF, engine_params: dict = None, codec: str = 'libx264',
+                 preset: Optional[str] = 'medium', crf: Optional[int] = 23, threads: Optional[int] = None,
+                 motion_zones: MotionZones = None, decode_backend: str = DecodeBackend.MOVIEPY,
+                 decode_skip: int = 1, shared_frames: bool = True, result_cache: MotionResultCache = None,
+                 motion_heatmap: MotionHeatmap = None, region_backend: str = RegionBackend.CONTOURS,
+                 prefilter_block: int = None, threshold_calibration: ThresholdCalibration = None,
+                 parent_log: logger = None):
+        """
+        Args:
+            proxy_scale: if below 1, motion detection runs on frames downscaled by this factor
+                (e.g., 0.25 for main-stream footage). Boxes are still drawn on the full-resolution frames.
+            workers: the number of processes to run motion detection in. 1 keeps it all in this process.
+                Also the number of disjoint motion segments `draw_on_motion` encodes at once.
+            motion_engine: the motion detection engine to use (see `MotionEngine`)
+            engine_params: any additional keyword arguments for the engine's detector
+                (e.g., `{'alpha': 0.1}` for MotionEngine.RUNNING_AVG)
+            codec: the ffmpeg video encoder used when writing frames (see `open_frame_sink`)
+            preset: the encoder preset (e.g., 'ultrafast'). None leaves the encoder default.
+            crf: the encoder's constant rate factor. None leaves the encoder default.
+            threads: the number of encoder threads. None leaves it to ffmpeg.
+            motion_zones: the camera's include/exclude zones (see `MotionZones`). None watches the whole frame.
+            decode_backend: the decoder used to read files (see `DecodeBackend`)
+            decode_skip: read only every decode_skip-th frame of files. Frame counts and rates
+                (e.g., min_frames, the output's fps) then refer to the frames that are read.
+            shared_frames: if True and workers is above 1, motion indexes are built by a decoder process
+                handing frames to the workers through shared memory (see `SharedFrameRing`),
+                rather than this process decoding them and pickling them over to the workers
+            result_cache: if given, `draw_on_motion` results for files are looked up in (and saved to) this cache,
+                so footage that was already analyzed with the same settings isn't analyzed or rendered again
+            motion_heatmap: if given, the motion masks of every frame analyzed are counted into this heatmap
+                (see `MotionHeatmap`). The counting happens in this process, so detection does too.
+            region_backend: how motion masks are turned into boxes (see `RegionBackend`).
+                RegionBackend.COMPONENTS holds up better on busy scenes (rain, foliage) with many small regions.
+            prefilter_block: MotionEngine.DIFF and MotionEngine.RUNNING_AVG only. If given, frames whose
+                difference doesn't average at least threshold over any block of this many pixels square
+                are taken as static without looking for regions (see `MotionDetector.is_quiet`).
+                The share of frames skipped and the time saved are logged after detecting in this process.
+            threshold_calibration: if given, the thresholds passed to `draw_on_motion`, `draw_on_motion_from_cuts`
+                and `summarize_motion` are replaced by the camera's calibrated threshold for the hour, which is
+                estimated from the start of the clip when there's none yet (see `ThresholdCalibration`).
+                Only applies to MotionEngine.DIFF and MotionEngine.RUNNING_AVG.
+            parent_log: the logger to report through. Defaults to loguru's.
+        """
+        self.log = (parent_log if parent_log is not None else logger).bind(child_name=self.__class__.__name__)
         self.fps = fps
         self.resize_perc = resize_perc
         self.speed_x = speed_x
         self.vid_w = vid_w
         self.vid_h = vid_h
+        self.proxy_scale = proxy_scale
+        self.workers = workers
+        self.motion_engine = motion_engine
+        self.engine_params = engine_params if engine_params is not None else {}
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.motion_zones = motion_zones
+        self.decode_backend = decode_backend
+        self.decode_skip = decode_skip
+        self.shared_frames = shared_frames
+        self.result_cache = result_cache
+        self.motion_heatmap = motion_heatmap
+        self.region_backend = region_backend
+        self.prefilter_block = prefilter_block
+        self.threshold_calibration = threshold_calibration
+
+    def read_frames(self, fpath: str, reuse_buffer: bool = False, t_start: float = 0,
+                    t_end: float = None) -> Tuple[Iterator[np.ndarray], float]:
+        """Decodes the file with this instance's decode backend and frame skipping
+
+        Args:
+            fpath: the path to the video file
+            reuse_buffer: if True, the decoder may write each frame into the same array,
+                so each frame must be done with before the next is read
+            t_start: second of the file to start reading at
+            t_end: second of the file to stop reading at. None reads to the end.
+
+        Returns:
+            tuple of the frame iterator and the frame rate of the frames it yields
+        """
+        return read_frames(fpath, backend=self.decode_backend, skip=self.decode_skip, reuse_buffer=reuse_buffer,
+                           t_start=t_start, t_end=t_end)
+
+    @staticmethod
+    def _get_mp_context() -> multiprocessing.context.BaseContext:
+        """The multiprocessing context detection workers are started with.
+        OpenCV's thread pool doesn't survive a fork, so workers are spawned fresh."""
+        return multiprocessing.get_context('spawn')
+
+    def _can_reuse_buffer(self, stride: int = 1) -> bool:
+        """Whether motion detection is done with each frame before the next one is read.
+        Parallel and strided detection hold on to frames."""
+        return self.workers <= 1 and stride <= 1
+
+    def open_frame_sink(self, fpath: str, size: Tuple[int, int], fps: float = None, crf: int = None) -> FrameSink:
+        """Opens an ffmpeg process that encodes RGB frames to fpath as they're written to it,
+        using this instance's codec settings
+
+        Args:
+            fpath: the path to the output video file
+            size: (width, height) of the frames
+            fps: frame rate of the output. Defaults to this instance's fps
+            crf: the constant rate factor to encode at. Defaults to this instance's crf
+        """
+        return FrameSink(fpath, size=size, fps=fps if fps is not None else self.fps, codec=self.codec,
+                         preset=self.preset, crf=crf if crf is not None else self.crf, threads=self.threads)
+
+    def _get_detector_params(self, min_area: int = 500, threshold: int = 25,
+                             ref_frame_turnover: float = 20) -> dict:
+        """Collects this instance's detection settings into keyword arguments for its engine's detector"""
+        params = {
+            'min_area': min_area,
+            'scale': self.proxy_scale,
+            'zones': self.motion_zones,
+            'heatmap': self.motion_heatmap,
+            'region_backend': self.region_backend,
+        }
+        if self.motion_engine in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG]:
+            params['threshold'] = threshold
+            params['prefilter_block'] = self.prefilter_block
+        if self.motion_engine == MotionEngine.DIFF:
+            params['ref_frame_turnover'] = ref_frame_turnover
+        params.update(self.engine_params)
+        return params
+
+    def _get_detector(self, min_area: int = 500, threshold: int = 25,
+                      ref_frame_turnover: float = 20) -> MotionDetector:
+        """Builds a fresh motion detector with this instance's detection settings"""
+        params = self._get_detector_params(min_area, threshold, ref_frame_turnover)
+        return build_detector(self.motion_engine, **params)
+
+    def _calibrate_threshold(self, threshold: int = 25, fpath: str = None, frames: Iterable[np.ndarray] = None,
+                             t_start: float = 0, when: dt = None) -> Tuple[int, Optional[Iterable[np.ndarray]]]:
+        """Looks up the threshold to detect with (see `VidTools(threshold_calibration=...)`) for the hour
+        the clip was taken (`when`, now by default), calibrating it from the first seconds of the frames
+        (or of fpath from t_start) if needed
+
+        Returns:
+            tuple of the threshold and the frames to go on with. When the frames are an iterator,
+                the frames read for calibration are put back in front.
+        """
+        calibration = self.threshold_calibration
+        if calibration is None or self.motion_engine not in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG] or \
+                (fpath is None and frames is None):
+            return threshold, frames
+        calibrated = calibration.get(when)
+        if calibrated is not None:
+            return calibrated, frames
+        if frames is None:
+            sample, _ = self.read_frames(fpath, t_start=t_start, t_end=t_start + calibration.sample_s)
+        elif isinstance(frames, list):
+            sample = frames[:int(round(calibration.sample_s * self.fps))]
+        else:
+            sample = list(islice(frames, int(round(calibration.sample_s * self.fps))))
+            frames = chain(sample, frames)
+        # Measure the noise on frames prepared the same way the detector prepares them
+        detector = self._get_detector(threshold=threshold)
+        grays = (detector.grayscale_frame(detector.crop_to_zones(detector.to_proxy(frame))[0],
+                                          detector.proxy_blur_lvl) for frame in sample)
+        calibrated = calibration.calibrate(grays, when)
+        return (calibrated if calibrated is not None else threshold), frames
+
+    def _get_calibration_key(self, when: dt = None) -> Optional[dict]:
+        """Stands in for the calibrated threshold in `MotionResultCache` keys: the camera and hour of day
+        (`when`, now by default) the threshold is calibrated for, so cached results are found without sampling
+        any frames to calibrate"""
+        calibration = self.threshold_calibration
+        if calibration is None or self.motion_engine not in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG]:
+            return None
+        when = when if when is not None else dt.now()
+        return {'camera': calibration.camera, 'hour': when.hour, 'percentile': calibration.percentile,
+                'multiplier': calibration.multiplier, 'threshold_range': list(calibration.threshold_range)}
+
+    def _iter_motion_boxes(self, frames: Iterable[np.ndarray], min_area: int = 500, threshold: int = 25,
+                           ref_frame_turnover: float = 20, stride: int = 1) -> \
+            Iterator[Tuple[np.ndarray, List[Tuple[int, int, int, int]]]]:
+        """Runs motion detection over the frames, yielding each frame alongside its motion boxes, in order"""
+        for frame, boxes, _ in self._iter_motion_regions(frames, min_area, threshold, ref_frame_turnover, stride):
+            yield frame, boxes
+
+    def _iter_motion_regions(self, frames: Iterable[np.ndarray], min_area: int = 500, threshold: int = 25,
+                             ref_frame_turnover: float = 20, stride: int = 1) -> \
+            Iterator[Tuple[np.ndarray, List[Tuple[int, int, int, int]], List[float]]]:
+        """Runs motion detection over the frames, yielding each frame alongside its motion boxes
+        and their contour areas, in order.
+
+        With more than one worker, frames are collected into chunks of whole reference windows and
+        detected in a process pool. Each chunk's detector is primed with the reference frame in effect
+        at its start (the overlap with the previous chunk), so the boxes match the single-process path.
+        Only one chunk per worker (plus one queued) is in flight at once, which keeps memory bounded when streaming.
+        Engines that learn from the whole history of the clip can't be chunked and always run in this process.
+
+        A stride above 1 switches to the coarse-to-fine scan of `_iter_strided_motion_regions`,
+        for engines that support chunking.
+        """
+        detector = self._get_detector(min_area, threshold, ref_frame_turnover)
+        turnover = int(ref_frame_turnover)
+        if stride > 1 and detector.SUPPORTS_CHUNKING and turnover == ref_frame_turnover:
+            yield from self._iter_strided_motion_regions(frames, stride, min_area, threshold, turnover)
+            return
+        if self.workers <= 1 or not detector.SUPPORTS_CHUNKING or turnover != ref_frame_turnover or \
+                self.motion_heatmap is not None:
+            # Chunks can only be split on whole reference windows, and heatmaps only count in this process
+            try:
+                for frame in frames:
+                    yield (frame, *detector.detect_regions(frame))
+            finally:
+                self._log_prefilter(detector, detector.n_frames)
+            return
+
+        detect = partial(detect_chunk, self.motion_engine,
+                         self._get_detector_params(min_area, threshold, ref_frame_turnover))
+        chunk_size = turnover * self.PARALLEL_CHUNK_WINDOWS
+        mp_context = self._get_mp_context()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context) as executor:
+            in_flight = deque()
+            chunk = []
+            ref_frame = None
+            start_idx = 0
+            for frame in frames:
+                chunk.append(frame)
+                if len(chunk) < chunk_size:
+                    continue
+                in_flight.append((chunk, executor.submit(detect, chunk, start_idx, ref_frame)))
+                # Reference in effect for the start of the next chunk. Copied, as frames get drawn on
+                #   before the pool has necessarily pickled the next task
+                ref_frame = chunk[-turnover].copy()
+                start_idx += len(chunk)
+                chunk = []
+                while len(in_flight) > self.workers:
+                    done_chunk, future = in_flight.popleft()
+                    yield from ((frame, *regions) for frame, regions in zip(done_chunk, future.result()))
+            if len(chunk) > 0:
+                in_flight.append((chunk, executor.submit(detect, chunk, start_idx, ref_frame)))
+            while len(in_flight) > 0:
+                done_chunk, future = in_flight.popleft()
+                yield from ((frame, *regions) for frame, regions in zip(done_chunk, future.result()))
+
+    def _log_prefilter(self, counts: MotionDetector, n_frames: int):
+        """Reports how many of the frames detected on the block prefilter skipped and the time it saved
+        (see `VidTools(prefilter_block=...)`)
+
+        Args:
+            counts: the detector holding the prefilter counts
+            n_frames: the number of frames detected on
+        """
+        if self.prefilter_block is None or n_frames == 0 or \
+                self.motion_engine not in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG]:
+            return
+        self.log.info(f'Prefilter skipped {counts.n_prefiltered} of {n_frames} frames '
+                      f'({counts.n_prefiltered / n_frames:.0%}), saving ~{counts.prefilter_saved_s:.2f}s.')
+
+    def _iter_strided_motion_regions(self, frames: Iterable[np.ndarray], stride: int, min_area: int = 500,
+                                     threshold: int = 25, ref_frame_turnover: int = 20) -> \
+            Iterator[Tuple[np.ndarray, List[Tuple[int, int, int, int]], List[float]]]:
+        """Coarse-to-fine variant of `_iter_motion_regions`. Only every stride-th frame is checked at first.
+        The frames between two checked frames are then analyzed in full only when either of them had motion;
+        otherwise they're yielded without any boxes.
+
+        Each analyzed stretch is primed with the reference frame in effect at its start (as with chunks in
+        the parallel path), so its boxes match an exhaustive scan exactly. Motion that starts and ends
+        between two checked frames is missed, so the stride should stay below the shortest event of interest.
+        Only the frames since the last check (and the current reference frames) are held in memory.
+        The coarse checks leave the heatmap out, as each checked frame is detected again in the fine pass.
+        """
+        params = self._get_detector_params(min_area, threshold, ref_frame_turnover)
+        coarse_params = {**params, 'heatmap': None}
+        # Adds up the prefilter counts of the detectors built for each check and stretch
+        counts = build_detector(self.motion_engine, **params)
+        n_detected = 0
+
+        def detect(chunk: List[np.ndarray], start_idx: int, ref_frame: Optional[np.ndarray],
+                   is_coarse: bool = False) -> List[Tuple[List[Tuple[int, int, int, int]], List[float]]]:
+            nonlocal n_detected
+            detector = build_detector(self.motion_engine, **(coarse_params if is_coarse else params))
+            if ref_frame is not None:
+                detector.prime(ref_frame, start_idx)
+            n_detected += len(chunk)
+            regions = [detector.detect_regions(frame) for frame in chunk]
+            counts.add_counts(detector)
+            return regions
+        refs = {}       # Copies of the frames that serve as references, by index. Yielded frames get drawn on
+        pending = []    # Frames since the last checked frame
+        prev_flag = False
+
+        def _ref_for(idx: int) -> Optional[np.ndarray]:
+            """The reference frame in effect when frame idx is detected"""
+            return None if idx == 0 else refs[ref_frame_turnover * ((idx - 1) // ref_frame_turnover)]
+
+        def _resolve(is_fine: bool, start_idx: int):
+            if is_fine:
+                regions = detect(pending, start_idx, _ref_for(start_idx))
+            else:
+                regions = [([], [])] * len(pending)
+            return [(frame, *region) for frame, region in zip(pending, regions)]
+
+        i = -1
+        try:
+            for i, frame in enumerate(frames):
+                if i % ref_frame_turnover == 0:
+                    refs[i] = frame.copy()
+                    for ref_idx in [x for x in refs.keys() if x < i - stride - ref_frame_turnover]:
+                        del refs[ref_idx]
+                pending.append(frame)
+                if i % stride != 0:
+                    continue
+                # Coarse check, then go back over the stride if it's bounded by motion on either end
+                flag = i > 0 and len(detect([frame], i, _ref_for(i), is_coarse=True)[0][0]) > 0
+                yield from _resolve(prev_flag or flag, i - len(pending) + 1)
+                pending = []
+                prev_flag = flag
+            if len(pending) > 0:
+                yield from _resolve(prev_flag, i - len(pending) + 1)
+        finally:
+            self._log_prefilter(counts, n_detected)
+
+    def _can_share_frames(self, ref_frame_turnover: float = 20, stride: int = 1) -> bool:
+        """Whether a file can be analyzed with `_iter_shared_motion_regions`"""
+        return self.shared_frames and self.workers > 1 and stride <= 1 and self.motion_heatmap is None and \
+            self._get_detector(ref_frame_turnover=ref_frame_turnover).SUPPORTS_CHUNKING and \
+            int(ref_frame_turnover) == ref_frame_turnover
+
+    def _iter_shared_motion_regions(self, fpath: str, min_area: int = 500, threshold: int = 25,
+                                    ref_frame_turnover: int = 20) -> \
+            Iterator[Tuple[List[Tuple[int, int, int, int]], List[float]]]:
+        """Variant of the parallel path of `_iter_motion_regions` for files, where the frames never pass
+        through this process. A decoder process fills the blocks of a `SharedFrameRing` and the workers
+        detect on them in place, so only the boxes and areas of each frame are pickled, yielded in order.
+
+        The ring holds a block per worker plus two (the one being decoded into and one queued),
+        and a block is only handed back to the decoder once its results have been yielded.
+        """
+        turnover = int(ref_frame_turnover)
+        chunk_size = turnover * self.PARALLEL_CHUNK_WINDOWS
+        width, height = VideoCaptureReader(fpath).size
+        ring = SharedFrameRing(n_blocks=self.workers + 2, chunk_size=chunk_size, frame_shape=(height, width, 3))
+        detect = partial(detect_ring_chunk, self.motion_engine,
+                         self._get_detector_params(min_area, threshold, ref_frame_turnover), ring.name, ring.layout)
+        mp_context = self._get_mp_context()
+        free_blocks = mp_context.Queue()
+        filled_blocks = mp_context.Queue()
+        for block in range(ring.n_blocks):
+            free_blocks.put(block)
+        decoder = mp_context.Process(target=decode_to_ring, daemon=True, args=(
+            fpath, self.decode_backend, self.decode_skip, ring.name, ring.layout, turnover, free_blocks, filled_blocks))
+        decoder.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context) as executor:
+                in_flight = deque()
+                for item in iter(filled_blocks.get, None):
+                    block, start_idx, n_frames, has_ref = item
+                    in_flight.append((block, executor.submit(detect, block, n_frames, start_idx, has_ref)))
+                    while len(in_flight) > self.workers:
+                        done_block, future = in_flight.popleft()
+                        yield from future.result()
+                        free_blocks.put(done_block)
+                while len(in_flight) > 0:
+                    done_block, future = in_flight.popleft()
+                    yield from future.result()
+            decoder.join()
+            if decoder.exitcode != 0:
+                raise IOError(f'Decoding {fpath} into shared memory failed (exit code {decoder.exitcode})')
+        finally:
+            if decoder.is_alive():
+                # Iteration was cut short and the decoder is waiting on a free block
+                decoder.terminate()
+                decoder.join()
+            ring.close()
 
     @staticmethod
     def _get_trim_range_from_filename(fpath: str, start: dt, end: dt) -> Tuple[int, int]:
@@ -54,42 +475,272 @@ class VidTools:
     def make_clip_from_filenames(self, start_dt: dt, end_dt: dt, file_list: List[str],
                                  trim_files: bool = True, prefix: str = 'motion') -> str:
         """Takes in a list of file paths, determines the cropping necessary
-        based on the timerange in the path and downloads the video clip to a temp filepath"""
+        based on the timerange in the path and downloads the video clip to a temp filepath
+
+        When no file actually needs trimming and the files share codec parameters, they're joined
+        without re-encoding and any resizing/speeding up happens in a single encoding pass.
+        """
+        fpath = os.path.join(self.temp_dir, f'{prefix}_{start_dt:%T}_to_{end_dt:%T}.mp4')
+        trim_ranges = [self._get_trim_range_from_filename(dl_file, start_dt, end_dt) if trim_files else (0, None)
+                       for dl_file in file_list]
+        if all(trim_range == (0, None) for trim_range in trim_ranges):
+            joined_fpath = os.path.join(self.temp_dir, f'{prefix}_joined.mp4')
+            if self._concat_copy(file_list, joined_fpath):
+                if self.resize_perc == 1 and self.speed_x == 1:
+                    os.replace(joined_fpath, fpath)
+                    return fpath
+                clip = VideoFileClip(joined_fpath).resize(self.resize_perc).speedx(self.speed_x)
+                clip.write_videofile(fpath)
+                os.remove(joined_fpath)
+                return fpath
+
         clips = []
-        for dl_file in file_list:
+        for dl_file, (trim_st, trim_end) in zip(file_list, trim_ranges):
             clip = VideoFileClip(dl_file)
             if trim_files:
-                trim_st, trim_end = self._get_trim_range_from_filename(dl_file, start_dt, end_dt)
                 clip = clip.subclip(trim_st, trim_end)
             clip = (clip.resize(self.resize_perc).speedx(self.speed_x))
             # Append to our clips
             clips.append(clip)
         final = concatenate_videoclips(clips, method='compose')
-        fpath = os.path.join(self.temp_dir, f'{prefix}_{start_dt:%T}_to_{end_dt:%T}.mp4')
         final.write_videofile(fpath)
         return fpath
 
     def concat_files(self, filepath_list: List[str]) -> str:
-        """Concatenates a list of mp4 filepaths into one & saves it"""
+        """Concatenates a list of mp4 filepaths into one & saves it.
+        Files sharing codec parameters are joined without re-encoding."""
+        final_fpath = os.path.join(self.temp_dir, 'motion_concatenated_file.mp4')
+        if self._concat_copy(filepath_list, final_fpath):
+            return final_fpath
         clips = []
         for filepath in filepath_list:
             clip = VideoFileClip(filepath)
             clips.append(clip)
         final = concatenate_videoclips(clips, method='compose')
-        final_fpath = os.path.join(self.temp_dir, 'motion_concatenated_file.mp4')
         final.write_videofile(final_fpath)
         return final_fpath
 
+    @staticmethod
+    def _concat_copy(filepath_list: List[str], out_fpath: str) -> bool:
+        """Attempts to join the files with ffmpeg's concat demuxer (no re-encoding).
+        Returns False when the files aren't compatible, or ffmpeg couldn't join them."""
+        if len(filepath_list) == 0 or not FFmpeg.is_concat_compatible(filepath_list):
+            return False
+        try:
+            FFmpeg.concat_copy(filepath_list, out_fpath)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def _plan_budget(self, fpath: str, max_bytes: int, duration: float, speed: float = 1, scale: float = 1,
+                     t_start: float = 0, sample_end: float = None) -> dict:
+        """Picks the settings to encode `duration` seconds of fpath's footage at to come in under max_bytes.
+        A few seconds of the footage are encoded at each of BUDGET_SCALES (largest first, relative to scale)
+        to measure its bitrate, and the first scale that can fit the budget within BUDGET_CRF_RANGE is used,
+        at the CRF that spends most of the budget. If none can, the smallest scale is used at the highest CRF
+        and the footage is sped up further to make up the difference.
+
+        Args:
+            fpath: the file to sample the footage from
+            max_bytes: the size budget for the output
+            duration: the seconds of footage (before speeding up) the output is made from
+            speed: the factor the footage is sped up by
+            scale: the factor the footage is scaled by ahead of BUDGET_SCALES
+            t_start: second of the file the sampled stretch starts at
+            sample_end: second of the file the sampled stretch ends at. Defaults to the end of the file.
+
+        Returns:
+            dict of the 'scale', 'crf' and 'speed' to encode at
+        """
+        name, ext = os.path.splitext(os.path.basename(fpath))
+        sample_fpath = os.path.join(self.temp_dir, f'{name}_sample{ext}')
+        sample_end = sample_end if sample_end is not None else FFmpeg.duration(fpath)
+        # Leave some room for the estimate being off
+        target_bytes = max_bytes * self.BUDGET_MARGIN
+        min_crf, max_crf = self.BUDGET_CRF_RANGE
+        base_crf = self.crf if self.crf is not None else 23
+        sample_len = min(sample_end - t_start, self.BUDGET_SAMPLE_S * speed)
+        sample_start = t_start + (sample_end - t_start - sample_len) / 2
+        out_duration = duration / speed
+
+        try:
+            for candidate in self.BUDGET_SCALES:
+                FFmpeg.transcode(fpath, sample_fpath, scale=scale * candidate, speed=speed, codec=self.codec,
+                                 preset=self.preset, crf=base_crf, t_start=sample_start, duration=sample_len)
+                predicted_bytes = os.path.getsize(sample_fpath) / (sample_len / speed) * out_duration
+                # x264's bitrate roughly halves with every 6 steps up in CRF
+                needed_crf = int(np.ceil(base_crf + 6 * np.log2(predicted_bytes / target_bytes)))
+                if needed_crf <= max_crf:
+                    return {'scale': scale * candidate, 'crf': max(needed_crf, min_crf), 'speed': speed}
+        finally:
+            if os.path.exists(sample_fpath):
+                os.remove(sample_fpath)
+        # Even the smallest scale at the highest CRF is too big. Fewer frames it is.
+        return {'scale': scale * self.BUDGET_SCALES[-1], 'crf': max_crf,
+                'speed': self._budget_speed(speed, 2 ** ((needed_crf - max_crf) / 6), duration)}
+
+    @staticmethod
+    def _budget_speed(speed: float, factor: float, duration: float) -> float:
+        """Speeds up by factor further, keeping at least a second of output"""
+        return min(speed * factor, max(speed, duration))
+
+    def fit_to_budget(self, fpath: str, max_bytes: int, max_duration_s: float = None,
+                      out_fpath: str = None) -> Tuple[str, dict]:
+        """Re-encodes a clip so it comes in under a size (and optionally a duration) budget,
+        e.g., to keep uploads to Slack predictable.
+
+        The speed-up comes from the duration budget, and the scale and CRF from encoding a few seconds from
+        the middle of the clip (see `_plan_budget`). The full encode is redone (up to twice) at a CRF corrected
+        by its actual size if it overshoots the budget or uses less than half of it. The CRF stays within
+        BUDGET_CRF_RANGE; any overshoot beyond the highest CRF is made up by speeding the clip up further.
+        If the output still doesn't fit, a warning is logged and it's returned as is.
+
+        Args:
+            fpath: the clip to encode
+            max_bytes: the size budget for the output
+            max_duration_s: the longest the output may play for. Longer clips are sped up to fit.
+            out_fpath: the path to write the output to. Defaults to a file in the temp directory.
+
+        Returns:
+            tuple of the output's path and the dict of 'scale', 'crf' and 'speed' used
+        """
+        if out_fpath is None:
+            out_fpath = os.path.join(self.temp_dir, f'budget_{os.path.basename(fpath)}')
+        duration = FFmpeg.duration(fpath)
+        speed = max(1., duration / max_duration_s) if max_duration_s is not None else 1.
+        settings = self._plan_budget(fpath, max_bytes, duration, speed=speed, sample_end=duration)
+        target_bytes = max_bytes * self.BUDGET_MARGIN
+        min_crf, max_crf = self.BUDGET_CRF_RANGE
+
+        for attempt in range(3):
+            FFmpeg.transcode(fpath, out_fpath, codec=self.codec, preset=self.preset, **settings)
+            out_bytes = os.path.getsize(out_fpath)
+            crf = settings['crf']
+            if out_bytes > max_bytes and attempt < 2:
+                needed_crf = crf + max(1, int(np.ceil(6 * np.log2(out_bytes / target_bytes))))
+                settings['crf'] = min(needed_crf, max_crf)
+                if needed_crf > max_crf:
+                    settings['speed'] = self._budget_speed(settings['speed'], 2 ** ((needed_crf - max_crf) / 6),
+                                                           duration)
+            elif out_bytes < target_bytes / 2 and attempt == 0 and crf > min_crf:
+                # Short samples overstate the bitrate (their keyframe is a bigger share), so take
+                #   the first full encode as the better measure. Only once, to stay near the estimate.
+                settings['crf'] = max(min_crf, crf - int(6 * np.log2(target_bytes / out_bytes)))
+            else:
+                break
+        if out_bytes > max_bytes:
+            self.log.warning(f'Could not fit {fpath} into {max_bytes} bytes. Got {out_bytes} bytes at '
+                             f'{settings}.')
+        return out_fpath, settings
+
+    @staticmethod
+    def plan_cuts(motion_files: List[dict]) -> List[Tuple[str, float, Optional[float]]]:
+        """Builds an edit decision list from motion files whose time ranges may overlap.
+        Each file's cut starts where the footage covered so far ends, and files that are
+        entirely covered by earlier ones are dropped.
+
+        Args:
+            motion_files: dicts with the 'fpath' of the (downloaded) file and the 'start'
+                and 'end' datetimes it covers
+
+        Returns:
+            list of (filepath, start second, end second) cuts, in time order. An end of None runs to the end of file.
+        """
+        cuts = []
+        covered_until = None
+        for mfile in sorted(motion_files, key=lambda x: x['start']):
+            t_start = 0
+            if covered_until is not None and mfile['start'] < covered_until:
+                if mfile['end'] <= covered_until:
+                    # Nothing new in this one
+                    continue
+                t_start = (covered_until - mfile['start']).total_seconds()
+            cuts.append((mfile['fpath'], t_start, None))
+            covered_until = mfile['end'] if covered_until is None else max(covered_until, mfile['end'])
+        return cuts
+
+    def iter_cut_frames(self, cuts: List[Tuple[str, float, Optional[float]]],
+                        reuse_buffer: bool = False) -> Iterator[np.ndarray]:
+        """Decodes the cuts in order, once each, as one continuous stream of frames.
+        Frames from sources at a different resolution than the first are resized to match it.
+        (see `read_frames` for reuse_buffer)"""
+        size = None
+        for cut_fpath, t_start, t_end in cuts:
+            frames, _ = self.read_frames(cut_fpath, reuse_buffer=reuse_buffer, t_start=t_start, t_end=t_end)
+            for frame in frames:
+                if size is None:
+                    size = (frame.shape[1], frame.shape[0])
+                elif (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                yield frame
+
+    def draw_on_motion_from_cuts(self, cuts: List[Tuple[str, float, Optional[float]]], fpath: str,
+                                 min_area: int = 500, min_frames: int = 10, threshold: int = 25,
+                                 ref_frame_turnover: float = 20, buffer_s: float = 1,
+                                 stride: int = 1, when: dt = None, max_bytes: int = None,
+                                 max_duration_s: float = None) -> Tuple[bool, Optional[str], Optional[float]]:
+        """Runs the streaming `draw_on_motion` over a cut list (see `plan_cuts`) as if it were one clip.
+        Each source is decoded once and the output is encoded once, resized and sped up
+        by this instance's resize_perc and speed_x along the way.
+
+        Given a budget, the scale, CRF and any further speed-up are picked ahead of the encode instead,
+        from a sample of the first cut (see `_plan_budget`), so the output needn't be re-encoded to fit.
+        Which frames make it in isn't known until then, so the budget is planned as if all of them do.
+
+        Args:
+            cuts: the (filepath, start second, end second) cuts to process
+            fpath: the path to write the output to
+            max_bytes: if given, the size budget for the output
+            max_duration_s: budget only. The longest the output may play for.
+            (see `draw_on_motion` for the remaining args)
+        """
+        if len(cuts) == 0:
+            return False, None, None
+
+        def _render() -> Tuple[bool, Optional[str], Optional[float]]:
+            calibrated, _ = self._calibrate_threshold(threshold, fpath=cuts[0][0], t_start=cuts[0][1], when=when)
+            settings = {'scale': self.resize_perc, 'speed': self.speed_x, 'crf': self.crf}
+            if max_bytes is not None:
+                duration = sum((FFmpeg.duration(src_fpath) if t_end is None else t_end) - t_start
+                               for src_fpath, t_start, t_end in cuts)
+                speed = self.speed_x
+                if max_duration_s is not None:
+                    speed = max(speed, duration / max_duration_s)
+                settings = self._plan_budget(cuts[0][0], max_bytes, duration, speed=speed, scale=self.resize_perc,
+                                             t_start=cuts[0][1], sample_end=cuts[0][2])
+            with VideoFileClip(cuts[0][0]) as first_clip:
+                fps = first_clip.fps / self.decode_skip
+            frames = self.iter_cut_frames(cuts, reuse_buffer=self._can_reuse_buffer(stride))
+            result = self._stream_draw_on_motion(
+                fpath=fpath, frames=frames, min_area=min_area, min_frames=min_frames,
+                threshold=calibrated, ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s,
+                resize_perc=settings['scale'], speed_x=settings['speed'], crf=settings['crf'], stride=stride, fps=fps)
+            if max_bytes is not None and result[0] and os.path.getsize(fpath) > max_bytes:
+                self.log.warning(f'{fpath} came out at {os.path.getsize(fpath)} bytes, over the budget of '
+                                 f'{max_bytes} bytes planned at {settings}.')
+            return result
+
+        if self.result_cache is None:
+            return _render()
+        key = self._get_result_key(cuts, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                                   ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, stride=stride,
+                                   resize_perc=self.resize_perc, speed_x=self.speed_x, max_bytes=max_bytes,
+                                   max_duration_s=max_duration_s, calibration=self._get_calibration_key(when))
+        return self.result_cache.get_or_render(key, fpath, _render)
+
     def draw_on_motion(self, fpath: str, frames: List[np.ndarray] = None, min_area: int = 500,
                        min_frames: int = 10, threshold: int = 25, ref_frame_turnover: float = 20,
-                       buffer_s: float = 1, motion_frames_only: bool = True) -> \
-            Tuple[bool, Optional[str], Optional[float]]:
+                       buffer_s: float = 1, motion_frames_only: bool = True, streaming: bool = False,
+                       use_index: bool = False, idle_stop_s: float = None, resize_perc: float = 1,
+                       speed_x: float = 1, stride: int = 1,
+                       keyframe_triage: bool = False, when: dt = None) -> Tuple[bool, Optional[str], Optional[float]]:
         """Draws rectangles around motion items and re-saves the file
             If True is returned, the file has some motion highlighted in it, otherwise it doesn't have any
 
         Args:
             fpath: the path to the mp4 file. can be None if frames is not None
             frames: a list of frames to process instead of reading in from file.
+                Results are only cached (see `VidTools(result_cache=...)`) when reading from fpath.
             min_area: the minimum contour area (pixels)
             min_frames: the threshold of frames the final file must have. Fewer than this will return False
             threshold: min threshold (out of 255). used when calculating img differences
@@ -97,6 +748,24 @@ class VidTools:
                 before resetting the reference
             buffer_s: the seconds of buffer to include in video output before and after motion events
             motion_frames_only: if True, will keep only frames with detectable motion on them
+            streaming: if True, frames are decoded, analyzed and written one at a time, keeping only
+                a bounded pre-roll/post-roll buffer in memory (see `_stream_draw_on_motion`)
+            use_index: if True, motion is read from (or saved to) the file's motion index, so re-running
+                with a different min_area, min_frames or buffer_s skips the analysis (see `get_motion_index`).
+                Only applies when reading from fpath.
+            idle_stop_s: streaming only. Stop reading frames once this many seconds have passed without motion
+                (counted from the start if there's been none yet). Useful for live streams.
+            resize_perc: streaming only. Scales the output frames by this factor as they're written
+            speed_x: streaming only. Speeds the output up by this factor as it's written
+                (by keeping every speed_x-th frame). Audio is dropped when sped up.
+            stride: if above 1, only every stride-th frame is checked for motion at first, and the frames
+                around the ones with motion are then analyzed in full (see `_iter_strided_motion_regions`).
+                Keep it below min_frames. Needs an engine that supports chunking (MotionEngine.DIFF).
+            keyframe_triage: if True, only the file's keyframes are decoded at first, and only the GOPs
+                (keyframe intervals) that changed are decoded and analyzed in full (see `find_changed_gops`).
+                Only applies when reading from fpath. The output has no audio.
+            when: the time the clip starts. Picks the hour of day whose calibrated threshold is used
+                (see `VidTools(threshold_calibration=...)`). Now by default.
 
         Returns:
             tuple(
@@ -107,21 +776,62 @@ class VidTools:
 
         NB! threshold probably shouldn't exceed 254
         """
+        if self.result_cache is not None and frames is None:
+            # Keyed on the threshold asked for, so a cached result is found before any frames are sampled
+            key = self._get_result_key(
+                [(fpath, 0, None)], min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                streaming=streaming, idle_stop_s=idle_stop_s, resize_perc=resize_perc, speed_x=speed_x,
+                stride=stride, keyframe_triage=keyframe_triage, calibration=self._get_calibration_key(when))
+            # The output overwrites fpath, so the key has to be taken before rendering
+            return self.result_cache.get_or_render(key, fpath, partial(
+                self._draw_on_motion, fpath=fpath, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                streaming=streaming, use_index=use_index, idle_stop_s=idle_stop_s, resize_perc=resize_perc,
+                speed_x=speed_x, stride=stride, keyframe_triage=keyframe_triage, when=when))
+        return self._draw_on_motion(
+            fpath=fpath, frames=frames, min_area=min_area, min_frames=min_frames, threshold=threshold,
+            ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+            streaming=streaming, use_index=use_index, idle_stop_s=idle_stop_s, resize_perc=resize_perc,
+            speed_x=speed_x, stride=stride, keyframe_triage=keyframe_triage, when=when)
+
+    def _draw_on_motion(self, fpath: str, frames: List[np.ndarray] = None, min_area: int = 500,
+                        min_frames: int = 10, threshold: int = 25, ref_frame_turnover: float = 20,
+                        buffer_s: float = 1, motion_frames_only: bool = True, streaming: bool = False,
+                        use_index: bool = False, idle_stop_s: float = None, resize_perc: float = 1,
+                        speed_x: float = 1, stride: int = 1,
+                        keyframe_triage: bool = False, when: dt = None) -> Tuple[bool, Optional[str], Optional[float]]:
+        """Uncached `draw_on_motion`"""
+        threshold, frames = self._calibrate_threshold(threshold, fpath=fpath, frames=frames, when=when)
+        if keyframe_triage and frames is None:
+            return self._triage_draw_on_motion(
+                fpath=fpath, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                resize_perc=resize_perc, speed_x=speed_x, stride=stride)
+        if use_index and frames is None:
+            return self._draw_on_motion_from_index(
+                fpath=fpath, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                stride=stride)
+        if streaming:
+            return self._stream_draw_on_motion(
+                fpath=fpath, frames=frames, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                idle_stop_s=idle_stop_s, resize_perc=resize_perc, speed_x=speed_x, stride=stride)
+        clip = None
         if frames is None:
+            if fpath is None:
+                raise ValueError('Arguments \'fpath\' and \'frames\' were both None. '
+                                 'One of these must not be empty in order for the script to function.')
             clip = VideoFileClip(fpath)
-            frames = [x for x in clip.iter_frames()]
-            # Set the reference frame
-            ref_frame = clip.get_frame(0)
-        elif frames is not None:
-            clip = ImageSequenceClip(frames, fps=self.fps)
-            ref_frame = frames[0]
+            frames, fps = self.read_frames(fpath)
+            frames = list(frames)
         else:
-            raise ValueError('Arguments \'fpath\' and \'frames\' were both None. '
-                             'One of these must not be empty in order for the script to function.')
+            fps = self.fps
         keep_frames = []    # For determining which frames have motion
-        for i, frame in enumerate(frames):
-            rects, contours, drawn_frame = self._detect_contours(
-                ref_frame, frame, min_area, threshold, unique_only=False, color_correct_frame=True)
+        motion_boxes = self._iter_motion_boxes(frames, min_area, threshold, ref_frame_turnover, stride)
+        for i, (frame, boxes) in enumerate(motion_boxes):
+            rects, drawn_frame = self._draw_motion_boxes(boxes, frame, color_correct_frame=True)
             if motion_frames_only:
                 if rects > 0:
                     # We've drawn some rectangles on this
@@ -132,19 +842,78 @@ class VidTools:
             # Replace frame with drawn
             frames[i] = drawn_frame
             if i % ref_frame_turnover == 0:
-                print(f'Frame {i} reached.')
-                if i > 0:
-                    # Reset the reference frame
-                    ref_frame = frame
+                self.log.debug(f'Frame {i} reached.')
 
         if len(keep_frames) == 0:
             # Exit method... Nothing was determined to keep
             return False, None, None
         # Now loop through the frames we've marked and process them into clips
         # Determine the amount of buffer frames from the seconds of buffer
-        buffer_frame = int(round(clip.fps * buffer_s, 0))
-        # Begin calculating the sequences
+        buffer_frame = int(round(fps * buffer_s, 0))
+        sequences = self._build_sequences(keep_frames, buffer_frame)
+
+        # Each output window runs from the start of a sequence to buffer_s past its end
+        tot_frames = len(frames)
+        buffer_fr = int(fps * buffer_s)
+        windows = [(start, min(end + buffer_fr, tot_frames - 1)) for start, end in sequences
+                   if end - start >= min_frames]
+        if len(windows) == 0:
+            return False, None, None
+
+        tmp_fpath = os.path.join(self.temp_dir, f'drawn_{os.path.basename(fpath)}')
+        segments = []
+        for start, end in windows:
+            # Don't repeat frames a preceding window's buffer already covered
+            start = max(start, segments[-1][1] + 1) if len(segments) > 0 else start
+            if start >= end:
+                continue
+            if len(segments) > 0 and segments[-1][1] == start - 1:
+                segments[-1][1] = end - 1
+            else:
+                segments.append([start, end - 1])
+        if self.workers > 1 and len(segments) > 1:
+            self._encode_segments(frames, segments, tmp_fpath, fps)
+        else:
+            with self.open_frame_sink(tmp_fpath, size=(frames[0].shape[1], frames[0].shape[0]), fps=fps) as sink:
+                for start, end in segments:
+                    for frame in frames[start:end + 1]:
+                        sink.write(frame)
+        self._mux_segment_audio(clip, segments, tmp_fpath, fpath, fps)
+        return True, fpath, sum(end - st + 1 for st, end in segments) / fps
+
+    def _encode_segments(self, frames: List[np.ndarray], segments: List[List[int]], fpath: str, fps: float):
+        """Encodes each (first, last) frame segment to its own file, up to `workers` at a time,
+        then joins them into fpath with a stream copy.
+
+        Every encoder is a separate ffmpeg process (see `FrameSink`), so feeding them from threads is
+        enough to encode in parallel, and the frames don't need to be pickled over to other processes.
+        """
+        size = (frames[0].shape[1], frames[0].shape[0])
+        name, ext = os.path.splitext(os.path.basename(fpath))
+        seg_fpaths = [os.path.join(self.temp_dir, f'{name}_seg{i}{ext}') for i in range(len(segments))]
+
+        def _encode(seg_fpath: str, segment: List[int]):
+            with self.open_frame_sink(seg_fpath, size=size, fps=fps) as sink:
+                for frame in frames[segment[0]:segment[1] + 1]:
+                    sink.write(frame)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # list() to raise any encoding errors here
+                list(executor.map(_encode, seg_fpaths, segments))
+            FFmpeg.concat_copy(seg_fpaths, fpath)
+        finally:
+            for seg_fpath in seg_fpaths:
+                if os.path.exists(seg_fpath):
+                    os.remove(seg_fpath)
+
+    @staticmethod
+    def _build_sequences(keep_frames: List[int], buffer_frame: int) -> List[Tuple[int, int]]:
+        """Groups the (sorted) frame indices to keep into (first, last) sequences.
+        Frames less than buffer_frame apart are considered part of the same sequence."""
         sequences = []  # For holding lists of sequences
+        if len(keep_frames) == 0:
+            return sequences
         sequence_frames = [keep_frames[0]]
         for f in keep_frames[1:]:
             last_seq = sequence_frames[-1]
@@ -159,82 +928,460 @@ class VidTools:
                 sequence_frames = [f]
         if len(sequence_frames) > 0:
             sequences.append((sequence_frames[0], sequence_frames[-1]))
+        return sequences
 
-        processed_clips = []
-        for start, end in sequences:
-            if end - start >= min_frames:
-                processed_clips.append(
-                    self.develop_drawn_clip(org_clip=clip, sq_frames=[start, end], all_frames=frames,
-                                            buffer_s=buffer_s)
-                )
+    @staticmethod
+    def _hash_file(fpath: str, block_size: int = 2 ** 20) -> str:
+        """Hashes the file's contents"""
+        sha = hashlib.sha1()
+        with open(fpath, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+        return sha.hexdigest()
 
-        if len(processed_clips) > 0:
-            final_clip = concatenate_videoclips(processed_clips)
-            final_clip.write_videofile(fpath)
-            return True, fpath, final_clip.duration
-        return False, None, None
+    def _get_index_path(self, fpath: str, min_area: int = 500, threshold: int = 25,
+                        ref_frame_turnover: float = 20, stride: int = 1) -> str:
+        """Builds the path to the motion index for the file's contents and this instance's detector settings"""
+        params = self._get_detector_params(min(min_area, self.INDEX_MIN_AREA), threshold, ref_frame_turnover)
+        params['engine'] = self.motion_engine
+        params['zones'] = self.motion_zones.to_dict() if self.motion_zones is not None else None
+        del params['heatmap']
+        if stride > 1:
+            params['stride'] = stride
+        if self.decode_skip > 1:
+            params['decode_skip'] = self.decode_skip
+        params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.index_dir, f'{self._hash_file(fpath)[:20]}_{params_hash[:12]}.npz')
 
-    @staticmethod
-    def develop_drawn_clip(org_clip: VideoFileClip, sq_frames: List[float], all_frames: List[np.ndarray],
-                           buffer_s: float = 1) -> VideoClip:
-        """Calculates subclip start and end time, creates a subclip to reference.
-        Combines the drawn frames (with buffer) before transforming into a video clip
-        Adds original clip's audio to the video containing drawn frames.
+    def _get_result_key(self, sources: List[Tuple[str, float, Optional[float]]], **settings) -> str:
+        """Builds the `MotionResultCache` key for rendering the sources with the given settings
+
+        Args:
+            sources: the (filepath, start second, end second) cuts read. Files are identified by their contents.
+            settings: the draw_on_motion arguments used
+        """
+        params = dict(settings)
+        params.update({
+            'sources': [(self._hash_file(src_fpath), t_start, t_end) for src_fpath, t_start, t_end in sources],
+            'engine': self.motion_engine,
+            'engine_params': self.engine_params,
+            'proxy_scale': self.proxy_scale,
+            'zones': self.motion_zones.to_dict() if self.motion_zones is not None else None,
+            'decode_skip': self.decode_skip,
+            'region_backend': self.region_backend,
+            'prefilter_block': self.prefilter_block,
+            'encoder': [self.codec, self.preset, self.crf],
+        })
+        return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_motion_index(self, fpath: str, min_area: int = 500, threshold: int = 25,
+                         ref_frame_turnover: float = 20, stride: int = 1) -> MotionIndex:
+        """Loads the motion index for the file, analyzing the file and saving the index if there isn't one yet.
+
+        The index is keyed by the file's contents and the detector settings other than min_area.
+        Boxes are recorded down to INDEX_MIN_AREA, so any min_area at or above that reuses the same index.
+
+        Args:
+            fpath: the path to the mp4 file
+            (see `draw_on_motion` for the remaining args)
+        """
+        index_path = self._get_index_path(fpath, min_area, threshold, ref_frame_turnover, stride)
+        if os.path.exists(index_path):
+            return MotionIndex.load(index_path)
+        floor_area = min(min_area, self.INDEX_MIN_AREA)
+        frames, fps = self.read_frames(fpath, reuse_buffer=self._can_reuse_buffer(stride))
+        if self._can_share_frames(ref_frame_turnover, stride):
+            # Only the frame rate is needed here; the decoder process reads the frames
+            regions = self._iter_shared_motion_regions(fpath, floor_area, threshold, int(ref_frame_turnover))
+        else:
+            regions = ((boxes, areas) for _, boxes, areas in self._iter_motion_regions(
+                frames, floor_area, threshold, ref_frame_turnover, stride))
+        index = MotionIndex.from_regions(regions, fps=fps, min_area=floor_area)
+        os.makedirs(self.index_dir, exist_ok=True)
+        index.save(index_path)
+        return index
+
+    def _draw_on_motion_from_index(self, fpath: str, min_area: int = 500, min_frames: int = 10,
+                                   threshold: int = 25, ref_frame_turnover: float = 20, buffer_s: float = 1,
+                                   motion_frames_only: bool = True, stride: int = 1) -> \
+            Tuple[bool, Optional[str], Optional[float]]:
+        """Variant of `draw_on_motion` that selects sequences from the file's motion index
+        (see `get_motion_index`) and only decodes the clip again to render the frames that are kept"""
+        index = self.get_motion_index(fpath, min_area, threshold, ref_frame_turnover, stride)
+        if motion_frames_only:
+            keep_frames = np.flatnonzero(index.motion_flags(min_area)).tolist()
+        else:
+            keep_frames = list(range(index.n_frames))
+        buffer_frame = int(round(index.fps * buffer_s, 0))
+        # Each output window runs from the start of a sequence to buffer_s past its end
+        windows = [(start, min(end + buffer_frame, index.n_frames - 1))
+                   for start, end in self._build_sequences(keep_frames, buffer_frame) if end - start >= min_frames]
+        if len(windows) == 0:
+            return False, None, None
+
+        clip = VideoFileClip(fpath)
+        tmp_fpath = os.path.join(self.temp_dir, f'index_{os.path.basename(fpath)}')
+        writer = self.open_frame_sink(tmp_fpath, size=clip.size, fps=index.fps)
+        segments = []
+        window_idx = 0
+        # Each frame is drawn (into a new array) and written before the next is read
+        frames, _ = self.read_frames(fpath, reuse_buffer=True)
+        for i, frame in enumerate(frames):
+            while window_idx < len(windows) and i >= windows[window_idx][1]:
+                window_idx += 1
+            if window_idx == len(windows):
+                break
+            if i < windows[window_idx][0]:
+                continue
+            _, drawn_frame = self._draw_motion_boxes(index.get_boxes(i, min_area), frame, color_correct_frame=True)
+            writer.write(drawn_frame)
+            if len(segments) > 0 and segments[-1][1] == i - 1:
+                segments[-1][1] = i
+            else:
+                segments.append([i, i])
+        writer.close()
+        self._mux_segment_audio(clip, segments, tmp_fpath, fpath, index.fps)
+        return True, fpath, sum(end - st + 1 for st, end in segments) / index.fps
+
+    def summarize_motion(self, cuts: List[Tuple[str, float, Optional[float]]], sheet_fpath: str,
+                         gif_fpath: str = None, min_area: int = 500, min_frames: int = 10, threshold: int = 25,
+                         ref_frame_turnover: float = 20, buffer_s: float = 1, stride: int = 1, tile_w: int = 320,
+                         max_tiles: int = 16, gif_frames: int = 4, gif_frame_ms: int = 250, when: dt = None) -> \
+            Tuple[Optional[str], Optional[str]]:
+        """Tiles the peak-motion frame (the one with the most motion area) of each motion sequence
+        into a single JPEG contact sheet, optionally also writing a short GIF that steps through each sequence.
+
+        Sequences are selected as `draw_on_motion` would, from each file's motion index (see `get_motion_index`),
+        so a clip rendered afterwards with use_index=True doesn't analyze the files again.
+        Only the frames that make it into the summary are drawn on.
+
+        Args:
+            cuts: the (filepath, start second, end second) cuts to summarize (see `plan_cuts`).
+                An end of None reads to the end of the file.
+            sheet_fpath: the path to write the contact sheet to
+            gif_fpath: if given, the path to write the GIF to
+            tile_w: the width of each tile. Tiles keep the first frame's aspect ratio.
+            max_tiles: the most sequences to show. Above this, only the ones with the most motion are kept.
+            gif_frames: the number of frames (evenly spaced) shown from each sequence in the GIF
+            gif_frame_ms: the milliseconds each GIF frame is shown
+            (see `draw_on_motion` for the remaining args)
+
+        Returns:
+            tuple of the contact sheet's and GIF's filepaths, (None, None) if there were no motion sequences
+        """
+        if len(cuts) > 0:
+            threshold, _ = self._calibrate_threshold(threshold, fpath=cuts[0][0], t_start=cuts[0][1], when=when)
+        # (peak motion area, cut number, peak frame, GIF frames) of each sequence
+        picks = []
+        indexes = []
+        for cut_idx, (src_fpath, t_start, t_end) in enumerate(cuts):
+            index = self.get_motion_index(src_fpath, min_area, threshold, ref_frame_turnover, stride)
+            indexes.append(index)
+            first = int(round(t_start * index.fps))
+            last = index.n_frames - 1 if t_end is None else min(int(round(t_end * index.fps)), index.n_frames) - 1
+            keep_frames = (np.flatnonzero(index.motion_flags(min_area)[first:last + 1]) + first).tolist()
+            areas = index.summarize(min_area)[:, MotionIndex.AREA]
+            buffer_frame = int(round(index.fps * buffer_s, 0))
+            for start, end in self._build_sequences(keep_frames, buffer_frame):
+                if end - start < min_frames:
+                    continue
+                peak = start + int(np.argmax(areas[start:end + 1]))
+                gif_idxs = np.linspace(start, end, gif_frames).round().astype(int).tolist() \
+                    if gif_fpath is not None else []
+                picks.append((float(areas[peak]), cut_idx, peak, gif_idxs))
+        if len(picks) == 0:
+            return None, None
+        if len(picks) > max_tiles:
+            picks = sorted(picks, reverse=True)[:max_tiles]
+        picks = sorted(picks, key=lambda x: (x[1], x[2]))
+
+        tiles = []
+        gif_tiles = []
+        tile_size = None
+        for cut_idx, (src_fpath, _, _) in enumerate(cuts):
+            cut_picks = [pick for pick in picks if pick[1] == cut_idx]
+            if len(cut_picks) == 0:
+                continue
+            index = indexes[cut_idx]
+            wanted = {idx for _, _, peak, gif_idxs in cut_picks for idx in [peak] + gif_idxs}
+            rendered = {}
+            frames, _ = self.read_frames(src_fpath, reuse_buffer=True)
+            for i, frame in enumerate(frames):
+                if i > max(wanted):
+                    break
+                if i not in wanted:
+                    continue
+                if tile_size is None:
+                    tile_size = (tile_w, int(round(frame.shape[0] * tile_w / frame.shape[1])))
+                _, drawn = self._draw_motion_boxes(index.get_boxes(i, min_area), frame.copy())
+                drawn = cv2.resize(drawn, tile_size, interpolation=cv2.INTER_AREA)
+                cv2.putText(drawn, f'#{cut_idx + 1} {i / index.fps:.1f}s', (4, tile_size[1] - 6),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA)
+                rendered[i] = drawn
+            for _, _, peak, gif_idxs in cut_picks:
+                tiles.append(rendered[peak])
+                gif_tiles += [rendered[idx] for idx in gif_idxs]
+
+        columns = int(np.ceil(np.sqrt(len(tiles))))
+        rows = int(np.ceil(len(tiles) / columns))
+        tile_h = tile_size[1]
+        sheet = np.zeros((rows * tile_h, columns * tile_w, 3), dtype=np.uint8)
+        for i, tile in enumerate(tiles):
+            row, col = divmod(i, columns)
+            sheet[row * tile_h:(row + 1) * tile_h, col * tile_w:(col + 1) * tile_w] = tile
+        # Frames are RGB, OpenCV writes BGR
+        cv2.imwrite(sheet_fpath, cv2.cvtColor(sheet, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if gif_fpath is not None:
+            GIF().from_frames(gif_fpath, gif_tiles, frame_duration_ms=gif_frame_ms)
+        return sheet_fpath, gif_fpath
+
+    def _mux_segment_audio(self, clip: Optional[VideoFileClip], segments: List[List[int]], video_fpath: str,
+                           out_fpath: str, fps: float = None):
+        """Moves the rendered video into place, first muxing in the original clip's audio for the
+        (first, last) frame segments that were written, if there's any audio to speak of.
+        The video stream is copied rather than re-encoded.
+
+        Args:
+            fps: the frame rate the segment indices count in. Defaults to the clip's
+        """
+        if clip is None or clip.audio is None:
+            os.replace(video_fpath, out_fpath)
+            return
+        fps = clip.fps if fps is None else fps
+        audio = concatenate_audioclips([clip.audio.subclip(st / fps, (end + 1) / fps) for st, end in segments])
+        self._mux_audio(video_fpath, audio, out_fpath)
+
+    def _mux_audio(self, video_fpath: str, audio: Optional[AudioClip], out_fpath: str):
+        """Moves the video file into place, first muxing in the audio clip (if any).
+        The video stream is copied rather than re-encoded."""
+        if audio is None:
+            os.replace(video_fpath, out_fpath)
+            return
+        audio_fpath = os.path.join(self.temp_dir, f'segment_audio_{os.path.basename(out_fpath)}.m4a')
+        audio.write_audiofile(audio_fpath, codec='aac', logger=None)
+        ffmpeg_merge_video_audio(video_fpath, audio_fpath, out_fpath, logger=None)
+        os.remove(video_fpath)
+        os.remove(audio_fpath)
+
+    def find_changed_gops(self, fpath: str, min_area: int = 500, threshold: int = 25,
+                          pad_gops: int = 1) -> List[Tuple[float, float]]:
+        """Coarse scan that decodes only the file's keyframes and diffs each one against the one before.
+        A GOP (the stretch from one keyframe to the next) is flagged when its closing keyframe differs
+        from its opening one, and is returned along with pad_gops GOPs on either side.
+
+        Motion that starts and ends within a single GOP, leaving the scene as it was, is missed,
+        so this suits long recordings with GOPs of a few seconds (e.g., Amcrest's).
+
+        Args:
+            fpath: the path to the video file
+            min_area: the minimum contour area (pixels) of a change
+            threshold: min threshold (out of 255) used when diffing keyframes
+            pad_gops: the number of unchanged GOPs to include before and after each changed one
+
+        Returns:
+            list of merged (start second, end second) ranges of the file to analyze in full
+        """
+        # Every keyframe becomes the reference for the next. Keyframe diffs span whole GOPs,
+        #   so they're kept out of the heatmap.
+        params = self._get_detector_params(min_area, threshold, ref_frame_turnover=1)
+        params['heatmap'] = None
+        detector = build_detector(self.motion_engine, **params)
+        times = []
+        changed = []    # Index of the GOP each changed keyframe closes
+        for i, (timestamp, frame) in enumerate(FFmpeg.iter_keyframes(fpath)):
+            times.append(timestamp)
+            if len(detector.detect(frame)) > 0 and i > 0:
+                changed.append(i - 1)
+        if len(changed) == 0:
+            return []
+        # GOP i runs from keyframe i to keyframe i + 1, the last one to the end of the file
+        bounds = times + [FFmpeg.duration(fpath)]
+        ranges = []
+        for gop in changed:
+            first, last = max(gop - pad_gops, 0), min(gop + pad_gops, len(times) - 1)
+            if len(ranges) > 0 and first <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        return [(bounds[first], bounds[last + 1]) for first, last in ranges]
+
+    def _triage_draw_on_motion(self, fpath: str, min_area: int = 500, min_frames: int = 10,
+                               threshold: int = 25, ref_frame_turnover: float = 20, buffer_s: float = 1,
+                               motion_frames_only: bool = True, resize_perc: float = 1, speed_x: float = 1,
+                               stride: int = 1) -> Tuple[bool, Optional[str], Optional[float]]:
+        """Variant of the streaming `draw_on_motion` that only decodes the GOPs `find_changed_gops` flags.
+        Each range is run through detection on its own, so sequences, min_frames and the pre-/post-roll
+        never span the footage skipped in between. The ranges with motion are then joined into one clip."""
+        ranges = self.find_changed_gops(fpath, min_area=min_area, threshold=threshold)
+        range_fpaths = []
+        duration = 0
+        for i, (t_start, t_end) in enumerate(ranges):
+            frames, fps = self.read_frames(fpath, reuse_buffer=self._can_reuse_buffer(stride),
+                                           t_start=t_start, t_end=t_end)
+            range_fpath = os.path.join(self.temp_dir, f'triage_{i}_{os.path.basename(fpath)}')
+            is_motion, _, range_duration = self._stream_draw_on_motion(
+                fpath=range_fpath, frames=frames, min_area=min_area, min_frames=min_frames, threshold=threshold,
+                ref_frame_turnover=ref_frame_turnover, buffer_s=buffer_s, motion_frames_only=motion_frames_only,
+                resize_perc=resize_perc, speed_x=speed_x, stride=stride, fps=fps)
+            if is_motion:
+                range_fpaths.append(range_fpath)
+                duration += range_duration
+        if len(range_fpaths) == 0:
+            return False, None, None
+        if len(range_fpaths) == 1:
+            os.replace(range_fpaths[0], fpath)
+        else:
+            # Every range was encoded with the same settings, so they're joined without re-encoding
+            os.replace(self.concat_files(range_fpaths), fpath)
+            for range_fpath in range_fpaths:
+                os.remove(range_fpath)
+        return True, fpath, duration
+
+    def _stream_draw_on_motion(self, fpath: str, frames: Iterable[np.ndarray] = None, min_area: int = 500,
+                               min_frames: int = 10, threshold: int = 25, ref_frame_turnover: float = 20,
+                               buffer_s: float = 1, motion_frames_only: bool = True, idle_stop_s: float = None,
+                               resize_perc: float = 1, speed_x: float = 1, stride: int = 1,
+                               fps: float = None, crf: int = None) -> Tuple[bool, Optional[str], Optional[float]]:
+        """Streaming variant of `draw_on_motion`. Each frame is decoded, analyzed, annotated and
+        handed to the encoder before the next one is read, so peak memory depends on `buffer_s`
+        and `min_frames` rather than the length of the clip.
+
+        A motion sequence is built the same way as in `draw_on_motion` (motion frames closer than
+        the buffer are merged). Frames of a sequence are held back until it has spanned `min_frames`,
+        after which they're flushed along with up to `buffer_s` of pre-roll. Once flushed, frames
+        are written straight through until `buffer_s` of post-roll has passed.
+
+        Frames are resized and sped up on their way to the encoder, so a live stream can be analyzed
+        and encoded in one pass, stopping `idle_stop_s` after the motion dies down.
 
         Args:
-            org_clip: the original clip to leverage audio, duration data from
-            sq_frames: the sequence of frames that have motion annotations draw in them
-            all_frames: the full list of frames that we'll be slicing
-            buffer_s: the seconds of buffer to add before and after the motion area
+            fpath: the path to the mp4 file. The annotated output replaces this file.
+            frames: an iterable of frames to process instead of reading in from file
+            fps: the frame rate of `frames`. Defaults to this instance's fps
+            crf: the constant rate factor to encode at. Defaults to this instance's crf
+            (see `draw_on_motion` for the remaining args)
         """
-        duration = org_clip.duration
-        tot_frames = len(all_frames)
-        # Calculate number of frames to buffer before and after motion areas
-        buffer_fr = int(org_clip.fps * buffer_s)
-
-        # Calculate the start and end frames with the buffers
-        st_with_buffer = sq_frames[0]
-        end_with_buffer = sq_frames[-1] + buffer_fr
-        start_frame_pos = st_with_buffer if st_with_buffer > 0 else 0
-        end_frame_pos = end_with_buffer if end_with_buffer < tot_frames else tot_frames - 1
-
-        # Calculate the start and end times for the start and end frames
-        start_t = ((start_frame_pos / tot_frames) * duration)
-        end_t = ((end_frame_pos / tot_frames) * duration)
-
-        # Cut the original clip to fit the buffer
-        cut_clip = org_clip.subclip(start_t, end_t)
-
-        # Generate the sequence of drawn clips
-        drawn_clip = ImageSequenceClip(all_frames[start_frame_pos:end_frame_pos], fps=org_clip.fps)
-        if drawn_clip.duration != cut_clip.duration:
-            # Cut the tail off the drawn clip to match the cut_clip.
-            drawn_clip = drawn_clip.subclip(0, end_t - start_t)
-        # Make the drawn clip a VideoClip by concatenating it with only itself. Add original clip's audio
-        drawn_clip = concatenate_videoclips([drawn_clip])
-        drawn_clip.audio = cut_clip.audio
-        return drawn_clip
-
-    def write_frames(self, frames: List[np.ndarray], filepath: str, audio: CompositeAudioClip = None) -> str:
-        """Writes the frames to a given .mp4 filepath (h264 codec)"""
-        vclip = ImageSequenceClip(frames, fps=self.fps)
+        clip = None
+        if frames is None:
+            if fpath is None:
+                raise ValueError('Arguments \'fpath\' and \'frames\' were both None. '
+                                 'One of these must not be empty in order for the script to function.')
+            clip = VideoFileClip(fpath)
+            # Frames are drawn (into a new array) before the next is read, unless detection holds on to them
+            frames, fps = self.read_frames(fpath, reuse_buffer=self._can_reuse_buffer(stride))
+        elif fps is None:
+            fps = self.fps
+        buffer_frame = int(round(fps * buffer_s, 0))
+        # The largest distance between two motion frames that still places them in the same sequence
+        seq_gap = max(buffer_frame, 2)
+        idle_frames = int(round(fps * idle_stop_s, 0)) if idle_stop_s is not None else None
+        last_motion = 0
+
+        tmp_fpath = os.path.join(self.temp_dir, f'stream_{os.path.basename(fpath)}')
+        writer = None
+        segments = []       # (first, last) frame indices written to file, used to cut the matching audio
+        preroll = deque(maxlen=buffer_frame)   # Unwritten frames that might precede the next sequence
+        pending = []        # Frames of the current sequence that hasn't yet reached min_frames
+        seq_start = seq_last = None
+        confirmed = False
+        postroll_end = -1
+        n_written = 0
+        n_kept = 0          # Frames passed to _write, of which every speed_x-th is encoded
+        next_encoded = 0
+
+        def _write(idx: int, drawn: np.ndarray):
+            nonlocal writer, n_written, n_kept, next_encoded
+            n_kept += 1
+            if n_kept - 1 < next_encoded:
+                return
+            next_encoded += speed_x
+            if resize_perc != 1:
+                # Keep the dimensions even for yuv420p
+                size = (int(drawn.shape[1] * resize_perc) // 2 * 2, int(drawn.shape[0] * resize_perc) // 2 * 2)
+                drawn = cv2.resize(drawn, size, interpolation=cv2.INTER_AREA)
+            if writer is None:
+                writer = self.open_frame_sink(tmp_fpath, size=(drawn.shape[1], drawn.shape[0]), fps=fps, crf=crf)
+            writer.write(drawn)
+            if len(segments) > 0 and segments[-1][1] == idx - 1:
+                segments[-1][1] = idx
+            else:
+                segments.append([idx, idx])
+            n_written += 1
+
+        motion_boxes = self._iter_motion_boxes(frames, min_area, threshold, ref_frame_turnover, stride)
+        for i, (frame, boxes) in enumerate(motion_boxes):
+            rects, drawn_frame = self._draw_motion_boxes(boxes, frame, color_correct_frame=True)
+            if i % ref_frame_turnover == 0:
+                self.log.debug(f'Frame {i} reached.')
+            last_motion = i if rects > 0 else last_motion
+            has_motion = rects > 0 if motion_frames_only else True
+
+            if has_motion:
+                if seq_start is None:
+                    # New sequence - whatever's in the pre-roll buffer goes along with it
+                    seq_start = i
+                    confirmed = False
+                    pending = list(preroll)
+                    preroll.clear()
+                seq_last = i
+                if confirmed:
+                    _write(i, drawn_frame)
+                else:
+                    pending.append((i, drawn_frame))
+                    if seq_last - seq_start >= min_frames:
+                        # Sequence is long enough to keep. Flush what's been held back
+                        confirmed = True
+                        for idx, pending_frame in pending:
+                            _write(idx, pending_frame)
+                        pending = []
+                postroll_end = seq_last + buffer_frame if confirmed else postroll_end
+            elif seq_start is not None and not confirmed:
+                pending.append((i, drawn_frame))
+            elif i <= postroll_end:
+                _write(i, drawn_frame)
+            else:
+                preroll.append((i, drawn_frame))
+
+            if seq_start is not None and i + 1 - seq_last >= seq_gap:
+                # No upcoming frame can extend this sequence. Close it out.
+                if not confirmed:
+                    # Never reached min_frames. Its tail might still serve as pre-roll for the next one
+                    preroll.extend(pending)
+                    pending = []
+                seq_start = seq_last = None
+            if idle_frames is not None and i - last_motion >= idle_frames:
+                # Nothing's moved in a while. Stop reading.
+                break
+
+        if writer is None:
+            # Exit method... Nothing was determined to keep
+            return False, None, None
+        writer.close()
+        self._mux_segment_audio(clip if speed_x == 1 else None, segments, tmp_fpath, fpath, fps)
+        return True, fpath, n_written / fps
+
+    def write_frames(self, frames: Iterable[np.ndarray], filepath: str, audio: AudioClip = None) -> str:
+        """Writes the frames to a given .mp4 filepath (encoded with this instance's codec settings).
+        Frames are streamed to the encoder as they're read, so this can take a generator."""
+        tmp_fpath = os.path.join(self.temp_dir, f'frames_{os.path.basename(filepath)}')
+        sink = None
+        for frame in frames:
+            if sink is None:
+                sink = self.open_frame_sink(tmp_fpath, size=(frame.shape[1], frame.shape[0]))
+            sink.write(frame)
+        if sink is None:
+            raise ValueError('No frames to write.')
+        sink.close()
         if audio is not None:
-            audio.set_duration(vclip.duration)
-            vclip.audio = audio
-        vclip.write_videofile(filepath, codec='libx264', fps=self.fps)
+            audio = audio.set_duration(sink.n_frames / self.fps)
+        self._mux_audio(tmp_fpath, audio, filepath)
         return filepath
 
-    @staticmethod
-    def _grayscale_frame(frame: np.ndarray, blur_lvl: int = 21) -> np.ndarray:
-        """Converts a frame to grayscale"""
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (blur_lvl, blur_lvl), 0)
-        return gray
-
     def _detect_contours(self, reference_frame: np.ndarray, cur_frame: np.ndarray,
                          min_area: int = 500, threshold: int = 25, contour_lim: int = 10,
-                         prev_contours: List[np.ndarray] = None, unique_only: bool = False,
-                         color_correct_frame: bool = False) -> Tuple[int, List[np.ndarray], np.ndarray]:
+                         prev_contours: Union[ContourSignatureStore, List[np.ndarray]] = None,
+                         unique_only: bool = False, color_correct_frame: bool = False) -> \
+            Tuple[int, ContourSignatureStore, np.ndarray]:
         """Methodology used to detect contours in image differences
 
         Args:
@@ -243,22 +1390,24 @@ class VidTools:
             min_area: the minimum (pixel?) area of changes to be flagged as a significant change
             threshold: seems like the gradient of the change (in grayscale?) to identify changes?
             contour_lim: integer-wise means of detecting changes in contours (larger => more different)
-            prev_contours: List of previous contours (used for detecting unique contours
-            unique_only: if True, will perform unique contour analysis
+            prev_contours: the store of previously seen contours (used for detecting unique contours).
+                Pass the store returned by the previous call back in. A list of contours is also accepted.
+            unique_only: if True, only contours whose shape differs by more than contour_lim from
+                every nearby contour seen before are drawn (see `ContourSignatureStore`)
             color_correct_frame: if True, will try to apply a color correction to the frame before return
         """
+        cur_frame = self._writeable(cur_frame)
         # Compute absolute difference between current frame and first frame
-        ref_gray = self._grayscale_frame(reference_frame)
-        gray = self._grayscale_frame(cur_frame)
-        fdelta = cv2.absdiff(ref_gray, gray)
-        thresh = cv2.threshold(fdelta, threshold, 255, cv2.THRESH_BINARY)[1]
-        # Dilate the thresholded image to fill in holes, then find contours
-        #   on thresholded image
-        thresh = cv2.dilate(thresh, None, iterations=2)
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
+        ref_gray = MotionDetector.grayscale_frame(reference_frame)
+        gray = MotionDetector.grayscale_frame(cur_frame)
+        cnts = MotionDetector.find_contours(MotionDetector.threshold_delta(cv2.absdiff(ref_gray, gray), threshold))
         # Capture unique contours
-        unique_cnts = prev_contours.copy() if prev_contours is not None else []
+        if isinstance(prev_contours, ContourSignatureStore):
+            unique_cnts = prev_contours
+        else:
+            unique_cnts = ContourSignatureStore()
+            for cnt in (prev_contours or []):
+                unique_cnts.add(cnt)
 
         # Loop over contours
         rects = 0
@@ -267,12 +1416,10 @@ class VidTools:
             if cv2.contourArea(cnt) < min_area:
                 continue
             if unique_only:
-                # Check for unique contours
-                if any([cv2.matchShapes(cnt, ucnt, 1, 0.0) > contour_lim for ucnt in unique_cnts]):
-                    # Unique contour - add to group
-                    # Otherwise compute the bounding box for the contour & draw it on the frame
+                # Check for unique contours - these get added to the store
+                if unique_cnts.add_if_unique(cnt, contour_lim):
+                    # Compute the bounding box for the contour & draw it on the frame
                     self._draw_rectangle_over_contour(cnt, cur_frame, line_width=2, rgb=(0, 255, 0))
-                    unique_cnts.append(cnt)
                     rects += 1
             else:
                 # Just pick up any contours
@@ -282,6 +1429,29 @@ class VidTools:
             cur_frame = cv2.cvtColor(cur_frame, cv2.COLOR_BGR2RGB)
         return rects, unique_cnts, cur_frame
 
+    @staticmethod
+    def _writeable(frame: np.ndarray) -> np.ndarray:
+        """The frame itself, or a copy of it if it can't be drawn on.
+        Frames decoded by moviepy are read-only views onto the ffmpeg buffer."""
+        return frame if frame.flags.writeable else frame.copy()
+
+    @staticmethod
+    def _draw_motion_boxes(boxes: List[Tuple[int, int, int, int]], cur_frame: np.ndarray,
+                           color_correct_frame: bool = False) -> Tuple[int, np.ndarray]:
+        """Draws the bounding boxes (x, y, w, h) returned by a MotionDetector onto the frame
+
+        Args:
+            boxes: the bounding boxes to draw
+            cur_frame: the frame to draw on
+            color_correct_frame: if True, will try to apply a color correction to the frame before return
+        """
+        cur_frame = VidTools._writeable(cur_frame)
+        for x, y, w, h in boxes:
+            cv2.rectangle(cur_frame, (x, y), (x + w, y + h), (0, 255, 0), thickness=2)
+        if color_correct_frame:
+            cur_frame = cv2.cvtColor(cur_frame, cv2.COLOR_BGR2RGB)
+        return len(boxes), cur_frame
+
     @staticmethod
     def _draw_rectangle_over_contour(contour, frame: np.ndarray, line_width: float = 2,
                                      rgb: Tuple[float, float, float] = (0, 255, 0)):
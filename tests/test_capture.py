@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+
+from loguru import logger
+import numpy as np
+
+from servertools import (
+    CaptureService,
+    FrameRingBuffer,
+)
+
+
+def numbered_frame(i: int, w: int = 16, h: int = 9) -> np.ndarray:
+    """A small frame filled with its own index, so frames can be told apart after buffering"""
+    return np.full((h, w, 3), i % 256, dtype=np.uint8)
+
+
+class TestFrameRingBuffer(unittest.TestCase):
+    """Test suite for FrameRingBuffer"""
+
+    def test_preallocated(self):
+        """Frames should be copied into the same array rather than appended"""
+        buffer = FrameRingBuffer(capacity=5)
+        buffer.push(numbered_frame(0))
+        storage = buffer.frames
+        for i in range(1, 12):
+            buffer.push(numbered_frame(i))
+        self.assertIs(storage, buffer.frames)
+        self.assertEqual((5, 9, 16, 3), buffer.frames.shape)
+
+    def test_snapshot_order(self):
+        """Snapshots should hold the most recent frames, oldest first"""
+        buffer = FrameRingBuffer(capacity=5)
+        for i in range(12):
+            buffer.push(numbered_frame(i), timestamp=i)
+        frames, next_seq = buffer.snapshot()
+        self.assertEqual([7, 8, 9, 10, 11], [frame[0, 0, 0] for frame in frames])
+        self.assertEqual(12, next_seq)
+        frames, _ = buffer.snapshot(since=9.5)
+        self.assertEqual([10, 11], [frame[0, 0, 0] for frame in frames])
+
+    def test_read_skips_overwritten(self):
+        """Reading a frame that's been overwritten should give the oldest one still held"""
+        buffer = FrameRingBuffer(capacity=3)
+        for i in range(10):
+            buffer.push(numbered_frame(i))
+        seq, frame = buffer.read(2)
+        self.assertEqual(7, seq)
+        self.assertEqual(7, frame[0, 0, 0])
+        self.assertIsNone(buffer.read(10, timeout=0.01))
+
+
+class TestCaptureService(unittest.TestCase):
+    """Test suite for CaptureService"""
+
+    def test_event_includes_preroll(self):
+        """An event should start with buffered frames from before it was triggered and continue live"""
+        n_frames = 60
+        pushed = threading.Event()
+
+        def open_stream():
+            for i in range(n_frames):
+                if i == 20:
+                    pushed.set()
+                yield numbered_frame(i)
+                time.sleep(0.01)
+
+        capture = CaptureService(open_stream, preroll_s=1, fps=10, reconnect_s=10).start()
+        pushed.wait(5)
+        frames = list(capture.iter_event(postroll_s=5, timeout_s=0.5))
+        capture.stop()
+        values = [frame[0, 0, 0] for frame in frames]
+        # Pre-roll is capped at the buffer's capacity (preroll_s * fps)
+        self.assertLessEqual(values[0], 20)
+        self.assertGreater(values[0], 0)
+        self.assertEqual(list(range(values[0], n_frames)), values)
+
+    def test_failures_logged_with_backoff(self):
+        """A stream that keeps failing should have each error logged and be reopened less and less often"""
+        opened = []
+
+        def open_stream():
+            opened.append(time.time())
+            raise ConnectionError('Camera offline')
+
+        errors = []
+        handler = logger.add(errors.append, level='ERROR')
+        try:
+            capture = CaptureService(open_stream, reconnect_s=0.05, max_reconnect_s=0.2).start()
+            time.sleep(1)
+            capture.stop()
+        finally:
+            logger.remove(handler)
+        self.assertEqual(len(opened), len(errors))
+        self.assertIn('Camera offline', errors[0])
+        waits = np.diff(opened)
+        self.assertLess(waits[0], 0.1)
+        self.assertGreater(waits[-1], 0.15)
+        # Doubling 0.05s up to 0.2s gives ~6 attempts in a second rather than the 20 a fixed wait would
+        self.assertLessEqual(len(opened), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,897 @@
+from datetime import datetime as dt
+from datetime import timedelta
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+import cv2
+from loguru import logger
+from moviepy.editor import VideoFileClip
+import numpy as np
+
+from servertools import (
+    BackgroundSubtractorMotionDetector,
+    ContourSignatureStore,
+    DecodeBackend,
+    DiffMotionDetector,
+    FFmpeg,
+    FrameSink,
+    MotionDetector,
+    MotionEngine,
+    MotionHeatmap,
+    MotionIndex,
+    MotionResultCache,
+    MotionZones,
+    RegionBackend,
+    RunningAverageMotionDetector,
+    ThresholdCalibration,
+    VideoCaptureReader,
+    VidTools,
+)
+
+
+def make_motion_frames(n_frames: int = 100, motion_ranges: tuple = ((20, 40), ), w: int = 160,
+                       h: int = 90) -> list:
+    """Builds a static, noisy scene with a bright block sliding across it during the given frame ranges"""
+    rng = np.random.default_rng(0)
+    background = (rng.random((h, w, 3)) * 60 + 80).astype(np.uint8)
+    frames = []
+    for i in range(n_frames):
+        frame = background.copy()
+        for st, end in motion_ranges:
+            if st <= i < end:
+                x = int((i - st) / (end - st) * (w - 30))
+                frame[30:60, x:x + 20] = 240
+        frames.append(frame)
+    return frames
+
+
+class TestVidTools(unittest.TestCase):
+    """Test suite for VidTools"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.vt = VidTools(160, 90, fps=10)
+        cls.out_path = os.path.join(tempfile.gettempdir(), 'vidtools_test.mp4')
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.out_path):
+            os.remove(self.out_path)
+
+    def test_streaming_draw_on_motion(self):
+        """Streaming mode should keep the motion sequence plus at most buffer_s on either side"""
+        frames = make_motion_frames(motion_ranges=((22, 38), ))
+        is_motion, fpath, duration = self.vt.draw_on_motion(self.out_path, frames=frames, min_area=100,
+                                                            min_frames=5, buffer_s=1, streaming=True)
+        self.assertTrue(is_motion)
+        self.assertEqual(self.out_path, fpath)
+        self.assertGreaterEqual(duration, 2)
+        self.assertLessEqual(duration, 4.1)
+
+    def test_parallel_motion_boxes(self):
+        """Chunked detection in a process pool should give the same boxes as the single-process path"""
+        frames = make_motion_frames(n_frames=95, motion_ranges=((5, 30), (50, 80)))
+        serial = [boxes for _, boxes in self.vt._iter_motion_boxes(frames, min_area=100, ref_frame_turnover=4)]
+        parallel_vt = VidTools(160, 90, fps=10, workers=2)
+        parallel = [boxes for _, boxes in parallel_vt._iter_motion_boxes(frames, min_area=100, ref_frame_turnover=4)]
+        self.assertEqual(serial, parallel)
+
+    def test_shared_memory_motion_regions(self):
+        """Detecting on frames handed over through shared memory should match the single-process path"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_shared.mp4')
+        self.vt.write_frames(make_motion_frames(n_frames=95, motion_ranges=((5, 30), (50, 80))), fpath)
+        for backend in [DecodeBackend.MOVIEPY, DecodeBackend.OPENCV]:
+            vt = VidTools(160, 90, fps=10, workers=2, decode_backend=backend)
+            self.assertTrue(vt._can_share_frames(ref_frame_turnover=4))
+            frames, _ = vt.read_frames(fpath)
+            serial_regions = self.vt._iter_motion_regions(frames, min_area=100, ref_frame_turnover=4)
+            serial = [regions for _, *regions in serial_regions]
+            shared_regions = vt._iter_shared_motion_regions(fpath, min_area=100, ref_frame_turnover=4)
+            shared = [list(regions) for regions in shared_regions]
+            self.assertEqual(95, len(shared))
+            self.assertTrue(any(len(boxes) > 0 for boxes, _ in shared))
+            self.assertEqual(serial, shared)
+        os.remove(fpath)
+
+    def test_strided_motion_boxes(self):
+        """The coarse-to-fine scan should find the same boxes as the exhaustive one for events longer than the stride"""
+        frames = make_motion_frames(n_frames=95, motion_ranges=((5, 30), (50, 80)))
+        exhaustive = [boxes for _, boxes in self.vt._iter_motion_boxes(frames, min_area=100, ref_frame_turnover=4)]
+        for stride in [2, 3, 5]:
+            strided_boxes = self.vt._iter_motion_boxes(frames, min_area=100, ref_frame_turnover=4, stride=stride)
+            strided = [boxes for _, boxes in strided_boxes]
+            self.assertEqual(exhaustive, strided)
+
+    def test_streaming_idle_stop_and_output_transform(self):
+        """Streaming should stop reading idle_stop_s after the last motion and resize/speed up as it writes"""
+        n_read = 0
+
+        def live_frames():
+            nonlocal n_read
+            for frame in make_motion_frames(n_frames=200, motion_ranges=((22, 38), )):
+                n_read += 1
+                yield frame
+
+        is_motion, fpath, duration = self.vt.draw_on_motion(
+            self.out_path, frames=live_frames(), min_area=100, min_frames=5, buffer_s=1, streaming=True,
+            idle_stop_s=3, resize_perc=0.5, speed_x=2)
+        self.assertTrue(is_motion)
+        self.assertLess(n_read, 80)
+        clip = VideoFileClip(fpath)
+        self.assertEqual([80, 44], list(clip.size))
+        # Roughly 3-4s of frames kept, at double speed
+        self.assertGreaterEqual(duration, 1)
+        self.assertLessEqual(duration, 2.1)
+
+    def test_streaming_draw_on_motion_short_sequence(self):
+        """Sequences shorter than min_frames shouldn't produce any output"""
+        frames = make_motion_frames(motion_ranges=((22, 25), ))
+        is_motion, fpath, duration = self.vt.draw_on_motion(self.out_path, frames=frames, min_area=100,
+                                                            min_frames=10, buffer_s=0.2, streaming=True)
+        self.assertFalse(is_motion)
+        self.assertIsNone(fpath)
+
+    def test_build_sequences(self):
+        """Frames within the buffer of each other should be grouped together"""
+        self.assertEqual([], self.vt._build_sequences([], 5))
+        self.assertEqual([(1, 3), (10, 14), (30, 30)], self.vt._build_sequences([1, 2, 3, 10, 12, 14, 30], 5))
+
+    def test_concat_files_stream_copy(self):
+        """Files with matching codec parameters should be joined without re-encoding"""
+        fpaths = []
+        for i in range(2):
+            fpath = os.path.join(tempfile.gettempdir(), f'vidtools_part_{i}.mp4')
+            self.vt.write_frames(make_motion_frames(n_frames=20), fpath)
+            fpaths.append(fpath)
+        self.assertTrue(FFmpeg.is_concat_compatible(fpaths))
+        concat_fpath = self.vt.concat_files(fpaths)
+        self.assertAlmostEqual(4, VideoFileClip(concat_fpath).duration, delta=0.2)
+        for fpath in fpaths + [concat_fpath]:
+            os.remove(fpath)
+
+    def test_plan_cuts(self):
+        """Overlapping files should be trimmed to where the previous one ends, and covered ones dropped"""
+        st = dt(2022, 8, 20, 12)
+        motion_files = [
+            {'fpath': 'b.mp4', 'start': st + timedelta(seconds=20), 'end': st + timedelta(seconds=50)},
+            {'fpath': 'a.mp4', 'start': st, 'end': st + timedelta(seconds=30)},
+            {'fpath': 'c.mp4', 'start': st + timedelta(seconds=35), 'end': st + timedelta(seconds=45)},
+            {'fpath': 'd.mp4', 'start': st + timedelta(seconds=60), 'end': st + timedelta(seconds=70)},
+        ]
+        self.assertEqual([('a.mp4', 0, None), ('b.mp4', 10, None), ('d.mp4', 0, None)],
+                         self.vt.plan_cuts(motion_files))
+
+    def test_draw_on_motion_from_cuts(self):
+        """The cut list should be processed as one clip, sped up in the same pass"""
+        fpaths = []
+        for i, motion_range in enumerate([(22, 38), (5, 20)]):
+            fpath = os.path.join(tempfile.gettempdir(), f'vidtools_cut_{i}.mp4')
+            self.vt.write_frames(make_motion_frames(n_frames=50, motion_ranges=(motion_range, )), fpath)
+            fpaths.append(fpath)
+        vt = VidTools(160, 90, fps=10, speed_x=2, resize_perc=1)
+        is_motion, fpath, duration = vt.draw_on_motion_from_cuts(
+            [(fpaths[0], 0, None), (fpaths[1], 1, None)], self.out_path, min_area=100, min_frames=5, buffer_s=0.5)
+        self.assertTrue(is_motion)
+        # Two sequences of ~2s (incl. buffer), at double speed
+        self.assertGreaterEqual(duration, 1.2)
+        self.assertLessEqual(duration, 2.5)
+        # A budget is planned ahead of the single encode, speeding up further to fit the duration budget
+        cuts = [(fpaths[0], 0, None), (fpaths[1], 1, None)]
+        is_motion, fpath, duration = vt.draw_on_motion_from_cuts(
+            cuts, self.out_path, min_area=100, min_frames=5, buffer_s=0.5, max_bytes=8000, max_duration_s=2)
+        self.assertTrue(is_motion)
+        self.assertLessEqual(os.path.getsize(fpath), 8000)
+        self.assertLessEqual(duration, 1.2)
+        for fpath in fpaths:
+            os.remove(fpath)
+
+    def test_summarize_motion(self):
+        """Each motion sequence should get one tile with its peak frame, and the GIF a few frames of each"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_summary.mp4')
+        self.vt.write_frames(make_motion_frames(n_frames=95, motion_ranges=((5, 30), (50, 80))), fpath)
+        sheet_fpath = os.path.join(tempfile.gettempdir(), 'vidtools_summary.jpg')
+        gif_fpath = os.path.join(tempfile.gettempdir(), 'vidtools_summary.gif')
+        vt = VidTools(160, 90, fps=10)
+        vt.index_dir = tempfile.mkdtemp()
+        sheet, gif = vt.summarize_motion([(fpath, 0, None)], sheet_fpath, gif_fpath=gif_fpath, min_area=100,
+                                         min_frames=5, buffer_s=0.5, tile_w=80, gif_frames=3)
+        self.assertEqual((sheet_fpath, gif_fpath), (sheet, gif))
+        # Two tiles side by side
+        self.assertEqual((45, 160, 3), cv2.imread(sheet).shape)
+        with Image.open(gif) as img:
+            self.assertEqual(6, img.n_frames)
+        # Limited to the tile with the most motion, and to the cut's range
+        vt.summarize_motion([(fpath, 0, None)], sheet_fpath, min_area=100, min_frames=5, tile_w=80, max_tiles=1)
+        self.assertEqual((45, 80, 3), cv2.imread(sheet_fpath).shape)
+        self.assertEqual((None, None), vt.summarize_motion([(fpath, 8.5, None)], sheet_fpath, min_area=100,
+                                                           min_frames=5))
+        shutil.rmtree(vt.index_dir)
+        for path in [fpath, sheet_fpath, gif_fpath]:
+            os.remove(path)
+
+    def test_motion_index_reuse(self):
+        """Re-running with another min_area or buffer_s should reuse the index, while detector settings get their own"""
+        src_fpath = os.path.join(tempfile.gettempdir(), 'vidtools_index_src.mp4')
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_index.mp4')
+        # A small block slides across the top during frames 5-30, then the usual larger block during 50-80
+        frames = make_motion_frames(n_frames=95, motion_ranges=((50, 80), ))
+        for i in range(5, 30):
+            x = int((i - 5) / 25 * 140)
+            frames[i][10:22, x:x + 12] = 240
+        vt = VidTools(160, 90, fps=10)
+        vt.index_dir = tempfile.mkdtemp()
+        vt.write_frames(frames, src_fpath)
+
+        def _draw(**kwargs):
+            # The output replaces the file, so each run starts from a fresh copy of the source
+            shutil.copy(src_fpath, fpath)
+            return vt.draw_on_motion(fpath, min_frames=5, use_index=True, **kwargs)
+
+        both = _draw(min_area=100, buffer_s=0.5)
+        self.assertTrue(both[0])
+        index_path = vt._get_index_path(src_fpath, min_area=100)
+        self.assertEqual([os.path.basename(index_path)], os.listdir(vt.index_dir))
+        with patch.object(VidTools, '_iter_motion_regions', side_effect=AssertionError('Analyzed again')):
+            # Only the larger block's boxes clear the higher min_area
+            large_only = _draw(min_area=500, buffer_s=0.5)
+            self.assertTrue(large_only[0])
+            self.assertLess(large_only[2], both[2] - 2)
+            # A longer buffer adds post-roll to each sequence
+            buffered = _draw(min_area=100, buffer_s=1.5)
+            self.assertGreater(buffered[2], both[2])
+            self.assertEqual(1, len(os.listdir(vt.index_dir)))
+            # Detector settings are part of the key, so they need an index of their own
+            for settings in [{'threshold': 40}, {'ref_frame_turnover': 10}]:
+                self.assertNotEqual(index_path, vt._get_index_path(src_fpath, min_area=100, **settings))
+                with self.assertRaises(AssertionError):
+                    vt.get_motion_index(src_fpath, min_area=100, **settings)
+        shutil.rmtree(vt.index_dir)
+        for path in [src_fpath, fpath]:
+            os.remove(path)
+
+    def test_decode_backends(self):
+        """Both decoders should give the same frames, and the OpenCV one should honor skip and reuse its buffer"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_decode.mp4')
+        VidTools(160, 90, fps=10, crf=0).write_frames(make_motion_frames(n_frames=30), fpath)
+        moviepy_frames = [frame.copy() for frame in VidTools(fps=10).read_frames(fpath)[0]]
+        reader = VideoCaptureReader(fpath)
+        self.assertEqual((160, 90), reader.size)
+        cv2_frames = [frame.copy() for frame in reader]
+        self.assertEqual(len(moviepy_frames), len(cv2_frames))
+        self.assertLess(np.abs(moviepy_frames[25].astype(int) - cv2_frames[25]).mean(), 2)
+        buffers = {id(frame) for frame in VideoCaptureReader(fpath, reuse_buffer=True)}
+        self.assertEqual(1, len(buffers))
+        frames, fps = VidTools(decode_backend=DecodeBackend.OPENCV, decode_skip=3).read_frames(fpath, t_start=1)
+        self.assertEqual(10 / 3, fps)
+        self.assertEqual(7, len(list(frames)))
+        # moviepy's ffmpeg reader is closed once the frames run out or the iterator is dropped
+        with patch.object(VideoFileClip, 'close', autospec=True, side_effect=VideoFileClip.close) as close:
+            frames, fps = VidTools(fps=10).read_frames(fpath, t_start=1)
+            self.assertEqual(10, fps)
+            self.assertEqual(0, close.call_count)
+            self.assertEqual(20, len(list(frames)))
+            self.assertEqual(1, close.call_count)
+            frames, _ = VidTools(fps=10).read_frames(fpath)
+            next(frames)
+            frames.close()
+            self.assertEqual(2, close.call_count)
+        os.remove(fpath)
+
+    def test_streaming_opencv_backend(self):
+        """Streaming from a file should give the same result with either decoder"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_decode_src.mp4')
+        results = []
+        for backend in [DecodeBackend.MOVIEPY, DecodeBackend.OPENCV]:
+            self.vt.write_frames(make_motion_frames(motion_ranges=((22, 38), )), fpath)
+            vt = VidTools(160, 90, fps=10, decode_backend=backend)
+            results.append(vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True))
+        self.assertTrue(results[0][0])
+        self.assertEqual(results[0], results[1])
+        os.remove(fpath)
+
+    def test_write_frames(self):
+        """Frames from a generator should be streamed to the encoder with the instance's settings"""
+        vt = VidTools(160, 90, fps=10, preset='ultrafast', crf=30, threads=1)
+        vt.write_frames((frame for frame in make_motion_frames(n_frames=30)), self.out_path)
+        clip = VideoFileClip(self.out_path)
+        self.assertEqual([160, 90], list(clip.size))
+        self.assertAlmostEqual(3, clip.duration, delta=0.15)
+
+    def test_frame_sink_rejects_mismatched_frames(self):
+        """Frames that don't match the sink's size should be refused rather than garbling the output"""
+        with FrameSink(self.out_path, size=(160, 90), fps=10) as sink:
+            sink.write(make_motion_frames(n_frames=1)[0])
+            with self.assertRaises(ValueError):
+                sink.write(np.zeros((100, 100, 3), dtype=np.uint8))
+        self.assertEqual(1, sink.n_frames)
+
+    def test_draw_on_motion(self):
+        """The in-memory path should keep the motion sequence plus buffer_s after it"""
+        frames = make_motion_frames(motion_ranges=((22, 38), ))
+        is_motion, fpath, duration = self.vt.draw_on_motion(self.out_path, frames=frames, min_area=100,
+                                                            min_frames=5, buffer_s=1)
+        self.assertTrue(is_motion)
+        self.assertAlmostEqual(duration, VideoFileClip(fpath).duration, delta=0.15)
+        self.assertGreaterEqual(duration, 2)
+        self.assertLessEqual(duration, 3.1)
+
+    def test_keyframe_triage(self):
+        """Only the GOPs around the change should be flagged, and analyzing just those should keep the same motion"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_triage.mp4')
+        frames = make_motion_frames(n_frames=300, motion_ranges=((150, 175), ))
+        with FrameSink(fpath, size=(160, 90), fps=10, keyint=20) as sink:
+            for frame in frames:
+                sink.write(frame)
+        keyframes = list(FFmpeg.iter_keyframes(fpath))
+        self.assertEqual([2 * i for i in range(15)], [round(t) for t, _ in keyframes])
+        # The block shows from 15s to 17.5s, so the keyframe at 16s differs from those at 14s and 18s
+        ranges = self.vt.find_changed_gops(fpath, min_area=100)
+        self.assertEqual([(12, 20)], [(round(st), round(end)) for st, end in ranges])
+
+        full = self.vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True)
+        with FrameSink(fpath, size=(160, 90), fps=10, keyint=20) as sink:
+            for frame in frames:
+                sink.write(frame)
+        triaged = self.vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, keyframe_triage=True)
+        self.assertTrue(triaged[0])
+        self.assertAlmostEqual(full[2], triaged[2], delta=0.15)
+        os.remove(fpath)
+
+    def test_keyframe_triage_separate_ranges(self):
+        """Motion in GOP ranges far apart should each keep their own pre-/post-roll and be joined into one clip"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_triage_ranges.mp4')
+        frames = make_motion_frames(n_frames=400, motion_ranges=((60, 75), (300, 315)))
+
+        def _write_source():
+            with FrameSink(fpath, size=(160, 90), fps=10, keyint=20) as sink:
+                for frame in frames:
+                    sink.write(frame)
+
+        _write_source()
+        self.assertEqual(2, len(self.vt.find_changed_gops(fpath, min_area=100)))
+        full = self.vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True)
+        _write_source()
+        triaged = self.vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, keyframe_triage=True)
+        self.assertTrue(triaged[0])
+        self.assertAlmostEqual(full[2], triaged[2], delta=0.25)
+        self.assertAlmostEqual(triaged[2], VideoFileClip(fpath).duration, delta=0.25)
+        self.assertFalse(any(f.startswith('triage_') for f in os.listdir(self.vt.temp_dir)))
+        os.remove(fpath)
+
+    def test_fit_to_budget(self):
+        """Clips should be scaled down, compressed and sped up to fit the budget, and no further than needed"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_budget_src.mp4')
+        rng = np.random.default_rng(0)
+        # Noise doesn't compress, so the budget can only be met by giving up resolution or quality
+        frames = [(rng.random((180, 320, 3)) * 255).astype(np.uint8) for _ in range(100)]
+        VidTools(fps=10, preset='ultrafast').write_frames(frames, fpath)
+        vt = VidTools(fps=10, preset='ultrafast')
+        src_bytes = os.path.getsize(fpath)
+        out_fpath, settings = vt.fit_to_budget(fpath, max_bytes=src_bytes // 8, max_duration_s=5)
+        self.assertLessEqual(os.path.getsize(out_fpath), src_bytes // 8)
+        self.assertEqual(2, settings['speed'])
+        self.assertAlmostEqual(5, FFmpeg.duration(out_fpath), delta=0.3)
+        self.assertTrue(settings['scale'] < 1 or settings['crf'] > vt.crf)
+        # A generous budget keeps the full resolution and spends it on quality
+        out_fpath, settings = vt.fit_to_budget(fpath, max_bytes=src_bytes * 4)
+        self.assertEqual((1, 1), (settings['scale'], settings['speed']))
+        self.assertLessEqual(settings['crf'], vt.crf)
+        # Past the highest CRF the clip is sped up further
+        out_fpath, settings = vt.fit_to_budget(fpath, max_bytes=src_bytes // 200)
+        self.assertLessEqual(os.path.getsize(out_fpath), src_bytes // 200)
+        self.assertEqual(VidTools.BUDGET_CRF_RANGE[1], settings['crf'])
+        self.assertGreater(settings['speed'], 1)
+        # A budget below what even a single frame takes can't be met. It's returned as is with a warning.
+        warnings = []
+        handler = logger.add(warnings.append, level='WARNING')
+        try:
+            out_fpath, settings = vt.fit_to_budget(fpath, max_bytes=2000)
+        finally:
+            logger.remove(handler)
+        self.assertEqual(VidTools.BUDGET_CRF_RANGE[1], settings['crf'])
+        self.assertGreater(os.path.getsize(out_fpath), 2000)
+        self.assertEqual(1, len(warnings))
+        for path in [fpath, out_fpath]:
+            os.remove(path)
+
+    def test_draw_on_motion_parallel_segments(self):
+        """Disjoint sequences encoded in parallel and joined should give the same clip as a single encode"""
+        frames = make_motion_frames(n_frames=150, motion_ranges=((10, 30), (60, 80), (110, 130)))
+        results = []
+        for workers in [1, 3]:
+            vt = VidTools(160, 90, fps=10, workers=workers)
+            is_motion, fpath, duration = vt.draw_on_motion(self.out_path, frames=[f.copy() for f in frames],
+                                                           min_area=100, min_frames=5, buffer_s=1)
+            self.assertTrue(is_motion)
+            clip = VideoFileClip(fpath)
+            results.append((duration, sum(1 for _ in clip.iter_frames())))
+            clip.close()
+        self.assertEqual(results[0], results[1])
+        self.assertAlmostEqual(results[0][0], results[0][1] / 10, delta=0.15)
+
+
+class TestMotionIndex(unittest.TestCase):
+    """Test suite for MotionIndex"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        frames = make_motion_frames(n_frames=60, motion_ranges=((5, 20), (40, 50)))
+        detector = DiffMotionDetector(min_area=50, ref_frame_turnover=100)
+        cls.regions = [detector.detect_regions(frame) for frame in frames]
+        cls.index = MotionIndex.from_regions(cls.regions, fps=10, min_area=50)
+
+    def test_motion_flags(self):
+        """Flags at or above the floor should match what a detector at that min_area finds"""
+        expected = [any(area >= 500 for area in areas) for _, areas in self.regions]
+        self.assertEqual(expected, self.index.motion_flags(500).tolist())
+        with self.assertRaises(ValueError):
+            self.index.motion_flags(10)
+
+    def test_summary(self):
+        """The per-frame summary should hold the area, count and union of each frame's boxes"""
+        for i, (boxes, areas) in enumerate(self.regions):
+            row = self.index.summary[i]
+            self.assertEqual(len(boxes), row[MotionIndex.COUNT])
+            self.assertAlmostEqual(sum(areas), row[MotionIndex.AREA], places=0)
+            if len(boxes) > 0:
+                self.assertEqual(min(x for x, _, _, _ in boxes), row[MotionIndex.X0])
+                self.assertEqual(max(y + h for _, y, _, h in boxes), row[MotionIndex.Y1])
+
+    def test_save_load(self):
+        """Indexes should survive a round trip to disk"""
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_test_index.npz')
+        self.index.save(fpath)
+        loaded = MotionIndex.load(fpath)
+        os.remove(fpath)
+        self.assertEqual(self.index.n_frames, loaded.n_frames)
+        self.assertTrue(np.array_equal(self.index.summary, loaded.summary))
+        self.assertEqual(self.index.get_boxes(10), loaded.get_boxes(10))
+
+
+class TestMotionResultCache(unittest.TestCase):
+    """Test suite for MotionResultCache"""
+
+    def setUp(self) -> None:
+        self.cache = MotionResultCache(os.path.join(tempfile.gettempdir(), 'vidtools_test_cache'))
+        self.cache.clear()
+        self.clip_path = os.path.join(tempfile.gettempdir(), 'vidtools_cache_clip.mp4')
+        with open(self.clip_path, 'wb') as f:
+            f.write(b'0' * 1000)
+
+    def tearDown(self) -> None:
+        self.cache.clear()
+        if os.path.exists(self.clip_path):
+            os.remove(self.clip_path)
+
+    def test_get_put(self):
+        """Verdicts should round trip, with clips copied back out to the requested path"""
+        out_path = os.path.join(tempfile.gettempdir(), 'vidtools_cache_out.mp4')
+        self.assertIsNone(self.cache.get('a', out_path))
+        self.cache.put('a', True, self.clip_path, 12.5)
+        self.cache.put('b', False)
+        self.assertEqual((True, out_path, 12.5), self.cache.get('a', out_path))
+        self.assertEqual(1000, os.path.getsize(out_path))
+        self.assertEqual((False, None, None), self.cache.get('b', out_path))
+        os.remove(out_path)
+
+    def test_lru_eviction(self):
+        """The least recently used entries should go first once the cache is over its size"""
+        self.cache.max_bytes = 2500
+        out_path = os.path.join(tempfile.gettempdir(), 'vidtools_cache_out.mp4')
+        for i, key in enumerate(['a', 'b']):
+            self.cache.put(key, True, self.clip_path, 1)
+            os.utime(self.cache._entry_paths(key)[0], (i, i))
+        # Using 'a' makes 'b' the oldest
+        self.cache.get('a', out_path)
+        self.cache.put('c', True, self.clip_path, 1)
+        self.assertIsNone(self.cache.get('b', out_path))
+        self.assertIsNotNone(self.cache.get('a', out_path))
+        self.assertIsNotNone(self.cache.get('c', out_path))
+        self.assertLessEqual(self.cache.total_bytes, 2500)
+        os.remove(out_path)
+
+    def test_draw_on_motion_cached(self):
+        """Re-running draw_on_motion on the same footage should come from the cache without rendering"""
+        vt = VidTools(160, 90, fps=10, result_cache=self.cache)
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_cached.mp4')
+        frames = make_motion_frames(motion_ranges=((22, 38), ))
+        vt.write_frames(frames, fpath)
+        first = vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True)
+        self.assertTrue(first[0])
+        # The output replaced the source, so bring the source back
+        vt.write_frames(frames, fpath)
+
+        def _fail(*args, **kwargs):
+            raise AssertionError('Rendered again')
+
+        vt._draw_on_motion = _fail
+        self.assertEqual(first, vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True))
+        with self.assertRaises(AssertionError):
+            # Different settings aren't a hit
+            vt.draw_on_motion(fpath, min_area=200, min_frames=5, buffer_s=1, streaming=True)
+        os.remove(fpath)
+
+    def test_cached_before_calibration(self):
+        """Cached results should be found without decoding frames to calibrate the threshold from"""
+        calibration = ThresholdCalibration('test-cam', calibration_dir=tempfile.mkdtemp(), threshold_range=(5, 60))
+        vt = VidTools(160, 90, fps=10, result_cache=self.cache, threshold_calibration=calibration)
+        fpath = os.path.join(tempfile.gettempdir(), 'vidtools_cached_calibration.mp4')
+        frames = make_motion_frames(motion_ranges=((22, 38), ))
+        vt.write_frames(frames, fpath)
+        first = vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True)
+        self.assertTrue(first[0])
+        self.assertIsNotNone(calibration.get())
+        vt.write_frames(frames, fpath)
+        # Even with the hour's calibration gone, nothing is decoded on a hit
+        os.remove(calibration.fpath)
+        with patch.object(vt, 'read_frames', side_effect=AssertionError('Decoded')):
+            self.assertEqual(first, vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True))
+            with self.assertRaises(AssertionError):
+                # Other hours are calibrated separately, so they aren't a hit
+                vt.draw_on_motion(fpath, min_area=100, min_frames=5, buffer_s=1, streaming=True,
+                                  when=dt.now() + timedelta(hours=12))
+        shutil.rmtree(calibration.calibration_dir)
+        os.remove(fpath)
+
+
+class TestDiffMotionDetector(unittest.TestCase):
+    """Test suite for DiffMotionDetector"""
+
+    def test_reference_turnover(self):
+        """The preprocessed reference should only change on turnover frames"""
+        frames = make_motion_frames(n_frames=30, motion_ranges=((5, 30), ))
+        detector = DiffMotionDetector(min_area=100, ref_frame_turnover=10)
+        refs = []
+        for frame in frames:
+            detector.detect(frame)
+            refs.append(detector.ref_gray)
+        self.assertTrue(all(x is refs[0] for x in refs[:10]))
+        self.assertIsNot(refs[9], refs[10])
+        self.assertTrue(all(x is refs[10] for x in refs[10:20]))
+
+    def test_detect_matches_stateless(self):
+        """Boxes found with the cached reference should match the stateless path"""
+        frames = make_motion_frames(n_frames=30, motion_ranges=((5, 30), ))
+        detector = DiffMotionDetector(min_area=100, ref_frame_turnover=10)
+        vt = VidTools()
+        ref_frame = frames[0]
+        for i, frame in enumerate(frames):
+            rects, _, _ = vt._detect_contours(ref_frame, frame.copy(), min_area=100)
+            self.assertEqual(rects, len(detector.detect(frame)))
+            if i > 0 and i % 10 == 0:
+                ref_frame = frame
+
+    def test_proxy_detection(self):
+        """Detecting on a downscaled proxy should flag the same frames, with boxes in full-res coordinates"""
+        frames = make_motion_frames(n_frames=20, motion_ranges=((5, 20), ), w=640, h=360)
+        full = DiffMotionDetector(min_area=100)
+        proxy = DiffMotionDetector(min_area=100, scale=0.25)
+        for frame in frames:
+            full_boxes = full.detect(frame)
+            proxy_boxes = proxy.detect(frame)
+            self.assertEqual(len(full_boxes) > 0, len(proxy_boxes) > 0)
+            for (fx, fy, fw, fh), (px, py, pw, ph) in zip(sorted(full_boxes), sorted(proxy_boxes)):
+                # Proxy boxes are a bit looser due to dilation at the lower resolution
+                self.assertLessEqual(abs(fx - px), 16)
+                self.assertLessEqual(abs(fy - py), 16)
+        with self.assertRaises(ValueError):
+            DiffMotionDetector(scale=2)
+
+    def test_region_backends(self):
+        """Connected components should find the same regions as contours, with pixel-count areas"""
+        mask = np.zeros((90, 160), dtype=np.uint8)
+        mask[10:40, 20:60] = 255
+        mask[50:80, 100:150] = 255
+        # Specks below min_area
+        mask[5:8, 150:153] = 255
+        mask[85:88, 5:8] = 255
+        cnt_boxes, cnt_areas = DiffMotionDetector.contour_regions(mask, 100)
+        cc_boxes, cc_areas = DiffMotionDetector.component_regions(mask, 100)
+        self.assertEqual(sorted(cnt_boxes), sorted(cc_boxes))
+        self.assertEqual([1200, 1500], sorted(cc_areas))
+        self.assertTrue(all(cc > cnt for cc, cnt in zip(sorted(cc_areas), sorted(cnt_areas))))
+
+        frames = make_motion_frames(n_frames=40, motion_ranges=((5, 35), ))
+        contours = DiffMotionDetector(min_area=100, scale=0.5)
+        components = DiffMotionDetector(min_area=100, scale=0.5, region_backend=RegionBackend.COMPONENTS)
+        for frame in frames:
+            self.assertEqual(sorted(contours.detect(frame)), sorted(components.detect(frame)))
+        with self.assertRaises(ValueError):
+            DiffMotionDetector(region_backend='blobs')
+
+    def test_block_prefilter(self):
+        """Static frames should be skipped without changing what's detected on the others"""
+        frames = make_motion_frames(n_frames=60, motion_ranges=((20, 40), ))
+        for detector_class in [DiffMotionDetector, RunningAverageMotionDetector]:
+            full = detector_class(min_area=100)
+            prefiltered = detector_class(min_area=100, prefilter_block=8)
+            for frame in frames:
+                self.assertEqual(full.detect(frame), prefiltered.detect(frame))
+            self.assertEqual(0, full.prefilter_rate)
+            self.assertGreater(prefiltered.prefilter_rate, 0.3)
+            prefiltered.reset()
+            self.assertEqual((0, 0), (prefiltered.n_frames, prefiltered.n_prefiltered))
+        # VidTools reports the share skipped, both scanning every frame and with a stride
+        messages = []
+        handler = logger.add(messages.append, level='INFO', format='{message}')
+        try:
+            vt = VidTools(160, 90, fps=10, prefilter_block=8)
+            for stride in [1, 5]:
+                list(vt._iter_motion_boxes(frames, min_area=100, stride=stride))
+        finally:
+            logger.remove(handler)
+        self.assertEqual(2, len(messages))
+        self.assertTrue(messages[0].startswith('Prefilter skipped '))
+        self.assertIn(' of 60 frames', messages[0])
+
+
+class TestMotionZones(unittest.TestCase):
+    """Test suite for MotionZones"""
+
+    def test_mask_and_roi(self):
+        """Exclude zones should be cut out of include zones, and the roi should bound what's left"""
+        zones = MotionZones(include=[[(0, 0), (0.5, 0), (0.5, 1), (0, 1)]],
+                            exclude=[[(0, 0), (0.25, 0), (0.25, 1), (0, 1)]])
+        mask = zones.mask((90, 160))
+        self.assertEqual(0, mask[45, 10])
+        self.assertEqual(255, mask[45, 60])
+        self.assertEqual(0, mask[45, 120])
+        x, y, w, h = zones.roi((90, 160))
+        self.assertAlmostEqual(40, x, delta=1)
+        self.assertAlmostEqual(40, w, delta=2)
+        self.assertEqual((0, 90), (y, h))
+
+    def test_detection_in_zones(self):
+        """Only motion within the zones should be detected, with boxes in full-frame coordinates"""
+        frames = make_motion_frames(n_frames=40, motion_ranges=((5, 40), ))
+        right_half = [[(0.5, 0), (1, 0), (1, 1), (0.5, 1)]]
+        # The block slides left to right, reaching the right half around frame 22
+        for zones, expected in [(MotionZones(include=right_half), range(24, 40)),
+                                (MotionZones(exclude=right_half), range(5, 20))]:
+            detector = DiffMotionDetector(min_area=100, ref_frame_turnover=1000, zones=zones)
+            whole = DiffMotionDetector(min_area=100, ref_frame_turnover=1000)
+            for i, frame in enumerate(frames):
+                boxes = detector.detect(frame)
+                whole_boxes = whole.detect(frame)
+                if i in expected:
+                    self.assertGreater(len(boxes), 0)
+                for x, y, w, h in boxes:
+                    mask = zones.mask(frame.shape)
+                    self.assertTrue(mask[y:y + h, x:x + w].any())
+                    # Cropping changes the blur at the crop's edges a little, but the box should line up
+                    self.assertLessEqual(min(abs(y - box[1]) for box in whole_boxes), 3)
+
+    def test_all_excluded(self):
+        """Excluding the whole frame shouldn't fail, just find nothing"""
+        zones = MotionZones(exclude=[[(0, 0), (1, 0), (1, 1), (0, 1)]])
+        detector = DiffMotionDetector(min_area=100, zones=zones)
+        self.assertEqual([], [detector.detect(frame) for frame in make_motion_frames(n_frames=30)
+                              if len(detector.detect(frame)) > 0])
+
+    def test_save_load(self):
+        zones = MotionZones(include=[[(0.1, 0.1), (0.9, 0.1), (0.5, 0.9)]])
+        fpath = os.path.join(tempfile.gettempdir(), 'motion_zones_test.json')
+        zones.save(fpath)
+        self.assertEqual(zones.to_dict(), MotionZones.load(fpath).to_dict())
+        os.remove(fpath)
+        self.assertIsNone(MotionZones.for_camera('not-a-camera', zone_dir=tempfile.gettempdir()))
+
+
+class TestMotionHeatmap(unittest.TestCase):
+    """Test suite for MotionHeatmap"""
+
+    def setUp(self) -> None:
+        self.heatmap_dir = tempfile.mkdtemp()
+        self.heatmap = MotionHeatmap('test-cam', heatmap_dir=self.heatmap_dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.heatmap_dir)
+
+    def test_accumulates_motion(self):
+        """Counts should build up where the block moved and nowhere else, including through VidTools"""
+        frames = make_motion_frames(motion_ranges=((20, 60), ))
+        vt = VidTools(160, 90, fps=10, motion_heatmap=self.heatmap)
+        boxes = [b for _, b in vt._iter_motion_boxes(frames, min_area=100)]
+        self.assertTrue(any(len(b) > 0 for b in boxes))
+        counts = self.heatmap.counts
+        self.assertEqual((90, 160), counts.shape)
+        self.assertEqual(np.float32, counts.dtype)
+        self.assertGreater(counts[40:50].sum(), 0)
+        self.assertEqual(0, counts[:15].sum())
+
+    def test_stride_matches_exhaustive(self):
+        """A coarse-to-fine scan should count each moving frame once, the same as an exhaustive scan"""
+        frames = make_motion_frames(motion_ranges=((20, 60), ))
+        totals = []
+        for stride in [1, 5]:
+            heatmap = MotionHeatmap('test-cam', heatmap_dir=self.heatmap_dir)
+            vt = VidTools(160, 90, fps=10, motion_heatmap=heatmap)
+            list(vt._iter_motion_boxes(frames, min_area=100, ref_frame_turnover=4, stride=stride))
+            totals.append(heatmap.counts)
+        self.assertGreater(totals[0].sum(), 0)
+        self.assertTrue(np.array_equal(totals[0], totals[1]))
+
+    def test_zone_crop_offset(self):
+        """Masks found on a zone crop should be counted at their place in the frame"""
+        self.heatmap.add(np.full((10, 20), 255, dtype=np.uint8), offset=(30, 40), shape=(90, 160))
+        self.assertEqual(200, self.heatmap.counts.sum())
+        self.assertEqual(200, self.heatmap.counts[40:50, 30:50].sum())
+
+    def test_save_merges_by_day(self):
+        """Saving should add to the day's map on disk and start over"""
+        day = dt(2022, 8, 20).date()
+        for _ in range(2):
+            self.heatmap.add(np.full((90, 160), 255, dtype=np.uint8))
+            fpath = self.heatmap.save(day)
+        self.assertTrue(fpath.endswith(os.path.join('test-cam', '2022-08-20.npy')))
+        self.assertIsNone(self.heatmap.counts)
+        self.assertIsNone(self.heatmap.save(day))
+        self.assertTrue(np.all(self.heatmap.load(day) == 2))
+        self.assertIsNone(self.heatmap.load(dt(2022, 8, 21).date()))
+
+    def test_render(self):
+        """The overlay should match the background's size and leave areas without motion untouched"""
+        counts = np.zeros((90, 160), dtype=np.float32)
+        counts[40:50, 30:50] = 5
+        background = make_motion_frames(n_frames=1)[0]
+        overlay = MotionHeatmap.render(counts, background=np.repeat(np.repeat(background, 2, 0), 2, 1))
+        self.assertEqual((180, 320, 3), overlay.shape)
+        self.assertTrue(np.array_equal(overlay[:40], np.repeat(np.repeat(background, 2, 0), 2, 1)[:40]))
+        self.assertEqual((90, 160, 3), MotionHeatmap.render(counts).shape)
+
+
+def make_noisy_frames(noise: float, n_frames: int = 30, w: int = 160, h: int = 90) -> list:
+    """Builds a static scene with gaussian sensor noise and flickering exposure (as with IR night footage)"""
+    rng = np.random.default_rng(0)
+    background = (rng.random((h, w, 3)) * 60 + 80)
+    return [np.clip(background + rng.normal(0, noise, (h, w, 3)) + rng.normal(0, noise), 0, 255).astype(np.uint8)
+            for _ in range(n_frames)]
+
+
+class TestThresholdCalibration(unittest.TestCase):
+    """Test suite for ThresholdCalibration"""
+
+    def setUp(self) -> None:
+        self.calibration_dir = tempfile.mkdtemp()
+        self.calibration = ThresholdCalibration('test-cam', calibration_dir=self.calibration_dir,
+                                                threshold_range=(5, 60))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.calibration_dir)
+
+    def test_noise_floor(self):
+        """Noisier footage should give a higher noise floor and threshold, within the allowed range"""
+        floors = []
+        for noise in [1, 8]:
+            grays = [MotionDetector.grayscale_frame(frame) for frame in make_noisy_frames(noise)]
+            floors.append(ThresholdCalibration.noise_floor(grays))
+        self.assertLess(floors[0], floors[1])
+        self.assertLess(self.calibration.threshold_for(floors[0]), self.calibration.threshold_for(floors[1]))
+        self.assertEqual(60, self.calibration.threshold_for(100))
+        self.assertEqual(5, self.calibration.threshold_for(0))
+        self.assertIsNone(ThresholdCalibration.noise_floor(grays[:1]))
+
+    def test_cached_per_hour(self):
+        """Calibrations should be kept per hour and redone once they're too old"""
+        night, day = dt(2022, 8, 20, 2), dt(2022, 8, 20, 14)
+        grays = [MotionDetector.grayscale_frame(frame) for frame in make_noisy_frames(8)]
+        threshold = self.calibration.calibrate(grays, when=night)
+        self.assertEqual(threshold, self.calibration.get(night))
+        self.assertEqual(threshold, self.calibration.get(night + timedelta(days=3)))
+        self.assertIsNone(self.calibration.get(day))
+        stale = ThresholdCalibration('test-cam', calibration_dir=self.calibration_dir, max_age_days=0)
+        self.assertIsNone(stale.get(night))
+
+    def test_vidtools_calibration(self):
+        """VidTools should calibrate from the first frames, putting back any it takes from an iterator"""
+        vt = VidTools(160, 90, fps=10, threshold_calibration=self.calibration)
+        frames = make_noisy_frames(8, n_frames=50)
+        threshold, same_frames = vt._calibrate_threshold(25, frames=frames)
+        self.assertIs(frames, same_frames)
+        self.assertEqual(threshold, self.calibration.get())
+        # Cached for the hour
+        self.calibration.threshold_range = (50, 60)
+        self.assertEqual((threshold, None), vt._calibrate_threshold(25, frames=None, fpath='cached.mp4'))
+        os.remove(self.calibration.fpath)
+        threshold, chained = vt._calibrate_threshold(25, frames=iter(frames))
+        self.assertGreaterEqual(threshold, 50)
+        self.assertEqual(50, len(list(chained)))
+        # Clips are calibrated for the hour they were taken, not the hour they're processed
+        os.remove(self.calibration.fpath)
+        night = dt(2022, 8, 20, (dt.now().hour + 12) % 24)
+        threshold, _ = vt._calibrate_threshold(25, frames=frames, when=night)
+        self.assertEqual(threshold, self.calibration.get(night))
+        self.assertIsNone(self.calibration.get())
+        # Uncalibrated engines and instances keep the threshold they're given
+        self.assertEqual(25, VidTools(fps=10)._calibrate_threshold(25, frames=frames)[0])
+        mog_vt = VidTools(fps=10, motion_engine=MotionEngine.MOG2, threshold_calibration=self.calibration)
+        self.assertEqual(25, mog_vt._calibrate_threshold(25, frames=frames)[0])
+
+
+class TestContourSignatureStore(unittest.TestCase):
+    """Test suite for ContourSignatureStore"""
+
+    @staticmethod
+    def random_contours(n: int, seed: int = 0) -> list:
+        rng = np.random.default_rng(seed)
+        return [cv2.convexHull((rng.random((8, 2)) * 100 + rng.random(2) * 400).astype(np.int32)) for _ in range(n)]
+
+    def test_matches_match_shapes(self):
+        """Distances should be those cv2.matchShapes (method 1) gives, to the closest stored contour nearby"""
+        contours = self.random_contours(30)
+        store = ContourSignatureStore(cell_size=1000)
+        for cnt in contours[:20]:
+            store.add(cnt)
+        for cnt in contours[20:]:
+            expected = min(cv2.matchShapes(cnt, stored, 1, 0.0) for stored in contours[:20])
+            self.assertAlmostEqual(expected, store.nearest_distance(cnt), places=6)
+
+    def test_unique_and_eviction(self):
+        """Repeated shapes shouldn't be unique, and the store shouldn't grow past its cap"""
+        contours = self.random_contours(50, seed=1)
+        store = ContourSignatureStore(max_signatures=10)
+        self.assertTrue(store.add_if_unique(contours[0], contour_lim=0.01))
+        self.assertFalse(store.add_if_unique(contours[0], contour_lim=0.01))
+        for cnt in contours[1:]:
+            store.add(cnt)
+        self.assertEqual(10, len(store))
+        self.assertEqual(10, sum(len(slots) for slots in store.cells.values()))
+        # The first contour's been evicted, so it's new again
+        self.assertTrue(store.add_if_unique(contours[0], contour_lim=0.01))
+
+    def test_detect_contours_unique_only(self):
+        """A contour that's already been drawn shouldn't be drawn again in the following frame"""
+        vt = VidTools(160, 90)
+        frames = make_motion_frames(n_frames=25, motion_ranges=((5, 25), ))
+        rects, store, _ = vt._detect_contours(frames[0], frames[10], min_area=100, unique_only=True,
+                                              contour_lim=0.05)
+        self.assertEqual(1, rects)
+        rects, store, _ = vt._detect_contours(frames[0], frames[10], min_area=100, unique_only=True,
+                                              contour_lim=0.05, prev_contours=store)
+        self.assertEqual(0, rects)
+        self.assertEqual(1, len(store))
+
+
+class TestMotionEngines(unittest.TestCase):
+    """Test suite for the alternative motion engines"""
+
+    def test_running_average_has_no_reset_ghost(self):
+        """A block that's left the scene shouldn't keep flagging motion like a stale reference frame does"""
+        frames = make_motion_frames(n_frames=60, motion_ranges=((15, 25), ))
+        diff = DiffMotionDetector(min_area=100, ref_frame_turnover=20)
+        running = RunningAverageMotionDetector(min_area=100, alpha=0.2)
+        diff_flags = [len(diff.detect(frame)) > 0 for frame in frames]
+        running_flags = [len(running.detect(frame)) > 0 for frame in frames]
+        self.assertTrue(all(running_flags[16:25]))
+        # The diff engine's reference at frame 20 still holds the block until the next turnover
+        self.assertTrue(all(diff_flags[26:40]))
+        self.assertFalse(any(running_flags[40:]))
+
+    def test_background_subtractors(self):
+        """MOG2 and KNN should pick up the moving block once they've seen the background"""
+        frames = make_motion_frames(n_frames=60, motion_ranges=((40, 55), ))
+        for engine in [MotionEngine.MOG2, MotionEngine.KNN]:
+            detector = BackgroundSubtractorMotionDetector(min_area=100, engine=engine)
+            flags = [len(detector.detect(frame)) > 0 for frame in frames]
+            self.assertFalse(any(flags[5:40]), engine)
+            self.assertTrue(any(flags[40:55]), engine)
+        with self.assertRaises(ValueError):
+            BackgroundSubtractorMotionDetector(engine=MotionEngine.DIFF)
+
+    def test_engines_feed_draw_on_motion(self):
+        """Every engine should be selectable on VidTools and produce a clip"""
+        out_path = os.path.join(tempfile.gettempdir(), 'vidtools_engine_test.mp4')
+        for engine in [MotionEngine.DIFF, MotionEngine.RUNNING_AVG, MotionEngine.MOG2, MotionEngine.KNN]:
+            vt = VidTools(160, 90, fps=10, motion_engine=engine)
+            frames = make_motion_frames(n_frames=60, motion_ranges=((30, 50), ))
+            is_motion, _, _ = vt.draw_on_motion(out_path, frames=frames, min_area=100, min_frames=5,
+                                                streaming=True)
+            self.assertTrue(is_motion, engine)
+        os.remove(out_path)
+
+
+if __name__ == '__main__':
+    unittest.main()